@@ -29,6 +29,34 @@ module kb_cufflinks {
         string      report_ref;
     } CufflinksResult;
 
+	/*
+        incremental                 -   reuse Expression objects of the prior expression set
+                                        made from the same alignment version with the same
+                                        params, and only run cufflinks for new or changed
+                                        alignments (Optional)
+        previous_expression_set_ref -   KBaseSets.ExpressionSet to build on in incremental
+                                        mode; defaults to the existing set with the output
+                                        name (Optional)
+        shard_by_contig             -   run cufflinks on groups of contigs with similar read
+                                        counts in parallel and merge the results, for very
+                                        deep alignments (Optional)
+        num_shards                  -   number of contig groups in sharded mode; defaults to
+                                        num_threads (Optional)
+        max_bundle_frags            -   skip loci with more fragments than this (Optional)
+        max_bundle_length           -   skip loci longer than this (Optional)
+        no_effective_length_correction - do not correct for effective transcript length
+                                        (Optional)
+        frag_bias_correct           -   correct for fragment bias using the genome sequence
+                                        (Optional)
+        multi_read_correct          -   weight multi-mapped reads by their likely origin
+                                        (Optional)
+        library_type                -   fr-unstranded, fr-firststrand or fr-secondstrand
+                                        (Optional)
+        preset                      -   "fast": bundle limits and corrections tuned for run
+                                        time; explicitly given options still apply (Optional)
+        auto_tune_bundles           -   pick max_bundle_frags from the read depth of each BAM
+                                        unless it is given (Optional)
+	*/
 	typedef structure{
 		string workspace_name;
 		string alignment_object_ref;
@@ -41,19 +69,86 @@ module kb_cufflinks {
 		int min_intron_length;
 		int max_intron_length;
 		int overhang_tolerance;
+		boolean incremental;
+		obj_ref previous_expression_set_ref;
+		boolean shard_by_contig;
+		int num_shards;
+		int max_bundle_frags;
+		int max_bundle_length;
+		boolean no_effective_length_correction;
+		boolean frag_bias_correct;
+		boolean multi_read_correct;
+		string library_type;
+		string preset;
+		boolean auto_tune_bundles;
 	} CufflinksParams;
 
     async funcdef run_cufflinks(CufflinksParams params)
 		returns (CufflinksResult) authentication required;
 
+	/*
+        Input parameters for run_cufflinks_batch. Same as CufflinksParams, but takes a list
+        of alignment or alignment set objects that are quantified against the same genome.
+
+        alignment_object_refs       -   KBaseRNASeq.RNASeqAlignment, KBaseRNASeq.RNASeqAlignmentSet
+                                        or KBaseSets.ReadsAlignmentSet object references
+	*/
+	typedef structure{
+		string workspace_name;
+		list<string> alignment_object_refs;
+		string expression_set_suffix;
+		string expression_suffix;
+		string genome_ref;
+		int num_threads;
+		int min_intron_length;
+		int max_intron_length;
+		int overhang_tolerance;
+		boolean incremental;
+		boolean shard_by_contig;
+		int num_shards;
+		int max_bundle_frags;
+		int max_bundle_length;
+		boolean no_effective_length_correction;
+		boolean frag_bias_correct;
+		boolean multi_read_correct;
+		string library_type;
+		string preset;
+		boolean auto_tune_bundles;
+	} CufflinksBatchParams;
+
+	/*
+        results: one CufflinksResult (without report) per entry of alignment_object_refs
+        report_name: name of the combined report generated by KBaseReport
+        report_ref: reference of the combined report generated by KBaseReport
+	*/
+	typedef structure{
+		list<CufflinksResult> results;
+		string report_name;
+		string report_ref;
+	} CufflinksBatchResult;
+
+    async funcdef run_cufflinks_batch(CufflinksBatchParams params)
+		returns (CufflinksBatchResult) authentication required;
+
+    typedef structure{
+        string      condition1;
+        string      condition2;
+    } ConditionPair;
+
     /*
         Required input parameters for run_Cuffdiff.
 
         expressionset_ref           -   reference for an expressionset object
         workspace_name              -   workspace name to save the differential expression output object
         output_obj_name             -   name of the differential expression matrix set output object
-    */
 
+        quantify_once               -   run cuffquant once per sample and feed the cached .cxb
+                                        files to cuffdiff and cuffnorm
+        contrasts                   -   condition pairs to test; each runs as its own cuffdiff,
+                                        concurrently, instead of one run over all conditions.
+                                        q-values and significance are recomputed over the
+                                        tests of all pairs together, as one run corrects them
+    */
 	typedef structure{
         obj_ref     expressionset_ref;
         string      workspace_name;
@@ -63,6 +158,8 @@ module kb_cufflinks {
         boolean     multi_read_correct;     /* Optional */
         boolean     time_series;            /* Optional */
         int         min_alignment_count;    /* Optional */
+        boolean     quantify_once;          /* Optional */
+        list<ConditionPair> contrasts;      /* Optional */
 
     } CuffdiffInput;
 
@@ -0,0 +1,189 @@
+"""
+Staged alignment downloads shared by run_cufflinks and run_Cuffdiff.
+
+Each alignment object version is downloaded once into a cache entry keyed by its UPA.
+Callers hold a lease on the entries they use; leases are holder files named after the
+holding process, so entries in use (by any process on the host) are never evicted and
+leases of processes that died without releasing them do not pin entries forever. When
+the cache grows past its size bound the least recently used unheld entries are removed.
+
+LeasedCache is the same cache for any directory built from a key; the sorted BAM and
+cuffquant caches use it too.
+"""
+
+import os
+import errno
+import fcntl
+import shutil
+import uuid
+from contextlib import contextmanager
+
+from scratch_manager import parse_size, directory_size
+
+DEFAULT_CACHE_SIZE = '50G'
+HOLDERS_SUFFIX = '.holders'
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def release_lease(lease):
+    """
+    release_lease: drop a lease returned by LeasedCache.acquire
+    """
+    try:
+        os.remove(lease)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+class LeasedCache(object):
+    """
+    Size-bounded LRU cache of directories, keyed by strings such as object UPAs
+    """
+
+    def __init__(self, cache_directory, max_size=None, logger=None, label='entry'):
+        self.cache_directory = cache_directory
+        self.max_size = max_size
+        self.logger = logger
+        self.label = label
+        self.hits = 0
+        self.misses = 0
+
+    def _log(self, message):
+        if self.logger is not None:
+            self.logger.info(message)
+        else:
+            print(message)
+
+    @contextmanager
+    def _lock(self):
+        try:
+            os.makedirs(self.cache_directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with open(os.path.join(self.cache_directory, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _entry(self, key):
+        return os.path.join(self.cache_directory, key.replace('/', '_'))
+
+    def _add_holder(self, entry):
+        holders = entry + HOLDERS_SUFFIX
+        if not os.path.isdir(holders):
+            os.makedirs(holders)
+        lease = os.path.join(holders, '{}.{}'.format(os.getpid(), uuid.uuid4()))
+        open(lease, 'w').close()
+        # entry mtime is the LRU clock
+        os.utime(entry, None)
+        return lease
+
+    def _live_holders(self, entry):
+        holders = entry + HOLDERS_SUFFIX
+        if not os.path.isdir(holders):
+            return []
+        live = list()
+        for name in os.listdir(holders):
+            if _process_alive(int(name.split('.')[0])):
+                live.append(name)
+            else:
+                os.remove(os.path.join(holders, name))
+        return live
+
+    def _entries(self):
+        return [os.path.join(self.cache_directory, name)
+                for name in os.listdir(self.cache_directory)
+                if not name.startswith('.') and not name.endswith(HOLDERS_SUFFIX) and
+                os.path.isdir(os.path.join(self.cache_directory, name))]
+
+    def _evict(self):
+        if self.max_size is None:
+            return
+        entries = [(os.path.getmtime(entry), directory_size(entry), entry)
+                   for entry in self._entries()]
+        total = sum(size for mtime, size, entry in entries)
+        for mtime, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            if self._live_holders(entry):
+                continue
+            self._log('evicting cached {} {}'.format(self.label, entry))
+            shutil.rmtree(entry, ignore_errors=True)
+            shutil.rmtree(entry + HOLDERS_SUFFIX, ignore_errors=True)
+            total -= size
+
+    def cached_size(self, key):
+        """
+        cached_size: bytes of the cached directory of key, or None
+        """
+        entry = self._entry(key)
+        return directory_size(entry) if os.path.isdir(entry) else None
+
+    def acquire_cached(self, key):
+        """
+        acquire_cached: (directory, lease) of the cached directory of key, or None on a miss
+        """
+        entry = self._entry(key)
+        with self._lock():
+            if not os.path.isdir(entry):
+                return None
+            self.hits += 1
+            self._log('using cached {} {} ({} hits, {} misses)'.format(
+                self.label, key, self.hits, self.misses))
+            return entry, self._add_holder(entry)
+
+    def acquire(self, key, create):
+        """
+        acquire: (directory, lease) of the cached directory of key, calling create() for a
+                 new directory on a miss; release the lease when the files are no longer
+                 needed
+        """
+        cached = self.acquire_cached(key)
+        if cached is not None:
+            return cached
+
+        # create outside the lock; when two processes race, the first to finish wins
+        self.misses += 1
+        created_directory = create()
+        entry = self._entry(key)
+        with self._lock():
+            if os.path.isdir(entry):
+                shutil.rmtree(created_directory, ignore_errors=True)
+            else:
+                shutil.move(created_directory, entry)
+            lease = self._add_holder(entry)
+            self._evict()
+        return entry, lease
+
+    def release(self, lease):
+        """
+        release: drop a lease returned by acquire
+        """
+        release_lease(lease)
+
+
+class AlignmentCache(LeasedCache):
+    """
+    Size-bounded LRU cache of downloaded alignment directories, keyed by alignment UPA
+    """
+
+    def __init__(self, cache_directory, max_size=None, logger=None):
+        super(AlignmentCache, self).__init__(cache_directory, max_size, logger, 'alignment')
+
+    @classmethod
+    def from_config(cls, config, logger=None):
+        return cls(config.get('alignment-cache-dir') or os.path.join(config['scratch'],
+                                                                     'alignment_cache'),
+                   parse_size(config.get('alignment-cache-size') or DEFAULT_CACHE_SIZE),
+                   logger)
@@ -0,0 +1,119 @@
+"""
+Annotation preparation for cufflinks: the genome GTF is cut down to the records cufflinks
+reads for one alignment, i.e. exon and CDS records on contigs in the BAM @SQ header, with
+duplicate records removed. Slim GTFs are cached by genome GTF contents and BAM references,
+so the samples of a set aligned to one genome share one slim annotation; the cache is a
+size-bounded LRU cache whose entries are leased while cufflinks reads them.
+"""
+
+import os
+import re
+import json
+import hashlib
+import shutil
+import uuid
+
+from cuffquant import get_file_fingerprint
+from bam_utils import read_bam_header
+from alignment_cache import LeasedCache
+from scratch_manager import parse_size
+
+DEFAULT_CACHE_SIZE = '2G'
+SLIM_GTF = 'slim.gtf'
+COUNTS_FILE = 'counts.json'
+
+# feature types cufflinks builds reference transcripts from
+KEPT_FEATURES = ('exon', 'CDS')
+TRANSCRIPT_ID_PATTERN = re.compile(r'transcript_id\s+"?([^";]+)"?')
+
+
+def slim_gtf(gtf_file, reference_names, output_file):
+    """
+    slim_gtf: write the exon and CDS records of gtf_file on reference_names to output_file,
+              dropping duplicate records; returns the counts of kept and removed records
+    """
+    references = set(reference_names)
+    counts = {'kept': 0, 'other_contigs': 0, 'other_features': 0, 'duplicates': 0}
+    seen = set()
+    with open(gtf_file) as gtf, open(output_file, 'w') as slim:
+        for line in gtf:
+            if line.startswith('#') or not line.strip():
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 9:
+                continue
+            if fields[0] not in references:
+                counts['other_contigs'] += 1
+                continue
+            if fields[2] not in KEPT_FEATURES:
+                counts['other_features'] += 1
+                continue
+            transcript_id = TRANSCRIPT_ID_PATTERN.search(fields[8])
+            key = (fields[0], fields[2], fields[3], fields[4], fields[6],
+                   transcript_id.group(1) if transcript_id else fields[8])
+            if key in seen:
+                counts['duplicates'] += 1
+                continue
+            seen.add(key)
+            slim.write(line if line.endswith('\n') else line + '\n')
+            counts['kept'] += 1
+    return counts
+
+
+class SlimAnnotationCache(object):
+    """
+    Slim GTFs keyed by the genome GTF contents and the BAM reference names
+    """
+
+    def __init__(self, cache_directory, max_size=None, logger=None):
+        self.cache_directory = cache_directory
+        self.cache = LeasedCache(cache_directory, max_size, logger, 'slim annotation')
+        # (path, size, mtime) of a genome GTF -> its fingerprint, hashed once per run
+        self.fingerprints = {}
+
+    @classmethod
+    def from_config(cls, config, logger=None):
+        return cls(config.get('slim-gtf-cache-dir') or os.path.join(config['scratch'],
+                                                                    'slim_gtf_cache'),
+                   parse_size(config.get('slim-gtf-cache-size') or DEFAULT_CACHE_SIZE),
+                   logger)
+
+    def _get_fingerprint(self, gtf_file):
+        stat = os.stat(gtf_file)
+        key = (os.path.abspath(gtf_file), stat.st_size, stat.st_mtime)
+        if key not in self.fingerprints:
+            self.fingerprints[key] = get_file_fingerprint(gtf_file)
+        return self.fingerprints[key]
+
+    def _cache_key(self, gtf_fingerprint, reference_names):
+        return hashlib.sha1(json.dumps([gtf_fingerprint, sorted(reference_names)])).hexdigest()
+
+    def _slim(self, gtf_file, reference_names):
+        """
+        _slim: write the slim GTF and its counts into a new directory of the cache
+        """
+        # slim to a private directory, so concurrent runs never see partial files
+        slim_directory = os.path.join(self.cache_directory, '.slim_' + str(uuid.uuid4()))
+        os.makedirs(slim_directory)
+        try:
+            counts = slim_gtf(gtf_file, reference_names, os.path.join(slim_directory, SLIM_GTF))
+            with open(os.path.join(slim_directory, COUNTS_FILE), 'w') as counts_file:
+                json.dump(counts, counts_file)
+        except Exception:
+            shutil.rmtree(slim_directory, ignore_errors=True)
+            raise
+        return slim_directory
+
+    def get_slim(self, gtf_file, bam_file):
+        """
+        get_slim: (slim GTF, record counts, lease) for running cufflinks on bam_file against
+                  gtf_file, slimming on a cache miss; release the lease with release_lease
+                  once cufflinks is done
+        """
+        reference_names = [name for name, length in read_bam_header(bam_file)[1]]
+        entry, lease = self.cache.acquire(
+            self._cache_key(self._get_fingerprint(gtf_file), reference_names),
+            lambda: self._slim(gtf_file, reference_names))
+        with open(os.path.join(entry, COUNTS_FILE)) as counts_file:
+            counts = json.load(counts_file)
+        return os.path.join(entry, SLIM_GTF), counts, lease
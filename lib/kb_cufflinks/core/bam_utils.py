@@ -0,0 +1,206 @@
+"""
+BAM preflight for cufflinks: read the BAM header without samtools and only sort when the
+file is not coordinate-sorted, keeping sorted copies keyed by the alignment object version
+in a size-bounded cache. Per-reference read counts from the BAM index drive sharding and
+bundle limit tuning.
+"""
+
+import os
+import re
+import struct
+import tempfile
+import zlib
+
+from alignment_cache import LeasedCache
+
+BGZF_MAGIC = '\x1f\x8b\x08\x04'
+BAM_MAGIC = 'BAM\x01'
+BAI_MAGIC = 'BAI\x01'
+# bin holding the mapped/unmapped read counts of a reference in a BAM index
+BAI_PSEUDO_BIN = 37450
+
+# auto-tuned --max-bundle-frags: a bundle may hold DEPTH_OUTLIER_FACTOR times the reads
+# expected over TYPICAL_BUNDLE_LENGTH bases, within cufflinks' default and a floor
+TYPICAL_BUNDLE_LENGTH = 20000
+DEPTH_OUTLIER_FACTOR = 50
+MIN_BUNDLE_FRAGS = 20000
+MAX_BUNDLE_FRAGS = 500000
+
+DEFAULT_SORT_CACHE_SIZE = '20G'
+
+
+class BgzfReader(object):
+    """
+    Minimal sequential reader of BGZF, the blocked gzip format BAM files are stored in
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.buffer = ''
+
+    def _read_block(self):
+        """
+        _read_block: decompress the next BGZF block; returns False at end of file
+        """
+        header = self.handle.read(18)
+        if not header:
+            return False
+        if len(header) < 18 or header[:4] != BGZF_MAGIC:
+            raise ValueError('Not a BGZF compressed file')
+        extra_length = struct.unpack('<H', header[10:12])[0]
+        # BSIZE is in the 'BC' subfield, the first and only one written by BGZF writers
+        if header[12:14] != 'BC':
+            raise ValueError('BGZF block without a BC subfield')
+        block_size = struct.unpack('<H', header[16:18])[0] + 1
+        payload = self.handle.read(block_size - 18)
+        compressed = payload[extra_length - 6:-8]
+        self.buffer += zlib.decompress(compressed, -15)
+        return True
+
+    def read(self, size):
+        while len(self.buffer) < size:
+            if not self._read_block():
+                break
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        if len(data) < size:
+            raise ValueError('Unexpected end of BAM file')
+        return data
+
+
+def read_bam_header(bam_file):
+    """
+    read_bam_header: return the SAM header text and the (name, length) of every reference
+    """
+    with open(bam_file, 'rb') as handle:
+        reader = BgzfReader(handle)
+        if reader.read(4) != BAM_MAGIC:
+            raise ValueError('{} is not a BAM file'.format(bam_file))
+        text_length = struct.unpack('<i', reader.read(4))[0]
+        text = reader.read(text_length).rstrip('\x00')
+        references = list()
+        for i in range(struct.unpack('<i', reader.read(4))[0]):
+            name_length = struct.unpack('<i', reader.read(4))[0]
+            name = reader.read(name_length).rstrip('\x00')
+            references.append((name, struct.unpack('<i', reader.read(4))[0]))
+    return text, references
+
+
+def get_sort_order(header_text):
+    """
+    get_sort_order: SO value of the @HD header line, or None when it is not given
+    """
+    for line in header_text.splitlines():
+        if line.startswith('@HD'):
+            match = re.search(r'\tSO:(\S+)', line)
+            return match.group(1) if match else None
+    return None
+
+
+def is_coordinate_sorted(bam_file):
+    """
+    is_coordinate_sorted: whether the BAM header declares coordinate sort order
+    """
+    return get_sort_order(read_bam_header(bam_file)[0]) == 'coordinate'
+
+
+def read_bai_mapped_counts(bai_file):
+    """
+    read_bai_mapped_counts: number of mapped reads of every reference in a .bai BAM index
+    """
+    with open(bai_file, 'rb') as handle:
+        data = handle.read()
+    if data[:4] != BAI_MAGIC:
+        raise ValueError('{} is not a BAM index'.format(bai_file))
+
+    offset = 4
+    n_ref = struct.unpack_from('<i', data, offset)[0]
+    offset += 4
+    counts = list()
+    for i in range(n_ref):
+        mapped = 0
+        n_bin = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+        for j in range(n_bin):
+            bin_id, n_chunk = struct.unpack_from('<Ii', data, offset)
+            offset += 8
+            if bin_id == BAI_PSEUDO_BIN:
+                # second chunk of the pseudo-bin holds (mapped, unmapped)
+                mapped = struct.unpack_from('<Q', data, offset + 16)[0]
+            offset += 16 * n_chunk
+        n_intv = struct.unpack_from('<i', data, offset)[0]
+        offset += 4 + 8 * n_intv
+        counts.append(mapped)
+    return counts
+
+
+def suggest_max_bundle_frags(references, mapped_counts):
+    """
+    suggest_max_bundle_frags: --max-bundle-frags for an alignment from its mean read density
+                              over the (name, length) references with reads, or None when
+                              nothing is mapped
+
+    Loci far deeper than the rest of the library are skipped instead of dominating the run.
+    """
+    covered_length = sum(length for (name, length), count in zip(references, mapped_counts)
+                         if count)
+    if not covered_length:
+        return None
+    density = float(sum(mapped_counts)) / covered_length
+    max_bundle_frags = int(density * TYPICAL_BUNDLE_LENGTH * DEPTH_OUTLIER_FACTOR)
+    return min(max(max_bundle_frags, MIN_BUNDLE_FRAGS), MAX_BUNDLE_FRAGS)
+
+
+class BamSortCache(object):
+    """
+    Coordinate-sorted copies of alignment BAM files, keyed by the alignment object UPA, in a
+    size-bounded LRU cache; callers hold a lease on the copies they use
+    """
+
+    SORTED_BAM = 'sorted.bam'
+
+    def __init__(self, cache_directory, threads=1, memory='768M', samtools='samtools',
+                 max_size=None, logger=None):
+        self.cache_directory = cache_directory
+        self.threads = threads
+        self.memory = memory
+        self.samtools = samtools
+        self.cache = LeasedCache(cache_directory, max_size, logger, 'sorted BAM')
+
+    def get_cached(self, alignment_upa):
+        """
+        get_cached: (sorted BAM, lease) of the alignment version sorted before, or None
+        """
+        cached = self.cache.acquire_cached(alignment_upa)
+        if cached is None:
+            return None
+        entry, lease = cached
+        return os.path.join(entry, self.SORTED_BAM), lease
+
+    def get_sort_command(self, bam_file, output_file):
+        return '{} sort -@ {} -m {} -T {} -o {} {}'.format(
+            self.samtools, self.threads, self.memory, output_file + '.tmp', output_file,
+            bam_file)
+
+    def get_sorted(self, bam_file, alignment_upa, run_command):
+        """
+        get_sorted: (bam_file, None) when bam_file is already coordinate-sorted, otherwise
+                    (cached sorted copy, lease), sorting with run_command on a cache miss
+        """
+        if is_coordinate_sorted(bam_file):
+            return bam_file, None
+
+        def sort():
+            if not os.path.isdir(self.cache_directory):
+                try:
+                    os.makedirs(self.cache_directory)
+                except OSError:
+                    if not os.path.isdir(self.cache_directory):
+                        raise
+            # sort into a private directory, published as the cache entry once complete
+            sort_directory = tempfile.mkdtemp(prefix='.sort_', dir=self.cache_directory)
+            run_command(self.get_sort_command(bam_file,
+                                              os.path.join(sort_directory, self.SORTED_BAM)))
+            return sort_directory
+
+        entry, lease = self.cache.acquire(alignment_upa, sort)
+        return os.path.join(entry, self.SORTED_BAM), lease
@@ -3,8 +3,41 @@
 import sys
 import os
 import re
+import mmap
 import shutil
 
+def _read_contig_ids(fasta_filename):
+    """Contig ids of the FASTA headers, in file order, found by jumping from one
+    header to the next without reading the sequence lines; raises ValueError for a
+    header without an id"""
+
+    contig_ids = []
+    if os.path.getsize(fasta_filename) == 0:
+        return contig_ids
+
+    with open(fasta_filename, 'rb') as data:
+        fasta = mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = 0 if fasta[:1] == '>' else fasta.find('\n>')
+            if start > 0:
+                start += 1
+            while start >= 0:
+                end = fasta.find('\n', start)
+                if end < 0:
+                    end = len(fasta)
+                header = fasta[start + 1:end].split()
+                if not header:
+                    raise ValueError("Contig {} of FASTA file {} has no id".format(
+                        len(contig_ids) + 1, fasta_filename))
+                contig_ids.append(header[0])
+
+                start = fasta.find('\n>', end)
+                if start >= 0:
+                    start += 1
+        finally:
+            fasta.close()
+    return contig_ids
+
 def create_sanitized_contig_ids(fasta_filename=None):
     """Create a tab delimited file containing a column for original contig ids
     and a column for sanitized contig ids that only contain alphanumeric characters"""
@@ -12,26 +45,28 @@ def create_sanitized_contig_ids(fasta_filename=None):
     if fasta_filename is None or not os.path.isfile(fasta_filename):
         raise IOError("Invalid FASTA file given: {}".format(fasta_filename))
 
-    contig_ids = []
-    # key = modified_id, value = original contig_id
-    contig_id_mapping = {}
-
     # save all contig_ids
-    with open(fasta_filename, 'r') as data:
-        line = data.readline()
-        while line:
-            if line.startswith(">"):
-                contig_ids.append(line.split()[0][1:])
+    contig_ids = _read_contig_ids(fasta_filename)
 
-            line = data.readline()
+    # key = modified_id, value = original contig_id
+    contig_id_mapping = {}
+    modified_ids = []
+    # key = sanitized id, value = number of ids sanitized to it so far
+    collisions = {}
 
     for x in contig_ids:
-        modified_id = re.sub('[^0-9a-zA-Z]+', '', x)
+        base_id = re.sub('[^0-9a-zA-Z]+', '', x)
+        modified_id = base_id
 
+        # colliding ids get base + 'a', then base + 'a2', 'a3', ... so the
+        # search for a free id resumes where the last one for this base ended
         while modified_id in contig_id_mapping:
-            modified_id = modified_id + 'a'
+            count = collisions.get(base_id, 0) + 1
+            collisions[base_id] = count
+            modified_id = base_id + 'a' + (str(count) if count > 1 else '')
 
         contig_id_mapping[modified_id] = x
+        modified_ids.append(modified_id)
 
     id_filename = fasta_filename.split('.')[0] + "_mapping.tab"
     with open(id_filename, 'w') as id_file:
@@ -39,8 +74,8 @@ def create_sanitized_contig_ids(fasta_filename=None):
         id_file.write("original\tmodified\n")
 
         # write the ids
-        for x in contig_id_mapping:
-            id_file.write("{}\t{}\n".format(contig_id_mapping[x], x)) 
+        for x in modified_ids:
+            id_file.write("{}\t{}\n".format(contig_id_mapping[x], x))
 
     return id_filename
 
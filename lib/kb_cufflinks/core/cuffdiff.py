@@ -1,25 +1,23 @@
 import os
+import json
 import uuid
 from pprint import pprint
 import zipfile
 import re
-import glob
-import multiprocessing as mp
 import handler_utils
 import script_utils
 from cuffmerge import CuffMerge
-from cuffdiff_output import process_cuffdiff_file
-
-from Workspace.WorkspaceClient import Workspace as Workspace
-from DataFileUtil.DataFileUtilClient import DataFileUtil
-from DataFileUtil.baseclient import ServerError as DFUError
-from GenomeFileUtil.GenomeFileUtilClient import GenomeFileUtil
-from ReadsAlignmentUtils.ReadsAlignmentUtilsClient import ReadsAlignmentUtils
-from ExpressionUtils.ExpressionUtilsClient import ExpressionUtils
-from DifferentialExpressionUtils.DifferentialExpressionUtilsClient import DifferentialExpressionUtils
-from KBaseReport.KBaseReportClient import KBaseReport
-
-class CuffDiff:
+from cuffquant import CuffQuant
+from scratch_manager import ScratchManager
+from alignment_cache import AlignmentCache
+from resources import Resources
+from memory_limits import (DEFAULT_MEMORY_RETRIES, MemoryLimitError, degraded_options,
+                           get_memory_limit)
+from cuffdiff_output import process_cuffdiff_file, merge_cuffdiff_outputs
+from html_report import PaginatedReport
+from service_clients import ServiceClients, client_property
+
+class CuffDiff(object):
 
     PARAM_IN_WS_NAME = 'workspace_name'
     PARAM_IN_OBJ_NAME = 'output_obj_name'
@@ -27,6 +25,14 @@ class CuffDiff:
 
     GFFREAD_TOOLKIT_PATH = '/kb/deployment/bin/gffread'
 
+    # service clients are only built when a code path first uses them
+    ws_client = client_property('ws')
+    dfu = client_property('dfu')
+    gfu = client_property('gfu')
+    rau = client_property('rau')
+    eu = client_property('eu')
+    deu = client_property('deu')
+
     def _process_params(self, params):
         """
         validates params passed to run_CuffDiff method
@@ -38,6 +44,8 @@ class CuffDiff:
             if p not in params:
                 raise ValueError('"{}" parameter is required, but missing'.format(p))
 
+        from DataFileUtil.baseclient import ServerError as DFUError
+
         ws_name_id = params.get(self.PARAM_IN_WS_NAME)
         if not isinstance(ws_name_id, int):
             try:
@@ -46,6 +54,13 @@ class CuffDiff:
                 prefix = se.message.split('.')[0]
                 raise ValueError(prefix)
 
+        for contrast in params.get('contrasts') or []:
+            if not (contrast.get('condition1') and contrast.get('condition2')):
+                raise ValueError('each of "contrasts" needs condition1 and condition2')
+            if contrast['condition1'] == contrast['condition2']:
+                raise ValueError('contrast of condition {} with itself'.format(
+                    contrast['condition1']))
+
     def _get_genome_gtf_file(self, gnm_ref, gtf_file_dir):
         """
         Get data from genome object ref and return the GTF filename (with path)
@@ -82,7 +97,8 @@ class CuffDiff:
                     if not (file.endswith('.zip') or
                                 file.endswith('.png') or
                                 file.endswith('.DS_Store')):
-                        zip_file.write(os.path.join(root, file), file)
+                        file_path = os.path.join(root, file)
+                        zip_file.write(file_path, os.path.relpath(file_path, result_directory))
 
         output_files.append({'path': result_file,
                              'name': os.path.basename(result_file),
@@ -91,9 +107,21 @@ class CuffDiff:
 
         return output_files
 
+    def _get_condition_mappings(self, item_refs):
+        """
+        _get_condition_mappings: (name, condition_mapping) of each DifferentialExpressionMatrix,
+                                 fetched in one subset call rather than downloading every matrix
+        """
+        if not item_refs:
+            return []
+        items = self.ws_client.get_objects2({'objects': [
+            {'ref': item_ref, 'included': ['condition_mapping']}
+            for item_ref in item_refs]})['data']
+        return [(item['info'][1], item['data'].get('condition_mapping')) for item in items]
+
     def _generate_html_report(self, result_directory,
                                        diff_expression_obj_ref,
-                                       genome_ref):
+                                       diff_expr_set):
         """
         _generate_html_report: generate html summary report
         """
@@ -103,54 +131,28 @@ class CuffDiff:
 
         output_directory = os.path.join(self.scratch, str(uuid.uuid4()))
         handler_utils._mkdir_p(output_directory)
-        result_file_path = os.path.join(output_directory, 'report.html')
 
-        diff_expr_set = self.ws_client.get_objects2({'objects':
-                                                       [{'ref':
-                                                             diff_expression_obj_ref}]})['data'][0]
         diff_expr_set_data = diff_expr_set['data']
         diff_expr_set_info = diff_expr_set['info']
         diff_expr_set_name = diff_expr_set_info[1]
 
-        overview_content = ''
-        overview_content += '<br/><table><tr><th>Generated DifferentialExpressionMatrixSet'
-        overview_content += ' Object</th></tr>'
-        overview_content += '<tr><td>{} ({})'.format(diff_expr_set_name,
-                                                     diff_expression_obj_ref)
-        overview_content += '</td></tr></table>'
-
-        overview_content += '<p><br/></p>'
-
-        overview_content += '<br/><table><tr><th>Generated DifferentialExpressionMatrix'
-        overview_content += ' Object</th><th></th><th></th><th></th></tr>'
-        overview_content += '<tr><th>Differential Expression Matrix Name</th>'
-        overview_content += '<th>Condition 1</th>'
-        overview_content += '<th>Condition 2</th>'
-        overview_content += '</tr>'
-
-        for item in diff_expr_set_data['items']:
-            item_diffexprmatrix_object = self.ws_client.get_objects2({'objects':
-                                                               [{'ref': item['ref']}]})['data'][0]
-            item_diffexprmatrix_info = item_diffexprmatrix_object['info']
-            item_diffexprmatrix_data = item_diffexprmatrix_object['data']
-            diffexprmatrix_name = item_diffexprmatrix_info[1]
-
-            overview_content += '<tr><td>{} ({})</td>'.format(diffexprmatrix_name,
-                                                              item['ref'])
-            overview_content += '<td>{}</td>'.format(item_diffexprmatrix_data.
-                                                     get('condition_mapping').keys()[0])
-            overview_content += '<td>{}</td>'.format(item_diffexprmatrix_data.
-                                                     get('condition_mapping').values()[0])
-            overview_content += '</tr>'
-        overview_content += '</table>'
-
-        with open(result_file_path, 'w') as result_file:
-            with open(os.path.join(os.path.dirname(__file__), 'report_template.html'),
-                      'r') as report_template_file:
-                report_template = report_template_file.read()
-                report_template = report_template.replace('<p>Overview_Content</p>',
-                                                          overview_content)
-                result_file.write(report_template)
+        report = PaginatedReport()
+        report.add_table('Generated DifferentialExpressionMatrixSet Object',
+                         ['Name', 'Reference'],
+                         [[diff_expr_set_name, diff_expression_obj_ref]])
+
+        item_refs = [item['ref'] for item in diff_expr_set_data['items']]
+        matrix_rows = list()
+        for item_ref, (diffexprmatrix_name, condition_mapping) in zip(
+                item_refs, self._get_condition_mappings(item_refs)):
+            matrix_rows.append(['{} ({})'.format(diffexprmatrix_name, item_ref),
+                                condition_mapping.keys()[0],
+                                condition_mapping.values()[0]])
+        report.add_table('Generated DifferentialExpressionMatrix Objects',
+                         ['Differential Expression Matrix Name', 'Condition 1', 'Condition 2'],
+                         matrix_rows)
+
+        result_file_path = report.write(output_directory)
 
         report_shock_id = self.dfu.file_to_shock({'file_path': output_directory,
                                                   'pack': 'zip'})['shock_id']
@@ -170,12 +172,16 @@ class CuffDiff:
 
         output_files = self._generate_output_file_list(result_directory)
 
+        # the set only holds item refs, so it is fetched once for both the html and the
+        # objects_created list
+        diff_expr_set = self.ws_client.get_objects2({'objects':
+                                                    [{'ref':
+                                                      diff_expression_obj_ref}]})['data'][0]
+        diff_expr_set_data = diff_expr_set['data']
+
         output_html_files = self._generate_html_report(result_directory,
                                                         diff_expression_obj_ref,
-                                                        genome_ref)
-        diff_expr_set_data = self.ws_client.get_objects2({'objects':
-                                                        [{'ref':
-                                                        diff_expression_obj_ref}]})['data'][0]['data']
+                                                        diff_expr_set)
 
         objects_created = [{'ref': diff_expression_obj_ref,
                             'description': 'Differential Expression Matrix Set generated by Cuffdiff'}]
@@ -195,13 +201,87 @@ class CuffDiff:
                          'report_object_name': 'kb_cuffdiff_report_' + str(uuid.uuid4())
                          }
 
-        kbase_report_client = KBaseReport(self.callback_url)
-        output = kbase_report_client.create_extended_report(report_params)
+        output = self.clients.kbase_report.create_extended_report(report_params)
 
         report_output = {'report_name': output['name'], 'report_ref': output['ref']}
 
         return report_output
 
+    def _get_alignment_bam_file(self, alignment_dir):
+        """
+        _get_alignment_bam_file: the BAM file of a downloaded alignment, accepted_hits.bam
+                                 when the download holds several
+        """
+        bam_files = [f for f in os.listdir(alignment_dir) if f.endswith('.bam')]
+        if len(bam_files) == 0:
+            raise ValueError('bam file does not exist in {}'.format(alignment_dir))
+        bam_file = os.path.join(alignment_dir,
+                                bam_files[0] if len(bam_files) == 1 else 'accepted_hits.bam')
+        if not os.path.exists(bam_file):
+            raise ValueError('{} does not exist'.format(bam_file))
+        return bam_file
+
+    def _get_alignment_upas(self, alignment_refs):
+        """
+        _get_alignment_upas: versioned refs of the alignment objects, in one call
+        """
+        infos = self.ws_client.get_object_info3(
+            {'objects': [{'ref': alignment_ref} for alignment_ref in alignment_refs]})['infos']
+        return ['{}/{}/{}'.format(info[6], info[0], info[4]) for info in infos]
+
+    def _stage_sample(self, manifest, list_file, expression_ref, alignment_ref, alignment_upa,
+                      condition):
+        """
+        _stage_sample: download the transcripts of one expression item and record it in the
+                       manifest with its alignment and condition; the alignment is staged
+                       later, by _stage_alignments, only when its BAM file is needed
+        """
+        expression_retval = self.eu.download_expression({'source_ref': expression_ref})
+        expression_dir = expression_retval.get('destination_dir')
+        self.scratch_manager.track(expression_dir)
+        e_file_path = os.path.join(expression_dir, "transcripts.gtf")
+
+        if os.path.exists(e_file_path):
+            self.logger.info('Adding:  ' + expression_ref + ':, ' + e_file_path)
+            list_file.write("{0}\n".format(e_file_path))
+        else:
+            raise ValueError(e_file_path + " not found")
+
+        manifest.append({'expression_ref': expression_ref,
+                         'alignment_ref': alignment_ref,
+                         'alignment_upa': alignment_upa,
+                         'condition': condition})
+
+    def _stage_alignments(self, samples):
+        """
+        _stage_alignments: lease the alignments of manifest samples from the shared cache,
+                           downloading them on a miss, and record their BAM files
+        """
+        for sample in samples:
+            alignment_dir, lease = self.alignment_cache.acquire(
+                sample['alignment_upa'],
+                lambda: self.rau.download_alignment({'source_ref': sample['alignment_ref']}).get(
+                    'destination_dir'))
+            self.alignment_leases.append(lease)
+            sample['bam_file'] = self._get_alignment_bam_file(alignment_dir)
+
+    def _get_manifest_data(self, manifest, file_key='bam_file'):
+        """
+        _get_manifest_data: cuffdiff labels and the comma-separated replicate files of each
+                            condition, conditions in order of first appearance
+        """
+        condition = list()
+        replicates = dict()
+        for sample in manifest:
+            if sample['condition'] not in replicates:
+                condition.append(sample['condition'])
+                replicates[sample['condition']] = list()
+            replicates[sample['condition']].append(sample[file_key])
+
+        return {'condition': condition,
+                'bam_files': [' ' + ','.join(replicates[c]) for c in condition],
+                'manifest': manifest}
+
     def _get_rnaseq_expressionset_data(self, expression_set_data, result_directory):
         """
         Get data from expressionset object in the form required 
@@ -218,73 +298,30 @@ class CuffDiff:
         """
         output_data['gtf_file_path'] = self._get_genome_gtf_file(output_data['genome_id'],
                                                                  self.scratch)
-        condition = []
-        bam_files = []
 
-        mapped_expr_ids = expression_set_data.get('mapped_expression_ids')
+        sample_refs = [(alignment_id, expression_id)
+                       for i in expression_set_data.get('mapped_expression_ids')
+                       for alignment_id, expression_id in i.items()]
+        alignments = self.ws_client.get_objects2(
+            {'objects': [{'ref': alignment_id, 'included': ['condition']}
+                         for alignment_id, expression_id in sample_refs]})['data']
+        alignment_upas = self._get_alignment_upas(
+            [alignment_id for alignment_id, expression_id in sample_refs])
 
+        """
+        assembly_gtf.txt will contain the file paths of all .gtf files 
+        in the expressionset. Used as input to cuffmerge.
+        """
         assembly_file = os.path.join(result_directory, "assembly_gtf.txt")
-        list_file = open(assembly_file, 'w')
-        for i in mapped_expr_ids:
-            for alignment_id, expression_id in i.items():
-                """
-                assembly_gtf.txt will contain the file paths of all .gtf files 
-                in the expressionset. Used as input to cuffmerge.
-                """
-                expression_retVal = self.eu.download_expression({'source_ref': expression_id})
-                expression_dir = expression_retVal.get('destination_dir')
-                e_file_path = os.path.join(expression_dir, "transcripts.gtf")
-
-                if os.path.exists(e_file_path):
-                    self.logger.info('Adding:  ' + expression_id + ':, ' + e_file_path)
-                    list_file.write("{0}\n".format(e_file_path))
-                else:
-                    raise ValueError(e_file_path + " not found")
-                """
-                Create a list of all conditions in expressionset. Used as input to cuffdiff.
-                """
-                alignment_data = self.ws_client.get_objects2(
-                    {'objects':
-                         [{'ref': alignment_id}]})['data'][0]['data']
-                alignment_condition = alignment_data.get('condition')
-                if alignment_condition not in condition:
-                    condition.append(alignment_condition)
-                """
-                Create a list of bam files in alignment set. Used as input to cuffdiff.
-                """
-                alignment_retVal = self.rau.download_alignment({'source_ref': alignment_id})
-                alignment_dir = alignment_retVal.get('destination_dir')
-                align_path, align_dir = os.path.split(alignment_dir)
-                new_alignment_dir = os.path.join(align_path, alignment_condition + '_' + align_dir)
-                os.rename(alignment_dir, os.path.join(align_path, new_alignment_dir))
-
-        list_file.close()
-        """
-        Get list of bamfiles in the format required by cuffdiff
-        """
-        align_dirs = os.listdir(align_path)
-        for c in condition:
-            rep_files = []
-            for d in align_dirs:
-                path, dir = os.path.split(d)
-                if c in dir:
-                    allbamfiles = glob.glob(os.path.join(align_path, d + '/*.bam'))
-                    if len(allbamfiles) == 0:
-                        raise ValueError('bam file does not exist in {}'.format(d))
-                    if len(allbamfiles) == 1:
-                        bfile = allbamfiles[0]
-                    elif len(allbamfiles) > 1:
-                        bfile = os.path.join(align_path, d + '/accepted_hits.bam')
-                    if os.path.exists(bfile):
-                        rep_files.append(bfile)
-                    else:
-                        raise ValueError('{} does not exist'.format(bfile))
-            if len(rep_files) > 0:
-                bam_files.append(' ' + ','.join(bf for bf in rep_files))
+        manifest = list()
+        with open(assembly_file, 'w') as list_file:
+            for (alignment_id, expression_id), alignment, alignment_upa in zip(
+                    sample_refs, alignments, alignment_upas):
+                self._stage_sample(manifest, list_file, expression_id, alignment_id,
+                                   alignment_upa, alignment['data'].get('condition'))
 
         output_data['assembly_file'] = assembly_file
-        output_data['condition'] = condition
-        output_data['bam_files'] = bam_files
+        output_data['manifest'] = manifest
         return output_data
 
     def _get_setapi_expressionset_data(self, expr_obj_data, result_directory):
@@ -294,48 +331,29 @@ class CuffDiff:
         """
         self.logger.info('Getting data from SETAPI expression set input')
         output_data = dict()
-        condition = list()
-        bam_files = list()
 
-        assembly_file = os.path.join(result_directory, "assembly_gtf.txt")
-        list_file = open(assembly_file, 'w')
+        expression_refs = [item['ref'] for item in expr_obj_data.get('items')]
+        expressions = self.ws_client.get_objects2(
+            {'objects': [{'ref': expression_ref,
+                          'included': ['condition', 'mapped_rnaseq_alignment', 'genome_id']}
+                         for expression_ref in expression_refs]})['data']
 
-        items = expr_obj_data.get('items')
-        for item in items:
-            """
-            assembly_gtf.txt will contain the file paths of all .gtf files 
-            in the expressionset. Used as input to cuffmerge.
-            """
-            expression_ref = item['ref']
-            expression_retval = self.eu.download_expression({'source_ref': expression_ref})
-            expression_dir = expression_retval.get('destination_dir')
-            e_file_path = os.path.join(expression_dir, "transcripts.gtf")
-
-            if os.path.exists(e_file_path):
-                self.logger.info('Adding:  ' + expression_ref + ':, ' + e_file_path)
-                list_file.write("{0}\n".format(e_file_path))
-            else:
-                raise ValueError(e_file_path + " not found")
-            """
-            Create a list of all conditions in expressionset. Used as input to cuffdiff.
-            """
-            expression_data = self.ws_client.get_objects2(
-                {'objects':
-                     [{'ref': expression_ref}]})['data'][0]['data']
-            expression_condition = expression_data.get('condition')
-            if expression_condition not in condition:
-                condition.append(expression_condition)
-            """
-            Create a list of bam files in alignment set. Used as input to cuffdiff.
-            """
-            alignment_ref = expression_data['mapped_rnaseq_alignment'].values()[0]
-            alignment_retval = self.rau.download_alignment({'source_ref': alignment_ref})
-            alignment_dir = alignment_retval.get('destination_dir')
-            align_path, align_dir = os.path.split(alignment_dir)
-            new_alignment_dir = os.path.join(align_path, expression_condition + '_' + align_dir)
-            os.rename(alignment_dir, os.path.join(align_path, new_alignment_dir))
-
-        list_file.close()
+        """
+        assembly_gtf.txt will contain the file paths of all .gtf files 
+        in the expressionset. Used as input to cuffmerge.
+        """
+        alignment_refs = [expression['data']['mapped_rnaseq_alignment'].values()[0]
+                          for expression in expressions]
+        alignment_upas = self._get_alignment_upas(alignment_refs)
+
+        assembly_file = os.path.join(result_directory, "assembly_gtf.txt")
+        manifest = list()
+        with open(assembly_file, 'w') as list_file:
+            for expression_ref, expression, alignment_ref, alignment_upa in zip(
+                    expression_refs, expressions, alignment_refs, alignment_upas):
+                expression_data = expression['data']
+                self._stage_sample(manifest, list_file, expression_ref, alignment_ref,
+                                   alignment_upa, expression_data.get('condition'))
 
         """
         Get gtf file from genome_ref. Used as input to cuffmerge.
@@ -343,32 +361,9 @@ class CuffDiff:
         output_data['genome_id'] = expression_data.get('genome_id')
         output_data['gtf_file_path'] = self._get_genome_gtf_file(output_data['genome_id'],
                                                                  self.scratch)
-        """
-        Get list of bamfiles in the format required by cuffdiff
-        """
-        align_dirs = os.listdir(align_path)
-        for c in condition:
-            rep_files = []
-            for d in align_dirs:
-                path, dir = os.path.split(d)
-                if c in dir:
-                    allbamfiles = glob.glob(os.path.join(align_path, d + '/*.bam'))
-                    if len(allbamfiles) == 0:
-                        raise ValueError('bam file does not exist in {}'.format(d))
-                    if len(allbamfiles) == 1:
-                        bfile = allbamfiles[0]
-                    elif len(allbamfiles) > 1:
-                        bfile = os.path.join(align_path, d + '/accepted_hits.bam')
-                    if os.path.exists(bfile):
-                        rep_files.append(bfile)
-                    else:
-                        raise ValueError('{} does not exist'.format(bfile))
-            if len(rep_files) > 0:
-                bam_files.append(' ' + ','.join(bf for bf in rep_files))
 
         output_data['assembly_file'] = assembly_file
-        output_data['condition'] = condition
-        output_data['bam_files'] = bam_files
+        output_data['manifest'] = manifest
         return output_data
 
     def _get_expressionset_data(self, expressionset_ref, result_directory):
@@ -386,14 +381,35 @@ class CuffDiff:
                             'KBaseRNASeq.RNASeqExpressionSet ' +
                             'or KBaseSets.ExpressionSet')
 
-    def _assemble_cuffdiff_command(self, params, expressionset_data, merged_gtf, output_dir):
+    def _quantify_samples(self, params, expressionset_data, merged_gtf):
+        """
+        _quantify_samples: expressionset_data with each condition's BAM files replaced by the
+                           cuffquant .cxb files of the same alignments
+        """
+        manifest = expressionset_data.get('manifest')
+        cxb_files = self.cuffquant_runner.get_abundances(
+            [sample.get('bam_file') for sample in manifest],
+            [sample['alignment_upa'] for sample in manifest], merged_gtf,
+            self.num_threads, params)
+        quantified_manifest = list()
+        for sample, cxb_file in zip(manifest, cxb_files):
+            quantified_sample = dict(sample)
+            quantified_sample['cxb_file'] = cxb_file
+            quantified_manifest.append(quantified_sample)
+
+        quantified_data = dict(expressionset_data)
+        quantified_data.update(self._get_manifest_data(quantified_manifest, 'cxb_file'))
+        return quantified_data
+
+    def _assemble_cuffdiff_command(self, params, expressionset_data, merged_gtf, output_dir,
+                                   num_threads=None):
 
         bam_files = " ".join(expressionset_data.get('bam_files'))
         t_labels = ",".join(expressionset_data.get('condition'))
 
         # output_dir = os.path.join(cuffdiff_dir, self.method_params['output_obj_name'])
 
-        cuffdiff_command = (' -p ' + str(self.num_threads))
+        cuffdiff_command = (' -p ' + str(num_threads or self.num_threads))
         """
         Set Advanced parameters for Cuffdiff
         """
@@ -412,6 +428,8 @@ class CuffDiff:
         if ('library_norm_method' in params and
                         params['library_norm_method'] is not None):
             cuffdiff_command += (' --library-norm-method ' + params['library_norm_method'])
+        if params.get('max_bundle_frags'):
+            cuffdiff_command += (' --max-bundle-frags ' + str(params['max_bundle_frags']))
 
         cuffdiff_command += " -o {0} -L {1} -u {2} {3}".format(output_dir,
                                                                t_labels,
@@ -419,6 +437,117 @@ class CuffDiff:
                                                                bam_files)
         return cuffdiff_command
 
+    def _run_cuffdiff_command(self, cuffdiff_command, cuffdiff_dir, memory_limit=None):
+        """
+        _run_cuffdiff_command: run cuffdiff in cuffdiff_dir, under memory_limit when given,
+                               and log its progress
+        """
+        try:
+            ret = script_utils.runProgram(self.logger,
+                                          "cuffdiff",
+                                          cuffdiff_command,
+                                          None,
+                                          cuffdiff_dir,
+                                          memory_limit)
+            result = ret["result"]
+            for line in result.splitlines(False):
+                self.logger.info(line)
+                stderr = ret["stderr"]
+                prev_value = ''
+                for line in stderr.splitlines(False):
+                    if line.startswith('> Processing Locus'):
+                        words = line.split()
+                        cur_value = words[len(words) - 1]
+                        if prev_value != cur_value:
+                            prev_value = cur_value
+                            self.logger.info(line)
+                        else:
+                            prev_value = ''
+                            self.logger.info(line)
+        except MemoryLimitError:
+            raise
+        except Exception, e:
+            raise Exception("Error executing cuffdiff {0},{1}".format(cuffdiff_command, e))
+
+    def _run_cuffdiff_retrying(self, params, expressionset_data, merged_gtf, output_dir,
+                               num_threads=None, memory_limit=None):
+        """
+        _run_cuffdiff_retrying: run cuffdiff, retrying with fewer threads and a tighter
+                                --max-bundle-frags when it runs out of memory; retries are
+                                recorded in the telemetry; runs under memory_limit, or
+                                self.memory_limit when not given
+        """
+        num_threads = num_threads or self.num_threads
+        memory_limit = memory_limit or self.memory_limit
+        for attempt in range(self.memory_retries + 1):
+            try:
+                self._run_cuffdiff_command(
+                    self._assemble_cuffdiff_command(params, expressionset_data, merged_gtf,
+                                                    output_dir, num_threads),
+                    output_dir, memory_limit)
+                return
+            except MemoryLimitError as e:
+                if attempt == self.memory_retries:
+                    raise
+                num_threads, max_bundle_frags = degraded_options(
+                    num_threads, params.get('max_bundle_frags'))
+                self.telemetry.append({'event': 'memory_retry', 'tool': 'cuffdiff',
+                                       'conditions': expressionset_data.get('condition'),
+                                       'attempt': attempt + 1, 'exit_code': e.exit_code,
+                                       'memory_limit': memory_limit,
+                                       'num_threads': num_threads,
+                                       'max_bundle_frags': max_bundle_frags})
+                self.logger.info('cuffdiff ran out of memory, retrying with {} threads and '
+                                 'max_bundle_frags {}'.format(num_threads, max_bundle_frags))
+                params = dict(params, max_bundle_frags=max_bundle_frags)
+
+    def _run_contrasts(self, params, expressionset_data, merged_gtf, cuffdiff_dir):
+        """
+        _run_contrasts: run one cuffdiff per requested condition pair concurrently, splitting
+                        the cores between them, and merge their .diff files into cuffdiff_dir
+        """
+        from multiprocessing.pool import ThreadPool
+
+        conditions = expressionset_data.get('condition')
+        bam_files = dict(zip(conditions, expressionset_data.get('bam_files')))
+        contrasts = list()
+        for contrast in params.get('contrasts'):
+            pair = [contrast['condition1'], contrast['condition2']]
+            for condition in pair:
+                if condition not in bam_files:
+                    raise ValueError('condition {} is not in the expression set ({})'.format(
+                        condition, ', '.join(conditions)))
+            if pair not in contrasts:
+                contrasts.append(pair)
+
+        num_threads = max(1, self.num_threads // len(contrasts))
+        contrast_dirs = [os.path.join(cuffdiff_dir,
+                                      re.sub(r'[^\w.-]', '_',
+                                             '{}_vs_{}'.format(*condition_pair)))
+                         for condition_pair in contrasts]
+
+        # concurrent contrasts share the job's memory
+        memory_limit = get_memory_limit(self.config, self.resources.memory,
+                                        min(len(contrasts), self.num_threads))
+
+        def run_contrast(i):
+            handler_utils._mkdir_p(contrast_dirs[i])
+            contrast_data = {'condition': contrasts[i],
+                             'bam_files': [bam_files[c] for c in contrasts[i]]}
+            self._run_cuffdiff_retrying(params, contrast_data, merged_gtf, contrast_dirs[i],
+                                        num_threads, memory_limit)
+
+        self.logger.info('Running cuffdiff on {} condition pairs, {} threads each'.format(
+            len(contrasts), num_threads))
+        pool = ThreadPool(min(len(contrasts), self.num_threads))
+        try:
+            pool.map(run_contrast, range(len(contrasts)))
+        finally:
+            pool.close()
+            pool.join()
+
+        merge_cuffdiff_outputs(contrast_dirs, cuffdiff_dir)
+
     def __init__(self, config, services, logger=None):
         self.config = config
         self.logger = logger
@@ -426,21 +555,53 @@ class CuffDiff:
         self.scratch = os.path.join(config['scratch'], 'cuffdiff_merge_' + str(uuid.uuid4()))
         self.ws_url = config['workspace-url']
         self.services = services
-        self.ws_client = Workspace(self.services['workspace_service_url'])
-        self.dfu = DataFileUtil(self.callback_url)
-        self.gfu = GenomeFileUtil(self.callback_url)
-        self.rau = ReadsAlignmentUtils(self.callback_url)
-        self.eu = ExpressionUtils(self.callback_url)
-        self.deu = DifferentialExpressionUtils(self.callback_url)
+        client_config = dict(config)
+        client_config.update({'workspace-url': services['workspace_service_url'],
+                              'SDK_CALLBACK_URL': self.callback_url})
+        self.clients = ServiceClients(client_config)
         self.cuffmerge_runner = CuffMerge(config, logger)
-        self.num_threads = mp.cpu_count()
-        handler_utils._mkdir_p(self.scratch)
+        self.cuffquant_runner = CuffQuant(config, logger)
+        self.scratch_manager = ScratchManager.from_config(config, self.scratch, logger)
+        # alignment downloads shared with run_cufflinks, leased for the whole run
+        self.alignment_cache = AlignmentCache.from_config(config, logger)
+        self.alignment_leases = []
+        # CPUs of the container, not the host; 'cpu-limit' in the config overrides
+        self.resources = Resources.from_config(config)
+        self.num_threads = self.resources.cpus
+        # address space cap of cuffdiff, and retries of cuffdiff runs out of memory
+        self.memory_limit = get_memory_limit(config, self.resources.memory)
+        self.memory_retries = (int(config['memory-retries'])
+                               if str(config.get('memory-retries', '')).strip() else
+                               DEFAULT_MEMORY_RETRIES)
+        self.telemetry = []
 
     def run_cuffdiff(self, params):
+        """
+        run_cuffdiff: run cuffmerge and cuffdiff on an expression set in a scratch directory
+                      of its own, removed afterwards except the cuffdiff output directory
+        """
+        self.scratch = os.path.join(self.config['scratch'], 'cuffdiff_merge_' + str(uuid.uuid4()))
+        self.scratch_manager = ScratchManager.from_config(self.config, self.scratch, self.logger)
+        self.telemetry = []
+        with self.scratch_manager.job():
+            try:
+                returnVal = self._run_cuffdiff(params)
+            finally:
+                while self.alignment_leases:
+                    self.alignment_cache.release(self.alignment_leases.pop())
+                self.cuffquant_runner.release()
+            self.scratch_manager.retain(returnVal.get('destination_dir'))
+        self.logger.info('workspace cache: {}'.format(self.clients.workspace_cache_stats()))
+        if self.telemetry:
+            self.logger.info('run telemetry:\n{}'.format(json.dumps(self.telemetry, indent=1)))
+        return returnVal
+
+    def _run_cuffdiff(self, params):
         """
         Check input parameters
         """
         self._process_params(params)
+        handler_utils._mkdir_p(self.scratch)
 
         expressionset_ref = params.get('expressionset_ref')
         result_directory = os.path.join(self.scratch, 'expset_' + str(uuid.uuid4()))
@@ -461,39 +622,40 @@ class CuffDiff:
                                                          expressionset_data.get('assembly_file'))
         self.logger.info('MERGED GTF FILE: ' + merged_gtf)
 
+        """
+        Quantify each sample once, cuffdiff and cuffnorm then read the .cxb files; only the
+        alignments without cached .cxb files are staged
+        """
+        manifest = expressionset_data['manifest']
+        if params.get('quantify_once'):
+            cxb_files = self.cuffquant_runner.get_cached_abundances(
+                [sample['alignment_upa'] for sample in manifest], merged_gtf, params)
+            self._stage_alignments([sample for sample, cxb_file in zip(manifest, cxb_files)
+                                    if cxb_file is None])
+            self.scratch_manager.check_space()
+            expressionset_data = self._quantify_samples(params, expressionset_data, merged_gtf)
+        else:
+            self._stage_alignments(manifest)
+            self.scratch_manager.check_space()
+            expressionset_data.update(self._get_manifest_data(manifest))
+
         """
         Assemble parameters and run cuffdiff
         """
         cuffdiff_dir = os.path.join(self.scratch, "cuffdiff_" + str(uuid.uuid4()))
         handler_utils._mkdir_p(cuffdiff_dir)
 
-        cuffdiff_command = self._assemble_cuffdiff_command(params,
-                                                           expressionset_data,
-                                                           merged_gtf,
-                                                           cuffdiff_dir)
-        try:
-            ret = script_utils.runProgram(self.logger,
-                                          "cuffdiff",
-                                          cuffdiff_command,
-                                          None,
-                                          cuffdiff_dir)
-            result = ret["result"]
-            for line in result.splitlines(False):
-                self.logger.info(line)
-                stderr = ret["stderr"]
-                prev_value = ''
-                for line in stderr.splitlines(False):
-                    if line.startswith('> Processing Locus'):
-                        words = line.split()
-                        cur_value = words[len(words) - 1]
-                        if prev_value != cur_value:
-                            prev_value = cur_value
-                            self.logger.info(line)
-                        else:
-                            prev_value = ''
-                            self.logger.info(line)
-        except Exception, e:
-            raise Exception("Error executing cuffdiff {0},{1}".format(cuffdiff_command, e))
+        if params.get('contrasts'):
+            self._run_contrasts(params, expressionset_data, merged_gtf, cuffdiff_dir)
+        else:
+            self._run_cuffdiff_retrying(params, expressionset_data, merged_gtf, cuffdiff_dir)
+
+        if params.get('quantify_once'):
+            self.cuffquant_runner.run_cuffnorm(os.path.join(cuffdiff_dir, 'cuffnorm'),
+                                               self.num_threads,
+                                               merged_gtf,
+                                               expressionset_data.get('condition'),
+                                               expressionset_data.get('bam_files'))
 
         """
         Save differential expression data with files for all condition pairs
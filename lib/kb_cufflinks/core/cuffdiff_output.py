@@ -115,3 +115,75 @@ def process_cuffdiff_file(diffexpr_filepath, scratch):
         print('===================  END DIFF EXPR FILES ==================================')
 
         return diff_expr_files
+
+
+DIFF_FILES = ['gene_exp.diff', 'isoform_exp.diff', 'tss_group_exp.diff', 'cds_exp.diff',
+              'splicing.diff', 'cds.diff', 'promoters.diff']
+# cuffdiff --FDR default
+FDR = 0.05
+
+
+def benjamini_hochberg(p_values):
+    """
+    benjamini_hochberg: q-values of p_values, as cuffdiff computes them over the OK tests
+                        of one .diff file
+    """
+    order = sorted(range(len(p_values)), key=lambda i: p_values[i])
+    q_values = [None] * len(p_values)
+    q_min = 1.0
+    for rank in range(len(order), 0, -1):
+        i = order[rank - 1]
+        q_min = min(q_min, p_values[i] * len(p_values) / rank)
+        q_values[i] = q_min
+    return q_values
+
+
+def _diff_rows(diff_paths):
+    for diff_path in diff_paths:
+        with open(diff_path) as diff:
+            next(diff, None)
+            for line in diff:
+                yield line.rstrip('\n').split('\t')
+
+
+def merge_cuffdiff_outputs(contrast_directories, output_directory, fdr=FDR):
+    """
+    merge_cuffdiff_outputs: concatenate the .diff files of cuffdiff runs over separate
+                            condition pairs into output_directory, keeping one header
+
+    Each run corrected its p-values for its own tests only; the q-values and significance
+    calls of the merged tables are recomputed over the tests of all runs together, as a
+    single cuffdiff run over all conditions corrects them.
+    """
+    for diff_file in DIFF_FILES:
+        diff_paths = [os.path.join(d, diff_file) for d in contrast_directories
+                      if os.path.exists(os.path.join(d, diff_file))]
+        if not diff_paths:
+            continue
+        header = None
+        for diff_path in diff_paths:
+            with open(diff_path) as diff:
+                header = next(diff, None)
+            if header is not None:
+                break
+        if header is None:
+            open(os.path.join(output_directory, diff_file), 'w').close()
+            continue
+        columns = header.rstrip('\n').split('\t')
+
+        q_values = None
+        if set(['status', 'p_value', 'q_value', 'significant']).issubset(columns):
+            status, p_value = columns.index('status'), columns.index('p_value')
+            q_values = benjamini_hochberg([float(row[p_value]) for row in _diff_rows(diff_paths)
+                                           if row[status] == 'OK'])
+            q_value, significant = columns.index('q_value'), columns.index('significant')
+
+        with open(os.path.join(output_directory, diff_file), 'w') as output:
+            output.write(header)
+            tested = 0
+            for row in _diff_rows(diff_paths):
+                if q_values is not None and row[status] == 'OK':
+                    row[q_value] = '{:g}'.format(q_values[tested])
+                    row[significant] = 'yes' if q_values[tested] <= fdr else 'no'
+                    tested += 1
+                output.write('\t'.join(row) + '\n')
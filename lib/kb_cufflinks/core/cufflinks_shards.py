@@ -0,0 +1,124 @@
+"""
+Helpers for running cufflinks on contig-group shards of one alignment and merging the results.
+
+References are grouped into shards of similar mapped read counts (from the BAM index), the
+annotation is split to match, and each shard runs as its own cufflinks process. FPKM values
+are relative to the mapped fragment mass of the run that produced them, so shard values are
+rescaled by shard mass / total mass when the shard outputs are merged.
+"""
+
+import os
+import re
+
+TRACKING_FILES = ['genes.fpkm_tracking', 'isoforms.fpkm_tracking']
+FPKM_COLUMNS = ['FPKM', 'FPKM_conf_lo', 'FPKM_conf_hi']
+GTF_FILES = ['transcripts.gtf', 'skipped.gtf']
+GTF_FPKM_ATTRIBUTES = ['FPKM', 'conf_lo', 'conf_hi']
+
+
+def assign_shards(reference_names, counts, num_shards):
+    """
+    assign_shards: group the references with reads into at most num_shards lists of similar
+                   read counts, largest references first; shards that would be empty are dropped
+    """
+    shards = [[] for i in range(num_shards)]
+    loads = [0] * num_shards
+    references = [(name, count) for name, count in zip(reference_names, counts) if count]
+    for name, count in sorted(references, key=lambda r: -r[1]):
+        lightest = loads.index(min(loads))
+        shards[lightest].append(name)
+        loads[lightest] += count
+    return [shard for shard in shards if shard]
+
+
+def split_gtf(gtf_file, shards, shard_directories):
+    """
+    split_gtf: write the annotation records of each shard's references to annotation.gtf in
+               its shard directory; records on references with no reads go to the first shard
+    """
+    shard_of = dict((name, i) for i, shard in enumerate(shards) for name in shard)
+    gtf_paths = [os.path.join(shard_directory, 'annotation.gtf')
+                 for shard_directory in shard_directories]
+    outputs = [open(gtf_path, 'w') for gtf_path in gtf_paths]
+    try:
+        with open(gtf_file) as gtf:
+            for line in gtf:
+                if line.startswith('#'):
+                    continue
+                outputs[shard_of.get(line.split('\t', 1)[0], 0)].write(line)
+    finally:
+        for output in outputs:
+            output.close()
+    return gtf_paths
+
+
+def write_shard_bed(references, bed_file):
+    """
+    write_shard_bed: BED file spanning the whole of each (name, length) reference
+    """
+    with open(bed_file, 'w') as bed:
+        for name, length in references:
+            bed.write('{}\t0\t{}\n'.format(name, length))
+
+
+def parse_map_mass(cufflinks_log):
+    """
+    parse_map_mass: normalized map mass cufflinks used as the FPKM denominator, or None
+    """
+    match = re.search(r'Normalized Map Mass:\s*([0-9.eE+-]+)', cufflinks_log)
+    return float(match.group(1)) if match else None
+
+
+def _scaled(value, scale):
+    try:
+        return '{:g}'.format(float(value) * scale)
+    except ValueError:
+        return value
+
+
+def _merge_tracking(shard_files, scales, output_file):
+    with open(output_file, 'w') as output:
+        header = None
+        for shard_file, scale in zip(shard_files, scales):
+            if not os.path.exists(shard_file):
+                continue
+            with open(shard_file) as tracking:
+                shard_header = next(tracking)
+                if header is None:
+                    header = shard_header
+                    output.write(header)
+                    columns = [header.rstrip('\n').split('\t').index(c) for c in FPKM_COLUMNS]
+                for line in tracking:
+                    larr = line.rstrip('\n').split('\t')
+                    for column in columns:
+                        larr[column] = _scaled(larr[column], scale)
+                    output.write('\t'.join(larr) + '\n')
+
+
+def _merge_gtf(shard_files, scales, output_file):
+    attribute = re.compile(r'\b({}) "([^"]*)"'.format('|'.join(GTF_FPKM_ATTRIBUTES)))
+    with open(output_file, 'w') as output:
+        for shard_file, scale in zip(shard_files, scales):
+            if not os.path.exists(shard_file):
+                continue
+            with open(shard_file) as gtf:
+                for line in gtf:
+                    output.write(attribute.sub(
+                        lambda m: '{} "{}"'.format(m.group(1), _scaled(m.group(2), scale)),
+                        line))
+
+
+def merge_shard_results(shard_directories, map_masses, result_directory):
+    """
+    merge_shard_results: combine the cufflinks outputs of all shards into result_directory,
+                         rescaling FPKM values to the total map mass of all shards
+    """
+    total_mass = float(sum(map_masses))
+    scales = [mass / total_mass if total_mass else 1.0 for mass in map_masses]
+
+    for tracking_file in TRACKING_FILES:
+        _merge_tracking([os.path.join(d, tracking_file) for d in shard_directories], scales,
+                        os.path.join(result_directory, tracking_file))
+    for gtf_file in GTF_FILES:
+        _merge_gtf([os.path.join(d, gtf_file) for d in shard_directories], scales,
+                   os.path.join(result_directory, gtf_file))
@@ -4,23 +4,28 @@ import os
 import uuid
 import errno
 import json
+import hashlib
 import re
+import shutil
 import subprocess
 import traceback
-from pathos.multiprocessing import ProcessingPool as Pool
 import multiprocessing
+import Queue
 import zipfile
 import contig_id_mapping as c_mapping
-from pprint import pprint
-
-from DataFileUtil.DataFileUtilClient import DataFileUtil
-from Workspace.WorkspaceClient import Workspace as Workspace
-from KBaseReport.KBaseReportClient import KBaseReport
-from GenomeFileUtil.GenomeFileUtilClient import GenomeFileUtil
-from AssemblyUtil.AssemblyUtilClient import AssemblyUtil
-from ReadsAlignmentUtils.ReadsAlignmentUtilsClient import ReadsAlignmentUtils
-from ExpressionUtils.ExpressionUtilsClient import ExpressionUtils
-from SetAPI.SetAPIClient import SetAPI
+from scratch_manager import ScratchManager, parse_size
+from alignment_cache import AlignmentCache, release_lease
+from annotation_slim import SlimAnnotationCache
+from gff_to_gtf import convert_gff3_to_gtf
+from resources import Resources
+from placement import (affinity_preexec, cpu_set_nodes, get_affinity, numa_nodes,
+                       plan_cpu_sets)
+from memory_limits import (DEFAULT_MEMORY_RETRIES, MemoryLimitError, degraded_options,
+                           get_memory_limit, is_memory_failure, memory_limit_preexec)
+from task_scheduling import BAM_BYTES_PER_READ, CostModel, longest_first
+from bam_utils import (BamSortCache, DEFAULT_SORT_CACHE_SIZE, read_bam_header,
+                       read_bai_mapped_counts, suggest_max_bundle_frags)
+from service_clients import ServiceClients, client_property
 
 
 def log(message, prefix_newline=False):
@@ -28,10 +33,38 @@ def log(message, prefix_newline=False):
     print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
 
 
-class CufflinksUtils:
+class CufflinksUtils(object):
     CUFFLINKS_TOOLKIT_PATH = '/opt/cufflinks/'
     GFFREAD_TOOLKIT_PATH = '/opt/cufflinks/'
 
+    # run_cufflinks params that change the Expression output; hashed for incremental runs
+    EXPRESSION_PARAMS_KEYS = ['genome_ref', 'min_intron_length', 'max_intron_length',
+                              'overhang_tolerance']
+    # hashed only when set (unset, 0 and '' leave cufflinks defaults in place), so Expressions
+    # made before these options existed stay reusable
+    EXPRESSION_OPTION_KEYS = ['max_bundle_frags', 'max_bundle_length',
+                              'no_effective_length_correction', 'frag_bias_correct',
+                              'multi_read_correct', 'library_type', 'preset',
+                              'auto_tune_bundles']
+
+    # option values applied by a preset unless the option is given explicitly
+    CUFFLINKS_PRESETS = {'fast': {'max_bundle_frags': 100000,
+                                  'max_bundle_length': 1000000,
+                                  'no_effective_length_correction': 1,
+                                  'frag_bias_correct': 0,
+                                  'multi_read_correct': 0}}
+    LIBRARY_TYPES = ['fr-unstranded', 'fr-firststrand', 'fr-secondstrand']
+    PARAMS_HASH_PREFIX = 'kb_cufflinks params_hash:'
+
+    # service clients are only built when a code path first uses them
+    dfu = client_property('dfu')
+    gfu = client_property('gfu')
+    au = client_property('au')
+    rau = client_property('rau')
+    set_api = client_property('set_api')
+    eu = client_property('eu')
+    ws = client_property('ws')
+
     def __init__(self, config):
         """
 
@@ -41,22 +74,55 @@ class CufflinksUtils:
         :param urls: Service urls
         """
         # BEGIN_CONSTRUCTOR
-        self.ws_url = config["workspace-url"]
+        self.config = config
         self.ws_url = config["workspace-url"]
         self.callback_url = config['SDK_CALLBACK_URL']
         self.srv_wiz_url = config['srv-wiz-url']
         self.token = config['KB_AUTH_TOKEN']
         self.shock_url = config['shock-url']
-        self.dfu = DataFileUtil(self.callback_url)
-        self.gfu = GenomeFileUtil(self.callback_url)
-        self.au = AssemblyUtil(self.callback_url)
-        self.rau = ReadsAlignmentUtils(self.callback_url)
-        self.set_api = SetAPI(self.srv_wiz_url, service_ver='dev')
-        self.eu = ExpressionUtils(self.callback_url)
-        self.ws = Workspace(self.ws_url, token=self.token)
-
+        self.clients = ServiceClients(config)
+
+        # reference annotation files keyed by genome ref, shared by all alignments of a run
+        self.gtf_files = {}
+        self.genome_fastas = {}
+        self.genome_upas = {}
+        self.vector_store = None
+
+        # CPUs and memory of the container, not the host, for every thread count
+        self.resources = Resources.from_config(config)
+        # with cpu-affinity, concurrent samples are pinned to disjoint CPU sets
+        self.cpu_affinity = str(config.get('cpu-affinity', '')).lower() in ('1', 'true', 'yes')
+        self.cpu_set = None
+        # address space cap of each subprocess, and retries of cufflinks runs out of memory
+        self.memory_limit = get_memory_limit(config, self.resources.memory)
+        self.memory_retries = (int(config['memory-retries'])
+                               if str(config.get('memory-retries', '')).strip() else
+                               DEFAULT_MEMORY_RETRIES)
+
+        # coordinate-sorted copies of unsorted alignment BAMs, keyed by alignment version
+        self.bam_sort_cache = BamSortCache(
+            config.get('bam-sort-cache-dir') or os.path.join(config['scratch'],
+                                                             'sorted_bam_cache'),
+            threads=self.resources.threads(config.get('samtools-sort-threads') or 1),
+            memory=config.get('samtools-sort-memory') or '768M',
+            max_size=parse_size(config.get('bam-sort-cache-size') or
+                                DEFAULT_SORT_CACHE_SIZE))
+
+        # genome GTFs cut down to the contigs and features cufflinks uses for each BAM
+        self.slim_annotation = str(config.get('slim-annotation', 'true')).lower() not in (
+            '0', 'false', 'no')
+        self.slim_annotation_cache = SlimAnnotationCache.from_config(config)
+
+        # created by run_cufflinks_app, not at construction
         self.scratch = os.path.join(config['scratch'], str(uuid.uuid4()))
-        self._mkdir_p(self.scratch)
+        self.scratch_manager = ScratchManager.from_config(config, self.scratch)
+
+        # alignment downloads shared with run_Cuffdiff, leased while cufflinks reads them
+        self.alignment_cache = AlignmentCache.from_config(config)
+        self.alignment_leases = []
+
+        # per-sample records of pool runs: estimated and actual cost, and events of the run
+        self.telemetry = []
 
         self.tool_used = "Cufflinks"
         self.tool_version = os.environ['VERSION']
@@ -119,15 +185,39 @@ class CufflinksUtils:
             if p not in params:
                 raise ValueError('"{}" parameter is required, but missing'.format(p))
 
-    def _run_command(self, command):
+        self._validate_cufflinks_options(params)
+
+    def _validate_cufflinks_options(self, params):
         """
-        _run_command: run command and print result
+        _validate_cufflinks_options: Raises an exception if preset or library_type are unknown
+        """
+        preset = params.get('preset')
+        if preset and preset not in self.CUFFLINKS_PRESETS:
+            raise ValueError('"preset" must be one of {}, not "{}"'.format(
+                sorted(self.CUFFLINKS_PRESETS.keys()), preset))
+
+        library_type = params.get('library_type')
+        if library_type and library_type not in self.LIBRARY_TYPES:
+            raise ValueError('"library_type" must be one of {}, not "{}"'.format(
+                self.LIBRARY_TYPES, library_type))
+
+    def _run_command(self, command, memory_limit=None, error_file=None):
+        """
+        _run_command: run command, under memory_limit when given, and print result; raises
+                      MemoryLimitError when it runs out of memory, with error_file, where the
+                      command sends its errors, checked as well
         """
 
         log('Start executing command:\n{}'.format(command))
-        pipe = subprocess.Popen(command, stdout=subprocess.PIPE, shell=True)
+        preexec_fn = memory_limit_preexec(
+            memory_limit, affinity_preexec(self.cpu_set) if self.cpu_set else None)
+        pipe = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                shell=True, preexec_fn=preexec_fn)
         output = pipe.communicate()[0]
         exitCode = pipe.returncode
+        if exitCode != 0 and error_file and os.path.exists(error_file):
+            with open(error_file) as errors:
+                output += errors.read()[-10000:]
 
         if (exitCode == 0):
             log('Executed command:\n{}\n'.format(command) +
@@ -136,6 +226,8 @@ class CufflinksUtils:
             error_msg = 'Error running command:\n{}\n'.format(command)
             error_msg += 'Exit Code: {}\nOutput:\n{}'.format(exitCode, output)
 
+            if is_memory_failure(exitCode, output):
+                raise MemoryLimitError(error_msg, exitCode)
             raise ValueError(error_msg)
 
     def _run_gffread(self, gff_path, gtf_path):
@@ -150,6 +242,22 @@ class CufflinksUtils:
 
         self._run_command(command)
 
+    def _convert_gff_to_gtf(self, gff_path, gtf_path):
+        """
+        _convert_gff_to_gtf: convert a GFF3 annotation to GTF in process, running gffread when
+                             the file cannot be converted
+        """
+        try:
+            num_transcripts = convert_gff3_to_gtf(gff_path, gtf_path)
+        except ValueError as e:
+            log('converting gff to gtf failed, using gffread: {}'.format(e))
+        else:
+            if num_transcripts:
+                log('converted gff to gtf: {} transcripts'.format(num_transcripts))
+                return
+            log('no transcripts found converting gff to gtf, using gffread')
+        self._run_gffread(gff_path, gtf_path)
+
     def _create_gtf_annotation_from_genome(self, genome_ref):
         """
          Create reference annotation file from genome
@@ -174,12 +282,14 @@ class CufflinksUtils:
             # get the GFF
             ret = self.gfu.genome_to_gff({'genome_ref': genome_ref})
             genome_gff_file = ret['file_path']
+            self.scratch_manager.track(genome_gff_file)
             c_mapping.replace_gff_contig_ids(genome_gff_file, mapping_filename, to_modified=True)
             gtf_ext = ".gtf"
 
             if not genome_gff_file.endswith(gtf_ext):
                 gtf_path = os.path.splitext(genome_gff_file)[0] + '.gtf'
-                self._run_gffread(genome_gff_file, gtf_path)
+                self.scratch_manager.track(gtf_path)
+                self._convert_gff_to_gtf(genome_gff_file, gtf_path)
             else:
                 gtf_path = genome_gff_file
 
@@ -194,33 +304,24 @@ class CufflinksUtils:
         """
         _get_gtf_file: get the reference annotation file (in GTF or GFF3 format)
         """
-        result_directory = self.scratch
         alignment_data = self.ws.get_objects2({'objects':
                                                [{'ref': alignment_ref}]})['data'][0]['data']
 
         genome_ref = alignment_data.get('genome_id')
-        # genome_name = self.ws.get_object_info([{"ref": genome_ref}], includeMetadata=None)[0][1]
-        # ws_gtf = genome_name+"_GTF_Annotation"
-
-        genome_data = self.ws.get_objects2({'objects':
-                                            [{'ref': genome_ref}]})['data'][0]['data']
 
-        gff_handle_ref = genome_data.get('gff_handle_ref')
-
-        if gff_handle_ref:
-            log('getting reference annotation file from genome')
-            annotation_file = self.dfu.shock_to_file({'handle_id': gff_handle_ref,
-                                                      'file_path': result_directory,
-                                                      'unpack': 'unpack'})['file_path']
-        else:
-            annotation_file = self._create_gtf_annotation_from_genome(genome_ref)
-
-        return annotation_file
+        return self._get_gtf_file_from_genome_ref(genome_ref)
 
     def _get_gtf_file_from_genome_ref(self, genome_ref):
         """
         _get_gtf_file: get the reference annotation file (in GTF or GFF3 format)
+
+        The annotation is prepared once per genome and reused by every alignment
+        processed by this runner.
         """
+        if genome_ref in self.gtf_files:
+            log('reusing reference annotation file for genome {}'.format(genome_ref))
+            return self.gtf_files[genome_ref]
+
         result_directory = self.scratch
 
         genome_data = self.ws.get_objects2({'objects':
@@ -236,14 +337,45 @@ class CufflinksUtils:
         else:
             annotation_file = self._create_gtf_annotation_from_genome(genome_ref)
 
+        self.gtf_files[genome_ref] = annotation_file
+
         return annotation_file
 
-    def _get_input_file(self, alignment_ref):
+    def _get_alignment_upa(self, alignment_ref):
         """
-        _get_input_file: get input BAM file from Alignment object
+        _get_alignment_upa: versioned ref of the alignment object a ref or ref path points to
         """
+        info = self.ws.get_object_info3({'objects': [{'ref': alignment_ref}]})['infos'][0]
+        return '{}/{}/{}'.format(info[6], info[0], info[4])
 
-        bam_file_dir = self.rau.download_alignment({'source_ref': alignment_ref})['destination_dir']
+    def _get_genome_upa(self, genome_ref, workspace_name=None):
+        """
+        _get_genome_upa: versioned ref of the genome a ref, or a name in workspace_name,
+                         points to, resolved once per run
+        """
+        if '/' not in genome_ref and workspace_name:
+            genome_ref = workspace_name + '/' + genome_ref
+        if genome_ref not in self.genome_upas:
+            info = self.ws.get_object_info3({'objects': [{'ref': genome_ref}]})['infos'][0]
+            self.genome_upas[genome_ref] = '{}/{}/{}'.format(info[6], info[0], info[4])
+        return self.genome_upas[genome_ref]
+
+    def _get_input_file(self, alignment_ref):
+        """
+        _get_input_file: get coordinate-sorted input BAM file from Alignment object
+        """
+        alignment_upa = self._get_alignment_upa(alignment_ref)
+        cached = self.bam_sort_cache.get_cached(alignment_upa)
+        if cached:
+            sorted_bam_file, lease = cached
+            self.alignment_leases.append(lease)
+            log('using cached sorted BAM {} of {}'.format(sorted_bam_file, alignment_upa))
+            return sorted_bam_file
+
+        bam_file_dir, lease = self.alignment_cache.acquire(
+            alignment_upa,
+            lambda: self.rau.download_alignment({'source_ref': alignment_ref})['destination_dir'])
+        self.alignment_leases.append(lease)
 
         files = os.listdir(bam_file_dir)
         bam_file_list = [file for file in files if re.match(r'.*\_sorted\.bam', file)]
@@ -257,7 +389,20 @@ class CufflinksUtils:
 
         bam_file = os.path.join(bam_file_dir, bam_file_name)
 
-        return bam_file
+        # cufflinks needs coordinate-sorted input; only sort when the header says otherwise
+        sorted_bam_file, lease = self.bam_sort_cache.get_sorted(bam_file, alignment_upa,
+                                                                self._run_command)
+        if lease:
+            self.alignment_leases.append(lease)
+        return sorted_bam_file
+
+    def _release_alignments(self):
+        """
+        _release_alignments: release the cached alignments and sorted BAMs leased by
+                             _get_input_file, and the slim annotations of _get_slim_gtf
+        """
+        while self.alignment_leases:
+            release_lease(self.alignment_leases.pop())
 
     def _generate_command(self, params):
         """
@@ -271,6 +416,18 @@ class CufflinksUtils:
             cufflinks_command += (' --min-intron-length ' + str(params['min_intron_length']))
         if 'overhang_tolerance' in params and params['overhang_tolerance'] is not None:
             cufflinks_command += (' --overhang-tolerance ' + str(params['overhang_tolerance']))
+        if params.get('max_bundle_frags') is not None:
+            cufflinks_command += (' --max-bundle-frags ' + str(params['max_bundle_frags']))
+        if params.get('max_bundle_length') is not None:
+            cufflinks_command += (' --max-bundle-length ' + str(params['max_bundle_length']))
+        if params.get('no_effective_length_correction'):
+            cufflinks_command += ' --no-effective-length-correction'
+        if params.get('multi_read_correct'):
+            cufflinks_command += ' --multi-read-correct'
+        if params.get('library_type'):
+            cufflinks_command += (' --library-type ' + params['library_type'])
+        if params.get('frag_bias_correct') and params.get('genome_fasta'):
+            cufflinks_command += (' --frag-bias-correct ' + params['genome_fasta'])
 
         cufflinks_command += " -o {0} -G {1} {2}".format(
             params['result_directory'], params['gtf_file'], params['input_file'])
@@ -279,6 +436,207 @@ class CufflinksUtils:
 
         return cufflinks_command
 
+    def _get_bam_depth(self, bam_file):
+        """
+        _get_bam_depth: (name, length) of every BAM reference and its mapped read count,
+                        indexing the BAM first when it has no index
+        """
+        if not os.path.exists(bam_file + '.bai'):
+            # the BAM may sit in a shared cache entry other workers read; index to a private
+            # name and move the index into place, so none of them sees a partial index
+            temp_index = '{}.{}.bai'.format(bam_file, uuid.uuid4())
+            try:
+                self._run_command('samtools index {} {}'.format(bam_file, temp_index))
+                os.rename(temp_index, bam_file + '.bai')
+            finally:
+                if os.path.exists(temp_index):
+                    os.remove(temp_index)
+        return read_bam_header(bam_file)[1], read_bai_mapped_counts(bam_file + '.bai')
+
+    def _get_cufflinks_option(self, params, key):
+        """
+        _get_cufflinks_option: the explicit value of a cufflinks option, or its preset value
+        """
+        if params.get(key) is not None:
+            return params[key]
+        return self.CUFFLINKS_PRESETS.get(params.get('preset'), {}).get(key)
+
+    def _get_genome_fasta(self, genome_ref):
+        """
+        _get_genome_fasta: genome assembly FASTA used by --frag-bias-correct, fetched once per
+                           genome
+        """
+        if genome_ref in self.genome_fastas:
+            return self.genome_fastas[genome_ref]
+
+        genome_data = self.ws.get_objects2({'objects': [
+            {'ref': genome_ref, 'included': ['contigset_ref', 'assembly_ref']}]})['data'][0]['data']
+        assembly_ref = genome_data.get('assembly_ref') or genome_data.get('contigset_ref')
+        if not assembly_ref:
+            raise ValueError(
+                "Genome at {0} does not have reference to the assembly object".format(
+                    genome_ref))
+
+        log('getting genome FASTA for fragment bias correction')
+        self.genome_fastas[genome_ref] = self.au.get_assembly_as_fasta({
+            'ref': genome_ref + ';' + assembly_ref})['path']
+        self.scratch_manager.track(self.genome_fastas[genome_ref])
+        return self.genome_fastas[genome_ref]
+
+    def _get_slim_gtf(self, gtf_file, bam_file):
+        """
+        _get_slim_gtf: the annotation cufflinks reads for bam_file, i.e. the exon and CDS
+                       records of gtf_file on the BAM's contigs, leased until
+                       _release_alignments; gtf_file itself when the BAM header cannot be read
+        """
+        try:
+            slim_gtf, counts, lease = self.slim_annotation_cache.get_slim(gtf_file, bam_file)
+        except (ValueError, IOError, OSError) as e:
+            log('using the full annotation for {}: {}'.format(bam_file, e))
+            return gtf_file
+        self.alignment_leases.append(lease)
+        log('slim annotation for {}: kept {} records, removed {} on contigs not in the BAM, '
+            '{} other features and {} duplicates'.format(
+                bam_file, counts['kept'], counts['other_contigs'], counts['other_features'],
+                counts['duplicates']))
+        return slim_gtf
+
+    def _resolve_cufflinks_options(self, params):
+        """
+        _resolve_cufflinks_options: params with num_threads within the CPU limit, preset
+                                    values filled in, the genome FASTA for
+                                    fragment bias correction, with auto_tune_bundles a
+                                    --max-bundle-frags chosen from the BAM read depth
+        """
+        params = params.copy()
+        params['num_threads'] = self.resources.threads(params.get('num_threads'))
+        for key in self.CUFFLINKS_PRESETS.get(params.get('preset'), {}):
+            params[key] = self._get_cufflinks_option(params, key)
+
+        if params.get('frag_bias_correct') and not params.get('genome_fasta'):
+            params['genome_fasta'] = self._get_genome_fasta(params['genome_ref'])
+
+        if params.get('auto_tune_bundles') and params.get('max_bundle_frags') is None:
+            references, counts = self._get_bam_depth(params['input_file'])
+            params['max_bundle_frags'] = suggest_max_bundle_frags(references, counts)
+            log('auto-tuned max_bundle_frags for {}: {}'.format(params['input_file'],
+                                                                params['max_bundle_frags']))
+
+        return params
+
+    def _run_cufflinks_command(self, params, memory_limit=None, error_file=None):
+        """
+        _run_cufflinks_command: run cufflinks, retrying with fewer threads and a tighter
+                                --max-bundle-frags when it runs out of memory; retries are
+                                recorded in the telemetry; runs under memory_limit, or
+                                self.memory_limit when not given
+        """
+        memory_limit = memory_limit or self.memory_limit
+        redirect = ' 2> ' + error_file if error_file else ''
+        for attempt in range(self.memory_retries + 1):
+            try:
+                self._run_command(self._generate_command(params) + redirect, memory_limit,
+                                  error_file)
+                return
+            except MemoryLimitError as e:
+                if attempt == self.memory_retries:
+                    raise
+                num_threads, max_bundle_frags = degraded_options(
+                    params.get('num_threads'), params.get('max_bundle_frags'))
+                self.telemetry.append({'event': 'memory_retry', 'tool': 'cufflinks',
+                                       'input_file': params['input_file'],
+                                       'attempt': attempt + 1, 'exit_code': e.exit_code,
+                                       'memory_limit': memory_limit,
+                                       'num_threads': num_threads,
+                                       'max_bundle_frags': max_bundle_frags})
+                log('cufflinks ran out of memory on {}, retrying with {} threads and '
+                    'max_bundle_frags {}'.format(params['input_file'], num_threads,
+                                                 max_bundle_frags))
+                params = dict(params, num_threads=num_threads,
+                              max_bundle_frags=max_bundle_frags)
+
+    def _run_cufflinks(self, params):
+        """
+        _run_cufflinks: run cufflinks for one alignment, split into contig shards when
+                        shard_by_contig is set
+        """
+        params = self._resolve_cufflinks_options(params)
+        if self.slim_annotation:
+            params['gtf_file'] = self._get_slim_gtf(params['gtf_file'], params['input_file'])
+        # the input is staged; stop before cufflinks if its outputs cannot fit
+        self.scratch_manager.check_space()
+
+        if params.get('shard_by_contig'):
+            num_shards = params.get('num_shards') or params.get('num_threads') or 1
+            if num_shards > 1 and self._run_sharded_cufflinks(params, num_shards):
+                return
+        self._run_cufflinks_command(params)
+
+    def _run_sharded_cufflinks(self, params, num_shards):
+        """
+        _run_sharded_cufflinks: run cufflinks in parallel on groups of contigs with similar
+                                read counts and merge the shard outputs into the result
+                                directory; returns False when there are fewer than two shards
+        """
+        import cufflinks_shards as shards
+        from multiprocessing.pool import ThreadPool
+
+        bam_file = params['input_file']
+        references, counts = self._get_bam_depth(bam_file)
+        shard_references = shards.assign_shards([name for name, length in references], counts,
+                                                num_shards)
+        if len(shard_references) < 2:
+            log('not sharding {}: reads are on fewer than two contigs'.format(bam_file))
+            return False
+
+        shard_root = params['result_directory'].rstrip('/') + '_shards'
+        shard_directories = [os.path.join(shard_root, 'shard_{}'.format(i))
+                             for i in range(len(shard_references))]
+        for shard_directory in shard_directories:
+            self._mkdir_p(shard_directory)
+        gtf_files = shards.split_gtf(params['gtf_file'], shard_references, shard_directories)
+        reference_lengths = dict(references)
+
+        def run_shard(i):
+            shard_directory = shard_directories[i]
+            bed_file = os.path.join(shard_directory, 'contigs.bed')
+            shards.write_shard_bed([(name, reference_lengths[name])
+                                    for name in shard_references[i]], bed_file)
+            shard_bam = os.path.join(shard_directory, 'alignment.bam')
+            self._run_command('samtools view -b -M -L {} -o {} {}'.format(
+                bed_file, shard_bam, bam_file))
+
+            shard_params = params.copy()
+            shard_params.update({'result_directory': shard_directory,
+                                 'gtf_file': gtf_files[i],
+                                 'input_file': shard_bam,
+                                 'num_threads': 1})
+            log_file = os.path.join(shard_directory, 'cufflinks.log')
+            self._run_cufflinks_command(shard_params, shard_memory_limit, log_file)
+            with open(log_file) as cufflinks_log:
+                return shards.parse_map_mass(cufflinks_log.read())
+
+        log('running cufflinks on {} contig shards of {}'.format(len(shard_references),
+                                                                 bam_file))
+        num_workers = min(len(shard_references), params.get('num_threads') or 1)
+        # concurrent shards share the memory cap of the run
+        shard_memory_limit = self.memory_limit // num_workers if self.memory_limit else None
+        pool = ThreadPool(num_workers)
+        try:
+            map_masses = pool.map(run_shard, range(len(shard_references)))
+        finally:
+            pool.close()
+
+        if None in map_masses:
+            # fall back to the index read counts when cufflinks did not report its map mass
+            read_counts = dict(zip([name for name, length in references], counts))
+            map_masses = [sum(read_counts[name] for name in shard)
+                          for shard in shard_references]
+        shards.merge_shard_results(shard_directories, map_masses, params['result_directory'])
+        shutil.rmtree(shard_root)
+
+        return True
+
     def _process_rnaseq_alignment_object(self, params):
         """
         _process_alignment_object: process KBaseRNASeq.RNASeqAlignment type input object
@@ -299,8 +657,10 @@ class CufflinksUtils:
         if '/' not in params['genome_ref']:
             params['genome_ref'] = params['workspace_name']+'/'+params['genome_ref']
 
-        command = self._generate_command(params)
-        self._run_command(command)
+        try:
+            self._run_cufflinks(params)
+        finally:
+            self._release_alignments()
 
         expression_obj_ref = self._save_rnaseq_expression(result_directory,
                                                    alignment_ref,
@@ -338,15 +698,23 @@ class CufflinksUtils:
         if not params.get('gtf_file'):
             params['gtf_file'] = self._get_gtf_file(alignment_ref)
 
-        command = self._generate_command(params)
-        self._run_command(command)
+        try:
+            self._run_cufflinks(params)
+        finally:
+            self._release_alignments()
 
         expression_obj_ref = self._save_kbasesets_expression(result_directory,
                                                    alignment_ref,
                                                    params.get('workspace_name'),
                                                    params.get('genome_ref'),
                                                    params.get('gtf_file'),
-                                                   params.get('expression_suffix'))
+                                                   params.get('expression_suffix'),
+                                                   self._get_expression_params_hash(params))
+
+        # columnar copy of the tracking files, so the ExpressionMatrix of this run and of
+        # incremental runs reusing the Expression memory-map the levels instead of
+        # re-parsing or downloading them
+        self._get_vector_store().add_sample(expression_obj_ref, result_directory)
 
         returnVal = {'result_directory': result_directory,
                      'expression_obj_ref': expression_obj_ref,
@@ -360,59 +728,89 @@ class CufflinksUtils:
 
         return returnVal
 
-    def _generate_html_report(self, result_directory, obj_ref):
+    def _get_report_objects(self, obj_refs):
         """
-        _generate_html_report: generate html summary report
+        _get_report_objects: info and set items of generated Expression/ExpressionSet objects,
+                             fetched with one subset call instead of downloading each object
+        """
+        return self.ws.get_objects2({'objects': [
+            {'ref': obj_ref, 'included': ['items', 'sample_expression_ids']}
+            for obj_ref in obj_refs]})['data']
+
+    def _get_expression_items(self, expression_object):
+        """
+        _get_expression_items: (expression ref, condition) pairs of a generated set object
+        """
+        expression_object_type = expression_object['info'][2]
+        expression_data = expression_object['data']
+        if re.match('KBaseRNASeq.RNASeqExpressionSet-\d.\d', expression_object_type):
+            return [(expression_ref, '')
+                    for expression_ref in expression_data['sample_expression_ids']]
+        if re.match('KBaseSets.ExpressionSet-\d.\d', expression_object_type):
+            return [(item['ref'], item['label']) for item in expression_data['items']]
+        return []
+
+    def _add_overview_tables(self, report, expression_objects, input_refs=None):
+        """
+        _add_overview_tables: add the generated object and expression tables to the report,
+                              naming every set item with one batched info call
+        """
+        item_lists = [self._get_expression_items(expression_object)
+                      for expression_object in expression_objects]
+        item_refs = [ref for items in item_lists for ref, condition in items]
+        item_names = iter([])
+        if item_refs:
+            item_names = iter(info[1] for info in self.ws.get_object_info3(
+                {'objects': [{'ref': ref} for ref in item_refs]})['infos'])
+
+        object_columns = ['Object Name', 'Object Type', 'Reference']
+        expression_columns = ['Expression Set', 'Condition', 'Expression Name', 'Reference']
+        if input_refs:
+            object_columns.insert(0, 'Input Object')
+        object_rows = list()
+        expression_rows = list()
+        for i, (expression_object, items) in enumerate(zip(expression_objects, item_lists)):
+            info = expression_object['info']
+            row = [info[1], info[2].split('-')[0], '{}/{}/{}'.format(info[6], info[0], info[4])]
+            if input_refs:
+                row.insert(0, input_refs[i])
+            object_rows.append(row)
+            for expression_ref, condition in items:
+                expression_rows.append([info[1], condition, next(item_names), expression_ref])
+
+        report.add_table('Generated Objects', object_columns, object_rows)
+        if expression_rows:
+            report.add_table('Generated Expression Objects', expression_columns, expression_rows)
+
+    def _write_html_report(self, report):
+        """
+        _write_html_report: write the report page and its data file and return html_links
         """
-        log('Start generating html report')
         html_report = list()
 
         output_directory = os.path.join(self.scratch, str(uuid.uuid4()))
         self._mkdir_p(output_directory)
-        result_file_path = os.path.join(output_directory, 'report.html')
-
-        expression_object = self.ws.get_objects2({'objects':
-                                                  [{'ref': obj_ref}]})['data'][0]
-
-        expression_object_type = expression_object.get('info')[2]
-
-        Overview_Content = ''
-        if re.match('KBaseRNASeq.RNASeqExpression-\d.\d', expression_object_type):
-            Overview_Content += '<p>Generated Expression Object:</p><p>{}</p>'.format(
-                expression_object.get('info')[1])
-        elif re.match('KBaseRNASeq.RNASeqExpressionSet-\d.\d', expression_object_type):
-            Overview_Content += '<p>Generated Expression Set Object:</p><p>{}</p>'.format(
-                expression_object.get('info')[1])
-            Overview_Content += '<br><p>Generated Expression Object:</p>'
-            for expression_ref in expression_object['data']['sample_expression_ids']:
-                expression_name = self.ws.get_object_info([{"ref": expression_ref}],
-                                                          includeMetadata=None)[0][1]
-                Overview_Content += '<p>{}</p>'.format(expression_name)
-        elif re.match('KBaseSets.ExpressionSet-\d.\d', expression_object_type):
-            pprint(expression_object)
-            Overview_Content += '<p>Generated Expression Set Object:</p><p>{}</p>'.format(
-                expression_object.get('info')[1])
-            Overview_Content += '<br><p>Generated Expression Object:</p>'
-            for expression_ref in expression_object['data']['items']:
-                expression_name = self.ws.get_object_info([{"ref": expression_ref['ref']}],
-                                                          includeMetadata=None)[0][1]
-                condition = expression_ref['label']
-                Overview_Content += '<p>condition:{0}; expression_name: {1}</p>'.format(condition, expression_name)
-
-        with open(result_file_path, 'w') as result_file:
-            with open(os.path.join(os.path.dirname(__file__), 'report_template.html'),
-                      'r') as report_template_file:
-                report_template = report_template_file.read()
-                report_template = report_template.replace('<p>Overview_Content</p>',
-                                                          Overview_Content)
-                result_file.write(report_template)
-
-        html_report.append({'path': result_file_path,
+        result_file_path = report.write(output_directory)
+
+        # the directory is uploaded, so the page can load its data file
+        html_report.append({'path': output_directory,
                             'name': os.path.basename(result_file_path),
                             'label': os.path.basename(result_file_path),
                             'description': 'HTML summary report for Cufflinks App'})
         return html_report
 
+    def _generate_html_report(self, result_directory, expression_object):
+        """
+        _generate_html_report: generate html summary report
+        """
+        log('Start generating html report')
+
+        from html_report import PaginatedReport
+        report = PaginatedReport()
+        self._add_overview_tables(report, [expression_object])
+
+        return self._write_html_report(report)
+
     def _save_rnaseq_expression(self, result_directory, alignment_ref,
                                 workspace_name, genome_ref, gtf_file,
                                 expression_suffix):
@@ -446,10 +844,13 @@ class CufflinksUtils:
 
     def _save_kbasesets_expression(self, result_directory, alignment_ref,
                                    workspace_name, genome_ref, gtf_file,
-                                   expression_suffix):
+                                   expression_suffix, params_hash=None):
         """
         _save_kbasesets_expression: save Expression object to workspace using ExpressionUtils
         and SetAPI
+
+        params_hash is recorded in the Expression description so a later incremental run
+        can tell whether the object can be reused.
         """
         log('start saving Expression object')
 
@@ -473,6 +874,7 @@ class CufflinksUtils:
             'tool_used': self.tool_used,
             'tool_version': self.tool_version,
             'annotation_ref': gff_annotation_obj_ref,
+            'description': self.PARAMS_HASH_PREFIX + str(params_hash),
         })['obj_ref']
 
         return expression_ref
@@ -537,22 +939,14 @@ class CufflinksUtils:
 
         return expression_set_ref
 
-    def _generate_report(self, obj_ref, workspace_name, result_directory,
-                         exprMatrix_FPKM_ref=None, exprMatrix_TPM_ref=None):
+    def _generate_objects_created(self, expression_object, exprMatrix_FPKM_ref=None,
+                                  exprMatrix_TPM_ref=None):
         """
-        _generate_report: generate summary report
+        _generate_objects_created: list the objects created for a generated Expression or
+        ExpressionSet object, as returned by _get_report_objects
         """
-
-        log('creating report')
-
-        output_files = self._generate_output_file_list(result_directory)
-        output_html_files = self._generate_html_report(result_directory,
-                                                       obj_ref)
-
-        expression_object = self.ws.get_objects2({'objects':
-                                                 [{'ref': obj_ref}]})['data'][0]
         expression_info = expression_object['info']
-        expression_data = expression_object['data']
+        obj_ref = '{}/{}/{}'.format(expression_info[6], expression_info[0], expression_info[4])
 
         expression_object_type = expression_info[2]
         if re.match('KBaseRNASeq.RNASeqExpression-\d+.\d+', expression_object_type):
@@ -564,15 +958,20 @@ class CufflinksUtils:
         elif re.match('KBaseSets.ExpressionSet-\d+.\d+', expression_object_type):
             objects_created = [{'ref': obj_ref,
                                 'description': 'ExpressionSet generated by Cufflinks'}]
-            items = expression_data['items']
-            for item in items:
-                objects_created.append({'ref': item['ref'],
+            for expression_ref, condition in self._get_expression_items(expression_object):
+                objects_created.append({'ref': expression_ref,
                                         'description': 'Expression generated by Cufflinks'})
             objects_created.append({'ref': exprMatrix_FPKM_ref,
                                     'description': 'FPKM ExpressionMatrix generated by Cufflinks'})
             objects_created.append({'ref': exprMatrix_TPM_ref,
                                     'description': 'TPM ExpressionMatrix generated by Cufflinks'})
 
+        return objects_created
+
+    def _create_report(self, workspace_name, output_files, objects_created, output_html_files):
+        """
+        _create_report: save the KBaseReport and return its name and ref
+        """
         report_params = {'message': '',
                          'workspace_name': workspace_name,
                          'file_links': output_files,
@@ -582,13 +981,63 @@ class CufflinksUtils:
                          'html_window_height': 366,
                          'report_object_name': 'kb_cufflinks_report_' + str(uuid.uuid4())}
 
-        kbase_report_client = KBaseReport(self.callback_url, token=self.token)
-        output = kbase_report_client.create_extended_report(report_params)
+        output = self.clients.kbase_report.create_extended_report(report_params)
 
         report_output = {'report_name': output['name'], 'report_ref': output['ref']}
 
         return report_output
 
+    def _generate_report(self, obj_ref, workspace_name, result_directory,
+                         exprMatrix_FPKM_ref=None, exprMatrix_TPM_ref=None):
+        """
+        _generate_report: generate summary report
+        """
+
+        log('creating report')
+
+        output_files = self._generate_output_file_list(result_directory)
+        expression_object = self._get_report_objects([obj_ref])[0]
+        output_html_files = self._generate_html_report(result_directory,
+                                                       expression_object)
+
+        objects_created = self._generate_objects_created(expression_object,
+                                                         exprMatrix_FPKM_ref,
+                                                         exprMatrix_TPM_ref)
+
+        return self._create_report(workspace_name, output_files, objects_created,
+                                   output_html_files)
+
+    def _generate_batch_report(self, batch_results, workspace_name):
+        """
+        _generate_batch_report: generate one summary report covering every input of a
+        run_cufflinks_batch call
+        """
+        log('creating batch report')
+
+        from html_report import PaginatedReport
+
+        expression_objects = self._get_report_objects(
+            [result['expression_obj_ref'] for result in batch_results])
+
+        output_files = list()
+        objects_created = list()
+        for result, expression_object in zip(batch_results, expression_objects):
+            for output_file in self._generate_output_file_list(result['result_directory']):
+                output_file['name'] = result['output'] + '_' + output_file['name']
+                output_file['label'] = output_file['name']
+                output_files.append(output_file)
+            objects_created.extend(self._generate_objects_created(
+                expression_object, result.get('exprMatrix_FPKM_ref'),
+                result.get('exprMatrix_TPM_ref')))
+
+        report = PaginatedReport()
+        self._add_overview_tables(report, expression_objects,
+                                  [result['alignment_object_ref'] for result in batch_results])
+        output_html_files = self._write_html_report(report)
+
+        return self._create_report(workspace_name, output_files, objects_created,
+                                   output_html_files)
+
     def _parse_FPKMtracking(self, filename, metric):
         result = {}
         pos1 = 0
@@ -768,15 +1217,13 @@ class CufflinksUtils:
 
         return expression_set_data
 
-    def _process_alignment_set_object(self, params, alignment_object_type):
+    def _generate_alignment_set_tasks(self, params, alignment_object_type):
         """
-        _process_alignment_set_object: process KBaseRNASeq.RNASeqAlignmentSet type input object
-                                        and KBaseSets.ReadsAlignmentSet type object
+        _generate_alignment_set_tasks: prepare the reference annotation and build one
+                                       _process_kbasesets_alignment_object params dict per
+                                       alignment in a KBaseRNASeq.RNASeqAlignmentSet or
+                                       KBaseSets.ReadsAlignmentSet object
         """
-        log('start processing KBaseRNASeq.RNASeqAlignmentSet object or KBaseSets.ReadsAlignmentSet object'
-            '\nparams:\n{}'.format(
-            json.dumps(params, indent=1)))
-
         alignment_set_ref = params.get('alignment_set_ref')
 
         if re.match('^KBaseRNASeq.RNASeqAlignmentSet-\d*', alignment_object_type):
@@ -787,6 +1234,12 @@ class CufflinksUtils:
 
             params['gtf_file'] = self._get_gtf_file_from_genome_ref(params['genome_ref'])
 
+        if self._get_cufflinks_option(params, 'frag_bias_correct'):
+            genome_ref = params['genome_ref']
+            if '/' not in genome_ref:
+                genome_ref = params['workspace_name'] + '/' + genome_ref
+            params['genome_fasta'] = self._get_genome_fasta(genome_ref)
+
         alignment_set = self.set_api.get_reads_alignment_set_v1({
                                                                 'ref': alignment_set_ref,
                                                                 'include_item_info': 0,
@@ -801,28 +1254,209 @@ class CufflinksUtils:
             # use the following when you want to run the cmd sequentially
             # self._process_kbasesets_alignment_object(mul_processor_params[0])
 
-        cpus = min(params.get('num_threads'), multiprocessing.cpu_count())
-        pool = Pool(ncpus=cpus)
-        log('running _process_alignment_object with {} cpus'.format(cpus))
-        alignment_expression_map = pool.map(self._process_kbasesets_alignment_object, mul_processor_params)
+        return mul_processor_params
+
+    def _estimate_alignment_costs(self, mul_processor_params):
+        """
+        _estimate_alignment_costs: expected cost of every task in mapped reads, from the
+                                   alignment stats of the alignment object or the size of an
+                                   already downloaded BAM; None when neither is known
+        """
+        try:
+            objects = self.ws.get_objects2({'objects': [
+                {'ref': task['alignment_ref'], 'included': ['alignment_stats/mapped_reads']}
+                for task in mul_processor_params]})['data']
+        except Exception as e:
+            log('cannot estimate alignment costs, keeping set order: {}'.format(e))
+            return [None] * len(mul_processor_params)
+
+        costs = list()
+        for obj in objects:
+            mapped_reads = (obj['data'].get('alignment_stats') or {}).get('mapped_reads')
+            if mapped_reads:
+                costs.append(mapped_reads)
+                continue
+            info = obj['info']
+            size = self.alignment_cache.cached_size('{}/{}/{}'.format(info[6], info[0], info[4]))
+            costs.append(size / BAM_BYTES_PER_READ if size else None)
+        return costs
+
+    def _plan_worker_cpu_sets(self, num_workers, threads_per_worker):
+        """
+        _plan_worker_cpu_sets: queue of the disjoint CPU sets pool workers pin their
+                               subprocesses to, or None without cpu-affinity or for a single
+                               worker
+        """
+        if not self.cpu_affinity or num_workers < 2:
+            return None
+        nodes = numa_nodes()
+        cpu_sets = plan_cpu_sets(num_workers,
+                                 get_affinity() or range(multiprocessing.cpu_count()),
+                                 nodes, threads_per_worker)
+        if not cpu_sets:
+            log('not pinning samples: fewer CPUs than concurrent samples')
+            return None
+
+        queue = multiprocessing.Queue()
+        for i, cpus in enumerate(cpu_sets):
+            log('sample slot {}: CPUs {} on NUMA node(s) {}'.format(
+                i, ','.join(str(cpu) for cpu in cpus), cpu_set_nodes(cpus, nodes)))
+            queue.put(cpus)
+        return queue
+
+    def _run_alignment_tasks(self, mul_processor_params, num_threads):
+        """
+        _run_alignment_tasks: run _process_kbasesets_alignment_object for every task on one
+                              worker pool, most expensive first, yielding the results in task
+                              order as soon as they and the ones before them finish
+        """
+        if not mul_processor_params:
+            return
+
+        costs = self._estimate_alignment_costs(mul_processor_params)
+        order = longest_first(costs)
+        log('dispatching alignment tasks longest first: {}'.format(
+            ', '.join('{} ({} reads)'.format(i, 'unknown' if costs[i] is None else costs[i])
+                      for i in order)))
+        cost_model = CostModel()
+
+        # num_threads is the thread budget of the whole run, shared by the concurrent samples
+        budget = self.resources.threads(num_threads)
+        cpus = min(budget, len(mul_processor_params))
+        task_params = list()
+        for task in mul_processor_params:
+            task = task.copy()
+            task['num_threads'] = max(1, budget // cpus)
+            task_params.append(task)
+        cpu_sets = self._plan_worker_cpu_sets(cpus, max(1, budget // cpus))
+        # workers build their own CufflinksUtils once; tasks only carry their params
+        # concurrent samples share the job's memory
+        memory_limit = get_memory_limit(self.config, self.resources.memory, cpus)
+        pool = multiprocessing.Pool(cpus, _init_alignment_worker,
+                                    (self.config, self.scratch, cpu_sets, memory_limit))
+        log('running _process_alignment_object with {} cpus, {} threads per sample ({})'.format(
+            cpus, max(1, budget // cpus), self.resources))
+        finished = {}
+        next_index = 0
+        try:
+            for index, result, record in pool.imap_unordered(
+                    _run_alignment_task, [(i, task_params[i]) for i in order]):
+                record.update({'alignment_ref': mul_processor_params[index]['alignment_ref'],
+                               'estimated_cost': costs[index],
+                               'estimated_seconds': cost_model.estimate(costs[index])})
+                cost_model.record(costs[index], record['seconds'])
+                self.telemetry.append(record)
+                log('finished alignment task {} ({} of {}): estimated {}, took {:.1f} s'.format(
+                    index, len(finished) + next_index + 1, len(mul_processor_params),
+                    'n/a' if record['estimated_seconds'] is None else
+                    '{:.1f} s'.format(record['estimated_seconds']), record['seconds']))
+                finished[index] = result
+                while next_index in finished:
+                    if next_index == len(mul_processor_params) - 1:
+                        # every task is done; let the workers go before the last result
+                        pool.close()
+                        pool.join()
+                        if cost_model.total_cost:
+                            log('alignment cost model: {:.2f} s per million mapped reads'.format(
+                                cost_model.estimate(1000000)))
+                    yield finished.pop(next_index)
+                    next_index += 1
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _get_vector_store(self):
+        """
+        _get_vector_store: cache of the memory-mappable expression vectors, kept across runs
+        """
+        if self.vector_store is None:
+            from expression_vectors import ExpressionVectorStore
+            self.vector_store = ExpressionVectorStore.from_config(self.config)
+        return self.vector_store
+
+    def _load_vector_levels(self, alignment_expression_map):
+        """
+        _load_vector_levels: (gene ids, log2 FPKM, log2 TPM) of the samples with cached
+                             vectors, keyed by expression ref; vectors of the samples run
+                             now are written from their result directories on a miss
+        """
+        vector_store = self._get_vector_store()
+        vector_levels = dict()
+        try:
+            for r in alignment_expression_map:
+                vector_directory = vector_store.get_sample(
+                    r.get('expression_obj_ref'),
+                    None if r.get('reused') else r.get('result_directory'))
+                if vector_directory:
+                    vector_levels[r.get('expression_obj_ref')] = \
+                        vector_store.load_log2_levels(vector_directory)
+        finally:
+            vector_store.release()
+        return vector_levels
+
+    def _get_expression_levels(self, expression_refs):
+        """
+        _get_expression_levels: FPKM and TPM levels stored on Expression objects, fetched
+                                with one subset call
+        """
+        if not expression_refs:
+            return {}
+
+        expressions = self.ws.get_objects2({'objects': [
+            {'ref': ref, 'included': ['expression_levels', 'tpm_expression_levels']}
+            for ref in expression_refs]})['data']
+
+        return dict((ref, (expression['data'].get('expression_levels', {}),
+                           expression['data'].get('tpm_expression_levels', {})))
+                    for ref, expression in zip(expression_refs, expressions))
+
+    def _save_alignment_set_results(self, params, alignment_expression_map):
+        """
+        _save_alignment_set_results: collect the per-alignment cufflinks results of one
+                                     alignment set, save them as a KBaseSets.ExpressionSet and
+                                     save its FPKM and TPM ExpressionMatrix objects
+        """
+        from expression_matrix import ExpressionMatrixBuilder
 
         result_directory = os.path.join(self.scratch, str(uuid.uuid4()))
         self._mkdir_p(result_directory)
 
+        alignment_infos = self.ws.get_object_info3({
+            'objects': [{"ref": r.get('alignment_ref')} for r in alignment_expression_map],
+            'includeMetadata': 1})['infos']
+        expression_infos = self.ws.get_object_info3({
+            'objects': [{"ref": r.get('expression_obj_ref')} for r in alignment_expression_map]
+        })['infos']
+
+        # reused expressions were not parsed by this run; their vectors are cached by the run
+        # that made them, and the levels are read from the objects when they are not
+        vector_levels = self._load_vector_levels(alignment_expression_map)
+        reused_levels = self._get_expression_levels(
+            [r.get('expression_obj_ref') for r in alignment_expression_map
+             if r.get('expression_obj_ref') not in vector_levels])
+
+        matrix_builder = ExpressionMatrixBuilder()
         expression_items = list()
-        for proc_alignment_return in alignment_expression_map:
+        for proc_alignment_return, alignment_info, expression_info in zip(
+                alignment_expression_map, alignment_infos, expression_infos):
             expression_obj_ref = proc_alignment_return.get('expression_obj_ref')
-            alignment_ref = proc_alignment_return.get('alignment_ref')
-            alignment_info = self.ws.get_object_info3({'objects': [{"ref": alignment_ref}], 'includeMetadata': 1})
-            condition = alignment_info['infos'][0][10]['condition']
+            condition = alignment_info[10]['condition']
+            expression_name = expression_info[1]
             expression_items.append({
                 "ref": expression_obj_ref,
                 "label": condition,
             })
-            expression_name = self.ws.get_object_info([{"ref": expression_obj_ref}],
-                                                      includeMetadata=None)[0][1]
-            self._run_command('cp -R {} {}'.format(proc_alignment_return.get('result_directory'),
-                                                   os.path.join(result_directory, expression_name)))
+            if expression_obj_ref in reused_levels:
+                fpkm_levels, tpm_levels = reused_levels[expression_obj_ref]
+                matrix_builder.add_sample(expression_name, fpkm_levels, tpm_levels, condition)
+            else:
+                gene_ids, fpkm, tpm = vector_levels[expression_obj_ref]
+                matrix_builder.add_sample_columns(expression_name, gene_ids, fpkm, tpm,
+                                                  condition)
+            if not proc_alignment_return.get('reused'):
+                self._run_command('cp -R {} {}'.format(
+                    proc_alignment_return.get('result_directory'),
+                    os.path.join(result_directory, expression_name)))
 
         expression_set = {
             "description": "generated by kb_cufflinks",
@@ -838,12 +1472,129 @@ class CufflinksUtils:
         returnVal = {'result_directory': result_directory,
                      'expression_obj_ref': expression_set_info['set_ref']}
 
+        expression_matrix_refs = self._save_expression_matrix(params['expression_set_name'],
+                                                              params['workspace_name'],
+                                                              params['genome_ref'],
+                                                              matrix_builder)
+        returnVal.update(expression_matrix_refs)
+
         widget_params = {"output": params.get('expression_set_name'),
                          "workspace": params.get('workspace_name')}
         returnVal.update(widget_params)
 
         return returnVal
 
+    def _get_expression_params_hash(self, params):
+        """
+        _get_expression_params_hash: fingerprint of the params that determine the cufflinks
+                                     output of an alignment; the genome is hashed as its
+                                     versioned ref, so a new genome version is not reused
+        """
+        hashed_params = dict((k, params.get(k)) for k in self.EXPRESSION_PARAMS_KEYS)
+        if params.get('genome_ref'):
+            hashed_params['genome_ref'] = self._get_genome_upa(params['genome_ref'],
+                                                               params.get('workspace_name'))
+        hashed_params.update((k, params[k]) for k in self.EXPRESSION_OPTION_KEYS
+                             if params.get(k))
+        hashed_params['tool_version'] = self.tool_version
+        return hashlib.sha1(json.dumps(hashed_params, sort_keys=True)).hexdigest()
+
+    def _get_prior_expression_set_ref(self, params):
+        """
+        _get_prior_expression_set_ref: the KBaseSets.ExpressionSet an incremental run builds
+                                       on, either given as previous_expression_set_ref or the
+                                       existing object named expression_set_name
+        """
+        prior_ref = params.get('previous_expression_set_ref')
+        if not prior_ref:
+            prior_ref = params['workspace_name'] + '/' + params['expression_set_name']
+
+        prior_info = self.ws.get_object_info3({'objects': [{'ref': prior_ref}],
+                                               'ignoreErrors': 1})['infos'][0]
+        if not prior_info:
+            log('no prior expression set found at {}'.format(prior_ref))
+            return None
+        if not re.match('^KBaseSets.ExpressionSet-\d*', prior_info[2]):
+            log('prior object {} is {}, not a KBaseSets.ExpressionSet'.format(prior_ref,
+                                                                             prior_info[2]))
+            return None
+
+        return '{}/{}/{}'.format(prior_info[6], prior_info[0], prior_info[4])
+
+    def _find_reusable_expressions(self, params, mul_processor_params):
+        """
+        _find_reusable_expressions: match alignment tasks against the items of the prior
+                                    expression set
+
+        An Expression is reused when it was made from the same alignment version with the
+        same params hash. Returns a list parallel to mul_processor_params holding either a
+        result dict for a reused Expression or None for alignments that must be run.
+        """
+        reused = [None] * len(mul_processor_params)
+
+        prior_set_ref = self._get_prior_expression_set_ref(params)
+        if not prior_set_ref:
+            return reused
+
+        prior_set = self.set_api.get_expression_set_v1({'ref': prior_set_ref,
+                                                        'include_item_info': 0})
+        prior_items = prior_set['data']['items']
+        if not prior_items:
+            return reused
+
+        # one subset call for all items; the expression levels are not downloaded
+        prior_expressions = self.ws.get_objects2({'objects': [
+            {'ref': prior_set_ref + ';' + item['ref'],
+             'included': ['mapped_rnaseq_alignment', 'description']}
+            for item in prior_items]})['data']
+
+        prior_by_key = dict()
+        for item, expression in zip(prior_items, prior_expressions):
+            description = expression['data'].get('description') or ''
+            if not description.startswith(self.PARAMS_HASH_PREFIX):
+                continue
+            params_hash = description[len(self.PARAMS_HASH_PREFIX):]
+            for alignment_ref in expression['data'].get('mapped_rnaseq_alignment', {}).values():
+                # the last element of a ref path is the versioned alignment itself
+                prior_by_key[(alignment_ref.split(';')[-1], params_hash)] = item['ref']
+
+        for index, task in enumerate(mul_processor_params):
+            alignment_ref = task['alignment_ref']
+            key = (alignment_ref.split(';')[-1], self._get_expression_params_hash(task))
+            if key in prior_by_key:
+                reused[index] = {'expression_obj_ref': prior_by_key[key],
+                                 'alignment_ref': alignment_ref,
+                                 'result_directory': None,
+                                 'reused': True}
+
+        log('incremental run reuses {} of {} expressions from {}'.format(
+            len([r for r in reused if r]), len(reused), prior_set_ref))
+
+        return reused
+
+    def _process_alignment_set_object(self, params, alignment_object_type):
+        """
+        _process_alignment_set_object: process KBaseRNASeq.RNASeqAlignmentSet type input object
+                                        and KBaseSets.ReadsAlignmentSet type object
+        """
+        log('start processing KBaseRNASeq.RNASeqAlignmentSet object or KBaseSets.ReadsAlignmentSet object'
+            '\nparams:\n{}'.format(
+            json.dumps(params, indent=1)))
+
+        mul_processor_params = self._generate_alignment_set_tasks(params, alignment_object_type)
+
+        if params.get('incremental'):
+            reused = self._find_reusable_expressions(params, mul_processor_params)
+        else:
+            reused = [None] * len(mul_processor_params)
+
+        run_results = iter(self._run_alignment_tasks(
+            [task for task, prior in zip(mul_processor_params, reused) if not prior],
+            params.get('num_threads')))
+        alignment_expression_map = [prior or next(run_results) for prior in reused]
+
+        return self._save_alignment_set_results(params, alignment_expression_map)
+
     def _generate_output_object_name(self, params, alignment_object_type, alignment_object_name):
         """
         Generates the output object name based on input object type and name and stores it in
@@ -883,33 +1634,179 @@ class CufflinksUtils:
             else:  # assume user specified suffix
                 params['expression_set_name'] = alignment_object_name + expression_set_suffix
 
-    def _save_expression_matrix(self, expressionset_ref, workspace_name):
+    def _save_expression_matrix(self, expression_set_name, workspace_name, genome_ref,
+                                matrix_builder):
         """
-        _save_expression_matrix: save FPKM and TPM ExpressionMatrix
+        _save_expression_matrix: save FPKM and TPM ExpressionMatrix built from the levels
+                                 parsed by this run
         """
 
         log('start saving ExpressionMatrix object')
 
-        expression_set_name = self.ws.get_object_info([{"ref": expressionset_ref}],
-                                                      includeMetadata=None)[0][1]
+        if isinstance(workspace_name, int) or workspace_name.isdigit():
+            workspace_id = workspace_name
+        else:
+            workspace_id = self.dfu.ws_name_to_id(workspace_name)
+
+        if '/' not in genome_ref:
+            genome_ref = workspace_name + '/' + genome_ref
 
         output_obj_name_prefix = re.sub('_*[Ee]xpression_*[Ss]et',
                                         '',
                                         expression_set_name)
 
-        upload_expression_matrix_params = {'expressionset_ref': expressionset_ref,
-                                           'output_obj_name': output_obj_name_prefix,
-                                           'workspace_name': workspace_name}
+        fpkm_matrix_data, tpm_matrix_data = matrix_builder.get_matrix_data(genome_ref)
+        log('ExpressionMatrix has {} genes and {} samples'.format(
+            len(matrix_builder.row_ids), len(matrix_builder.col_ids)))
 
-        expression_matrix_refs = self.eu.get_expressionMatrix(upload_expression_matrix_params)
+        object_type = 'KBaseFeatureValues.ExpressionMatrix'
+        save_object_params = {
+            'id': workspace_id,
+            'objects': [{'type': object_type,
+                         'data': fpkm_matrix_data,
+                         'name': output_obj_name_prefix + '_FPKM_ExpressionMatrix'},
+                        {'type': object_type,
+                         'data': tpm_matrix_data,
+                         'name': output_obj_name_prefix + '_TPM_ExpressionMatrix'}]
+        }
+
+        fpkm_oi, tpm_oi = self.dfu.save_objects(save_object_params)
+
+        expression_matrix_refs = {
+            'exprMatrix_FPKM_ref': str(fpkm_oi[6]) + '/' + str(fpkm_oi[0]) + '/' + str(fpkm_oi[4]),
+            'exprMatrix_TPM_ref': str(tpm_oi[6]) + '/' + str(tpm_oi[0]) + '/' + str(tpm_oi[4])}
 
         return expression_matrix_refs
 
+    def _validate_run_cufflinks_batch_params(self, params):
+        """
+        _validate_run_cufflinks_batch_params:
+                Raises an exception if params are invalid
+        """
+
+        log('Start validating run_cufflinks_batch params')
+
+        # check for required parameters
+        for p in ['alignment_object_refs', 'workspace_name', 'genome_ref']:
+            if p not in params:
+                raise ValueError('"{}" parameter is required, but missing'.format(p))
+
+        if not isinstance(params['alignment_object_refs'], list) or \
+                not params['alignment_object_refs']:
+            raise ValueError('"alignment_object_refs" must be a non-empty list')
+
+        self._validate_cufflinks_options(params)
+
+    def run_cufflinks_batch_app(self, params):
+        """
+        run_cufflinks_batch_app: run cufflinks on many alignment and alignment set objects
+
+        The reference annotation is prepared once per genome, all samples of all inputs
+        are scheduled on a single worker pool, and every input gets its own Expression or
+        ExpressionSet (with ExpressionMatrix objects for sets). One report covers the batch.
+        Scratch space of the run is removed afterwards, except the result directories.
+        """
+        with self.scratch_manager.job():
+            returnVal = self._run_cufflinks_batch_app(params)
+            for result in returnVal['results']:
+                self.scratch_manager.retain(result.get('result_directory'))
+        log('workspace cache: {}'.format(self.clients.workspace_cache_stats()))
+        if self.telemetry:
+            log('run telemetry:\n{}'.format(json.dumps(self.telemetry, indent=1)))
+        return returnVal
+
+    def _run_cufflinks_batch_app(self, params):
+        log('--->\nrunning CufflinksUtil.run_cufflinks_batch_app\n' +
+            'params:\n{}'.format(json.dumps(params, indent=1)))
+
+        self._validate_run_cufflinks_batch_params(params)
+        self._mkdir_p(self.scratch)
+
+        alignment_object_refs = params['alignment_object_refs']
+        alignment_object_infos = self.ws.get_object_info3({
+            "objects": [{"ref": ref} for ref in alignment_object_refs]})['infos']
+
+        if '/' not in params['genome_ref']:
+            params['genome_ref'] = params['workspace_name'] + '/' + params['genome_ref']
+
+        batch_items = list()
+        mul_processor_params = list()
+        for alignment_object_ref, alignment_object_info in zip(alignment_object_refs,
+                                                               alignment_object_infos):
+            item_params = dict((k, v) for k, v in params.iteritems()
+                               if k != 'alignment_object_refs')
+            item_params['alignment_object_ref'] = alignment_object_ref
+
+            alignment_object_type = alignment_object_info[2]
+            alignment_object_name = alignment_object_info[1]
+            self._generate_output_object_name(item_params, alignment_object_type,
+                                              alignment_object_name)
+
+            if re.match('^KBaseRNASeq.RNASeqAlignment-\d*', alignment_object_type):
+                item_params['alignment_ref'] = alignment_object_ref
+                item_params['gtf_file'] = self._get_gtf_file(alignment_object_ref)
+                item_tasks = [item_params.copy()]
+                is_set = False
+            elif re.match('^KBaseRNASeq.RNASeqAlignmentSet-\d*', alignment_object_type) or \
+                    re.match('^KBaseSets.ReadsAlignmentSet-\d*', alignment_object_type):
+                item_params['alignment_set_ref'] = alignment_object_ref
+                item_tasks = self._generate_alignment_set_tasks(item_params,
+                                                                alignment_object_type)
+                is_set = True
+            else:
+                raise ValueError('None RNASeqAlignment type\nObject info:\n{}'.format(
+                    alignment_object_info))
+
+            if is_set and item_params.get('incremental'):
+                reused = self._find_reusable_expressions(item_params, item_tasks)
+            else:
+                reused = [None] * len(item_tasks)
+
+            mul_processor_params.extend(
+                [task for task, prior in zip(item_tasks, reused) if not prior])
+            batch_items.append((item_params, is_set, reused))
+
+        log('running {} samples from {} inputs on one worker pool'.format(
+            len(mul_processor_params), len(batch_items)))
+        run_results = iter(self._run_alignment_tasks(mul_processor_params,
+                                                     params.get('num_threads')))
+
+        results = list()
+        for item_params, is_set, reused in batch_items:
+            alignment_expression_map = [prior or next(run_results) for prior in reused]
+            if is_set:
+                returnVal = self._save_alignment_set_results(item_params,
+                                                             alignment_expression_map)
+            else:
+                returnVal = dict(alignment_expression_map[0])
+            returnVal['alignment_object_ref'] = item_params['alignment_object_ref']
+            results.append(returnVal)
+
+        returnVal = {'results': results}
+        report_output = self._generate_batch_report(results, params.get('workspace_name'))
+        returnVal.update(report_output)
+
+        return returnVal
+
     def run_cufflinks_app(self, params):
+        """
+        run_cufflinks_app: run cufflinks on an alignment or alignment set object, removing
+                           the scratch space of the run afterwards except the result directory
+        """
+        with self.scratch_manager.job():
+            returnVal = self._run_cufflinks_app(params)
+            self.scratch_manager.retain(returnVal.get('result_directory'))
+        log('workspace cache: {}'.format(self.clients.workspace_cache_stats()))
+        if self.telemetry:
+            log('run telemetry:\n{}'.format(json.dumps(self.telemetry, indent=1)))
+        return returnVal
+
+    def _run_cufflinks_app(self, params):
         log('--->\nrunning CufflinksUtil.run_cufflinks_app\n' +
             'params:\n{}'.format(json.dumps(params, indent=1)))
 
         self._validate_run_cufflinks_params(params)
+        self._mkdir_p(self.scratch)
 
         alignment_object_ref = params.get('alignment_object_ref')
         alignment_object_info = self.ws.get_object_info3({
@@ -935,18 +1832,51 @@ class CufflinksUtils:
              re.match('^KBaseSets.ReadsAlignmentSet-\d*', alignment_object_type):
             params.update({'alignment_set_ref': alignment_object_ref})
             returnVal = self._process_alignment_set_object(params, alignment_object_type)
-            expression_matrix_refs = self._save_expression_matrix(returnVal['expression_obj_ref'],
-                                                                  params.get('workspace_name'))
-            returnVal.update(expression_matrix_refs)
 
             report_output = self._generate_report(returnVal['expression_obj_ref'],
                                                   params.get('workspace_name'),
                                                   returnVal['result_directory'],
-                                                  expression_matrix_refs['exprMatrix_FPKM_ref'],
-                                                  expression_matrix_refs['exprMatrix_TPM_ref'])
+                                                  returnVal['exprMatrix_FPKM_ref'],
+                                                  returnVal['exprMatrix_TPM_ref'])
             returnVal.update(report_output)
         else:
             raise ValueError('None RNASeqAlignment type\nObject info:\n{}'.format(
                 alignment_object_info))
 
         return returnVal
+
+
+# CufflinksUtils of an alignment task pool worker, built once per process
+_worker_utils = None
+
+
+def _init_alignment_worker(config, scratch, cpu_sets=None, memory_limit=None):
+    """
+    _init_alignment_worker: pool initializer building the worker's CufflinksUtils, sharing
+                            the scratch job directory of the run that started the pool, with
+                            the worker's share of the memory, and taking the worker's CPU set
+                            when samples are pinned
+    """
+    global _worker_utils
+    _worker_utils = CufflinksUtils(config)
+    _worker_utils.scratch = scratch
+    _worker_utils.scratch_manager = ScratchManager.from_config(config, scratch)
+    _worker_utils.memory_limit = memory_limit
+    if cpu_sets is not None:
+        try:
+            _worker_utils.cpu_set = cpu_sets.get_nowait()
+        except Queue.Empty:
+            # a replacement worker after all sets were taken runs unpinned
+            pass
+
+
+def _run_alignment_task(task):
+    """
+    _run_alignment_task: (task index, result, telemetry record) of one alignment task
+    """
+    index, params = task
+    _worker_utils.telemetry = []
+    start_time = time.time()
+    result = _worker_utils._process_kbasesets_alignment_object(params)
+    return index, result, {'seconds': time.time() - start_time, 'pid': os.getpid(),
+                           'cpus': _worker_utils.cpu_set, 'events': _worker_utils.telemetry}
@@ -0,0 +1,165 @@
+import os
+import uuid
+import errno
+import hashlib
+import json
+import traceback
+import script_utils
+from alignment_cache import LeasedCache, release_lease
+from scratch_manager import parse_size
+
+DEFAULT_CACHE_SIZE = '10G'
+
+
+def get_file_fingerprint(file_path):
+    """
+    get_file_fingerprint: sha1 of a file's contents
+    """
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), ''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class CuffQuant:
+    """
+    Runs cuffquant once per alignment against a merged annotation and keeps the resulting
+    abundances.cxb files, so cuffdiff and cuffnorm runs over new contrasts of the same
+    samples only pay for the statistics step.
+
+    Cached files are keyed by the alignment object version, the merged GTF contents and
+    the quantification options, and kept in a size-bounded LRU cache; the files a run
+    uses are leased until release() is called.
+    """
+
+    # cuffdiff options that change what cuffquant measures
+    QUANT_OPTION_KEYS = ['library_type', 'multi_read_correct']
+
+    def __init__(self, config, logger=None):
+        self.config = config
+        self.logger = logger
+        self.cache_directory = config.get('cuffquant-cache-dir') or os.path.join(
+            config['scratch'], 'cuffquant_cache')
+        self.cache = LeasedCache(
+            self.cache_directory,
+            parse_size(config.get('cuffquant-cache-size') or DEFAULT_CACHE_SIZE),
+            logger, 'cuffquant abundances')
+        self.leases = []
+
+    def get_cache_key(self, alignment_upa, gtf_fingerprint, params):
+        """
+        get_cache_key: cache key of an alignment quantified against a merged GTF
+        """
+        options = dict((k, params.get(k)) for k in self.QUANT_OPTION_KEYS if params.get(k))
+        key = json.dumps([alignment_upa, gtf_fingerprint, options], sort_keys=True)
+        return hashlib.sha1(key).hexdigest()
+
+    def _get_quant_options(self, params):
+        options = ''
+        if params.get('multi_read_correct'):
+            options += ' --multi-read-correct'
+        if params.get('library_type'):
+            options += ' --library-type ' + params['library_type']
+        return options
+
+    def run_cuffquant(self, directory, num_threads, merged_gtf, bam_file, params):
+        """
+        run_cuffquant: quantify one BAM file against merged_gtf, returns the .cxb file
+        """
+        cuffquant_command = " -p {0} -o {1}{2} {3} {4}".format(str(num_threads),
+                                                               directory,
+                                                               self._get_quant_options(params),
+                                                               merged_gtf,
+                                                               bam_file)
+        try:
+            script_utils.runProgram(self.logger, "cuffquant", cuffquant_command, None)
+        except Exception:
+            raise Exception(
+                "Error executing cuffquant {0},{1}".format(cuffquant_command,
+                                                           "".join(traceback.format_exc())))
+        cxb_file = os.path.join(directory, 'abundances.cxb')
+        if not os.path.exists(cxb_file):
+            raise ValueError('cuffquant did not write {}'.format(cxb_file))
+        return cxb_file
+
+    def _lease(self, cached):
+        entry, lease = cached
+        self.leases.append(lease)
+        return os.path.join(entry, 'abundances.cxb')
+
+    def get_cached_abundances(self, alignment_upas, merged_gtf, params):
+        """
+        get_cached_abundances: .cxb file of every alignment quantified against this merged
+                               GTF before, None for the others
+        """
+        gtf_fingerprint = get_file_fingerprint(merged_gtf)
+        cxb_files = list()
+        for upa in alignment_upas:
+            cached = self.cache.acquire_cached(self.get_cache_key(upa, gtf_fingerprint, params))
+            cxb_files.append(self._lease(cached) if cached else None)
+        return cxb_files
+
+    def get_abundances(self, bam_files, alignment_upas, merged_gtf, num_threads, params):
+        """
+        get_abundances: .cxb file of every alignment, running cuffquant in parallel for the
+                        alignments not quantified against this merged GTF before; only their
+                        BAM files are read, the others may be None
+        """
+        from multiprocessing.pool import ThreadPool
+
+        cxb_files = self.get_cached_abundances(alignment_upas, merged_gtf, params)
+        missing = [i for i, cxb_file in enumerate(cxb_files) if cxb_file is None]
+        self.logger.info('{} of {} samples need cuffquant'.format(len(missing), len(cxb_files)))
+        if not missing:
+            return cxb_files
+
+        try:
+            os.makedirs(self.cache_directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        gtf_fingerprint = get_file_fingerprint(merged_gtf)
+
+        def quantify(i):
+            def run():
+                # quantify into a private directory, published as the cache entry when complete
+                quant_dir = os.path.join(self.cache_directory, '.cuffquant_' + str(uuid.uuid4()))
+                self.run_cuffquant(quant_dir, max(1, num_threads // len(missing)),
+                                   merged_gtf, bam_files[i], params)
+                return quant_dir
+            cxb_files[i] = self._lease(self.cache.acquire(
+                self.get_cache_key(alignment_upas[i], gtf_fingerprint, params), run))
+
+        pool = ThreadPool(min(len(missing), num_threads))
+        try:
+            pool.map(quantify, missing)
+        finally:
+            pool.close()
+            pool.join()
+        return cxb_files
+
+    def release(self):
+        """
+        release: drop the leases on the .cxb files handed out so far
+        """
+        while self.leases:
+            release_lease(self.leases.pop())
+
+    def run_cuffnorm(self, directory, num_threads, merged_gtf, labels, sample_groups):
+        """
+        run_cuffnorm: normalized expression tables of the .cxb sample groups (one
+                      comma-separated group per label)
+        """
+        cuffnorm_command = " -p {0} -o {1} -L {2} {3} {4}".format(str(num_threads),
+                                                                  directory,
+                                                                  ",".join(labels),
+                                                                  merged_gtf,
+                                                                  " ".join(sample_groups))
+        try:
+            script_utils.runProgram(self.logger, "cuffnorm", cuffnorm_command, None)
+        except Exception:
+            raise Exception(
+                "Error executing cuffnorm {0},{1}".format(cuffnorm_command,
+                                                          "".join(traceback.format_exc())))
+        return directory
@@ -0,0 +1,103 @@
+"""
+Builds FPKM and TPM KBaseFeatureValues.ExpressionMatrix data from per-sample expression levels,
+so the matrices can be saved without downloading the Expression objects again.
+"""
+
+import numpy as np
+
+
+class ExpressionMatrixBuilder(object):
+    """
+    Assembles gene x sample FPKM and TPM matrices as samples are added.
+
+    Rows are the union of the gene ids of all samples, in first-seen order. A gene that is
+    not reported for a sample is recorded as not expressed (log2(0 + 1) = 0).
+    """
+
+    def __init__(self):
+        self.row_ids = []
+        self.col_ids = []
+        self.condition_mapping = {}
+        self._row_index = {}
+        self._columns = []
+        # (gene id list, rows) of the last lookup; samples sharing an index share the list
+        self._last_rows = (None, None)
+
+    def _get_rows(self, gene_ids):
+        """
+        _get_rows: row indices of gene_ids, adding unseen genes to the end of the row list
+        """
+        rows = np.empty(len(gene_ids), dtype=np.intp)
+        for i, gene_id in enumerate(gene_ids):
+            row = self._row_index.get(gene_id)
+            if row is None:
+                row = len(self.row_ids)
+                self._row_index[gene_id] = row
+                self.row_ids.append(gene_id)
+            rows[i] = row
+        return rows
+
+    def add_sample(self, col_id, fpkm_levels, tpm_levels, condition=None):
+        """
+        add_sample: add one sample column
+
+        fpkm_levels/tpm_levels: dicts of gene id to log2(FPKM + 1)/log2(TPM + 1), as produced
+        by CufflinksUtils.parse_FPKMtracking_calc_TPM or stored on an Expression object
+        """
+        gene_ids = list(fpkm_levels.keys())
+        fpkm = np.array([fpkm_levels[g] for g in gene_ids], dtype=np.float64)
+        tpm = np.array([tpm_levels.get(g, 0.0) for g in gene_ids], dtype=np.float64)
+        self.add_sample_columns(col_id, gene_ids, fpkm, tpm, condition)
+
+    def add_sample_columns(self, col_id, gene_ids, fpkm, tpm, condition=None):
+        """
+        add_sample_columns: add one sample column from arrays aligned with gene_ids, such as
+                            the memory-mapped vectors of ExpressionVectorStore.load_log2_levels
+        """
+        if col_id in self.col_ids:
+            raise ValueError('Sample {} was added twice'.format(col_id))
+
+        if self._last_rows[0] is gene_ids:
+            rows = self._last_rows[1]
+        else:
+            rows = self._get_rows(gene_ids)
+            self._last_rows = (gene_ids, rows)
+
+        self.col_ids.append(col_id)
+        if condition is not None:
+            self.condition_mapping[col_id] = condition
+        self._columns.append((rows, fpkm, tpm))
+
+    def build(self):
+        """
+        build: return the (FPKM, TPM) value arrays, shaped genes x samples
+        """
+        shape = (len(self.row_ids), len(self.col_ids))
+        fpkm_values = np.zeros(shape, dtype=np.float64)
+        tpm_values = np.zeros(shape, dtype=np.float64)
+        for col, (rows, fpkm, tpm) in enumerate(self._columns):
+            fpkm_values[rows, col] = fpkm
+            tpm_values[rows, col] = tpm
+        return fpkm_values, tpm_values
+
+    def _matrix_data(self, values, genome_ref, description):
+        return {'type': 'level',
+                'scale': 'log2',
+                'genome_ref': genome_ref,
+                'description': description,
+                'condition_mapping': dict(self.condition_mapping),
+                'feature_mapping': dict((row_id, row_id) for row_id in self.row_ids),
+                'data': {'row_ids': list(self.row_ids),
+                         'col_ids': list(self.col_ids),
+                         'values': values.tolist()}}
+
+    def get_matrix_data(self, genome_ref):
+        """
+        get_matrix_data: return the FPKM and TPM ExpressionMatrix object data
+        """
+        if not self.col_ids:
+            raise ValueError('No samples were added to the expression matrix')
+
+        fpkm_values, tpm_values = self.build()
+        return (self._matrix_data(fpkm_values, genome_ref, 'log2(FPKM + 1) matrix'),
+                self._matrix_data(tpm_values, genome_ref, 'log2(TPM + 1) matrix'))
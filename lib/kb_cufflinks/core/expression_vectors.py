@@ -0,0 +1,221 @@
+"""
+Columnar, memory-mappable copies of the per-sample cufflinks tracking files.
+
+For every sample the gene and isoform FPKM, TPM, confidence bounds and status are written
+as one .npy file per column into a cache entry keyed by the Expression object saved for the
+sample. The cache outlives the job, like the alignment cache, so the ExpressionMatrix of a
+run and later incremental runs that reuse the Expression memory-map the levels instead of
+re-parsing tracking files or downloading the object. Rows follow a feature id index that
+is stored once for all samples with the same ids, named by the hash of its contents.
+
+Entries are only served to the token that wrote them and are kept in a size-bounded LRU
+cache; the shared index files are not evicted, there is one per annotation.
+"""
+
+import os
+import errno
+import hashlib
+import shutil
+import uuid
+
+import numpy as np
+
+from alignment_cache import LeasedCache
+from scratch_manager import parse_size
+
+TRACKING_FILES = {'genes': 'genes.fpkm_tracking',
+                  'isoforms': 'isoforms.fpkm_tracking'}
+
+COLUMNS = ['FPKM', 'TPM', 'FPKM_conf_lo', 'FPKM_conf_hi', 'FPKM_status']
+
+# FPKM_status values reported by cufflinks, stored as their index (-1 for anything else)
+STATUS_CODES = ['OK', 'LOWDATA', 'HIDATA', 'FAIL']
+
+DEFAULT_CACHE_SIZE = '2G'
+INDEX_DIRECTORY = '.index'
+
+
+def parse_tracking_file(filename):
+    """
+    parse_tracking_file: read a cufflinks *.fpkm_tracking file into columns
+
+    As in CufflinksUtils.parse_FPKMtracking_calc_TPM, rows with an empty tracking id are
+    skipped, a repeated id keeps its last row and TPM is relative to the FPKM of all kept rows.
+    """
+    rows = {}
+    order = []
+    fpkm_sum = 0.0
+    with open(filename) as f:
+        header = next(f).rstrip('\n').split('\t')
+        id_col = header.index('tracking_id')
+        fpkm_col = header.index('FPKM')
+        lo_col = header.index('FPKM_conf_lo')
+        hi_col = header.index('FPKM_conf_hi')
+        status_col = header.index('FPKM_status')
+        for line in f:
+            larr = line.rstrip('\n').split('\t')
+            tracking_id = larr[id_col]
+            if tracking_id == '':
+                continue
+            fpkm = float(larr[fpkm_col])
+            fpkm_sum += fpkm
+            if tracking_id not in rows:
+                order.append(tracking_id)
+            status = larr[status_col]
+            rows[tracking_id] = (fpkm, float(larr[lo_col]), float(larr[hi_col]),
+                                 STATUS_CODES.index(status) if status in STATUS_CODES else -1)
+
+    values = np.array([rows[row_id] for row_id in order],
+                      dtype=np.float64).reshape(len(order), 4)
+    fpkm = values[:, 0]
+    tpm = fpkm / fpkm_sum * 1e6 if fpkm_sum > 0 else np.zeros(len(order))
+
+    return order, {'FPKM': fpkm,
+                   'TPM': tpm,
+                   'FPKM_conf_lo': values[:, 1],
+                   'FPKM_conf_hi': values[:, 2],
+                   'FPKM_status': values[:, 3].astype(np.int8)}
+
+
+def _read_ids(path):
+    with open(path) as f:
+        return [line.rstrip('\n') for line in f]
+
+
+def _write_ids(path, ids):
+    with open(path, 'w') as f:
+        for feature_id in ids:
+            f.write(feature_id + '\n')
+
+
+class ExpressionVectorStore(object):
+    """
+    Writes and memory-maps the per-sample expression vectors, keyed by Expression object ref
+    """
+
+    def __init__(self, cache_directory, max_size=None, logger=None):
+        self.cache_directory = cache_directory
+        self.index_directory = os.path.join(cache_directory, INDEX_DIRECTORY)
+        self.cache = LeasedCache(cache_directory, max_size, logger, 'expression vectors')
+        self.leases = []
+        self._ids = {}
+
+    @classmethod
+    def from_config(cls, config, logger=None):
+        cache_directory = config.get('expression-vector-cache-dir') or os.path.join(
+            config['scratch'], 'expression_vectors')
+        # vectors written with one token are never served to another
+        return cls(os.path.join(cache_directory,
+                                hashlib.sha1(config.get('KB_AUTH_TOKEN') or '').hexdigest()),
+                   parse_size(config.get('expression-vector-cache-size') or DEFAULT_CACHE_SIZE),
+                   logger)
+
+    def _get_ids(self, path):
+        """
+        _get_ids: read an id index once, so samples sharing it share one list object
+        """
+        if path not in self._ids:
+            self._ids[path] = _read_ids(path)
+        return self._ids[path]
+
+    def _publish_index(self, ids):
+        """
+        _publish_index: store ids under the hash of their contents and return the hash
+        """
+        try:
+            os.makedirs(self.index_directory)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+        index_hash = hashlib.sha1('\n'.join(ids)).hexdigest()
+        index_path = os.path.join(self.index_directory, index_hash + '.ids')
+        if not os.path.exists(index_path):
+            temp_path = index_path + '.' + str(uuid.uuid4())
+            _write_ids(temp_path, ids)
+            try:
+                # atomic: fails if a concurrent worker published the same ids first
+                os.link(temp_path, index_path)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+            finally:
+                os.remove(temp_path)
+        return index_hash
+
+    def _write_vectors(self, result_directory):
+        """
+        _write_vectors: write the vectors of a cufflinks result directory into a new
+                        directory of the cache and return it
+        """
+        vector_directory = os.path.join(self.cache_directory, '.vectors_' + str(uuid.uuid4()))
+        os.makedirs(vector_directory)
+        try:
+            for feature, tracking_file in TRACKING_FILES.iteritems():
+                tracking_path = os.path.join(result_directory, tracking_file)
+                if not os.path.exists(tracking_path):
+                    continue
+                ids, columns = parse_tracking_file(tracking_path)
+                with open(os.path.join(vector_directory, feature + '.index'), 'w') as f:
+                    f.write(self._publish_index(ids))
+                for column in COLUMNS:
+                    np.save(os.path.join(vector_directory, '{}.{}.npy'.format(feature, column)),
+                            columns[column])
+        except Exception:
+            shutil.rmtree(vector_directory, ignore_errors=True)
+            raise
+        return vector_directory
+
+    def add_sample(self, expression_ref, result_directory):
+        """
+        add_sample: store the vectors of the cufflinks result directory an Expression object
+                    was saved from
+        """
+        vector_directory, lease = self.cache.acquire(
+            expression_ref, lambda: self._write_vectors(result_directory))
+        self.cache.release(lease)
+        return vector_directory
+
+    def get_sample(self, expression_ref, result_directory=None):
+        """
+        get_sample: directory of the vectors of an Expression object, leased until release();
+                    a miss is written from result_directory when given, or returns None
+        """
+        if result_directory:
+            vector_directory, lease = self.cache.acquire(
+                expression_ref, lambda: self._write_vectors(result_directory))
+        else:
+            cached = self.cache.acquire_cached(expression_ref)
+            if cached is None:
+                return None
+            vector_directory, lease = cached
+        self.leases.append(lease)
+        return vector_directory
+
+    def release(self):
+        """
+        release: drop the leases taken by get_sample
+        """
+        while self.leases:
+            self.cache.release(self.leases.pop())
+
+    def load_sample(self, vector_directory, feature='genes', columns=COLUMNS):
+        """
+        load_sample: return the feature ids and the memory-mapped columns of a sample
+        """
+        with open(os.path.join(vector_directory, feature + '.index')) as f:
+            ids = self._get_ids(os.path.join(self.index_directory, f.read().strip() + '.ids'))
+
+        return ids, dict((column,
+                          np.load(os.path.join(vector_directory,
+                                               '{}.{}.npy'.format(feature, column)),
+                                  mmap_mode='r'))
+                         for column in columns)
+
+    def load_log2_levels(self, vector_directory):
+        """
+        load_log2_levels: gene ids with log2(FPKM + 1) and log2(TPM + 1) arrays, the levels
+                          stored on Expression objects and ExpressionMatrix objects
+        """
+        ids, columns = self.load_sample(vector_directory, 'genes', ['FPKM', 'TPM'])
+        return ids, np.log2(columns['FPKM'] + 1), np.log2(columns['TPM'] + 1)
@@ -0,0 +1,172 @@
+"""
+Streaming GFF3 to GTF conversion, writing the exon and CDS records of every transcript the
+way 'gffread -E -T' does, without running gffread on a full intermediate copy.
+
+Features are grouped by their Parent attribute in one pass. Transcripts are written when
+the next top-level feature starts past the end of the current locus, and nothing is kept
+of the loci already written, so memory stays bounded by the largest locus for gene-ordered
+files. A child whose parent is not in the current locus means the file is not gene-ordered
+(the parent was written out, or comes later); the conversion is then redone holding all
+features until the end of the file.
+"""
+
+import urllib
+
+# features whose coordinates make up the exons of their parent transcript
+SEGMENT_TYPES = ('exon', 'CDS', 'five_prime_UTR', 'three_prime_UTR', 'UTR')
+
+
+class GffOrderError(ValueError):
+    """
+    A feature refers to a parent outside the current locus
+    """
+    pass
+
+
+def _parse_attributes(column):
+    attributes = {}
+    for field in column.strip().split(';'):
+        if '=' in field:
+            key, value = field.split('=', 1)
+            attributes[key.strip()] = value.strip()
+    return attributes
+
+
+def _merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class _Locus(object):
+    """
+    Features of the transcripts not written out yet
+    """
+
+    def __init__(self):
+        self.features = {}
+        self.segments = {}
+        self.order = []
+        self.seqid = None
+        self.end = 0
+
+    def transcripts(self):
+        """
+        transcripts: ids of the features to write as transcripts: parents of segments and
+                     child features without children of their own
+        """
+        parent_ids = set(parent for feature in self.features.values()
+                         for parent in feature['parents'])
+        transcript_ids = set(self.segments)
+        transcript_ids.update(feature_id for feature_id, feature in self.features.items()
+                              if feature['parents'] and feature_id not in parent_ids)
+        return [feature_id for feature_id in self.order if feature_id in transcript_ids]
+
+
+def _write_transcript(gtf, locus, transcript_id):
+    feature = locus.features.get(transcript_id)
+    segments = locus.segments.get(transcript_id, [])
+    first = feature or segments[0]
+
+    gene_id = transcript_id
+    gene_name = None
+    if feature and feature['parents']:
+        gene_id = feature['parents'][0]
+        gene = locus.features.get(gene_id)
+        gene_name = gene['attributes'].get('Name') if gene else None
+    elif feature:
+        gene_name = feature['attributes'].get('Name')
+
+    exons = [[s['start'], s['end']] for s in segments if s['type'] == 'exon']
+    if not exons:
+        exons = _merge_intervals([(s['start'], s['end']) for s in segments])
+    if not exons:
+        exons = [[feature['start'], feature['end']]]
+    cds = sorted((s['start'], s['end'], s['phase']) for s in segments if s['type'] == 'CDS')
+
+    attributes = 'transcript_id "{}"; gene_id "{}";'.format(transcript_id, gene_id)
+    if gene_name:
+        attributes += ' gene_name "{}";'.format(urllib.unquote(gene_name))
+    for start, end in sorted(exons):
+        gtf.write('\t'.join([first['seqid'], first['source'], 'exon', str(start), str(end),
+                             '.', first['strand'], '.', attributes]) + '\n')
+    for start, end, phase in cds:
+        gtf.write('\t'.join([first['seqid'], first['source'], 'CDS', str(start), str(end),
+                             '.', first['strand'], phase, attributes]) + '\n')
+
+
+def _flush(gtf, locus, seqids):
+    transcripts = locus.transcripts()
+    positions = {}
+    for transcript_id in transcripts:
+        feature = locus.features.get(transcript_id)
+        segments = locus.segments.get(transcript_id, [])
+        positions[transcript_id] = (seqids[(feature or segments[0])['seqid']],
+                                    min([s['start'] for s in segments] +
+                                        ([feature['start']] if feature else [])),
+                                    transcript_id)
+    for transcript_id in sorted(transcripts, key=lambda t: positions[t]):
+        _write_transcript(gtf, locus, transcript_id)
+    return len(transcripts)
+
+
+def _convert(gff_file, gtf_file, streaming):
+    locus = _Locus()
+    # sequences in order of first appearance, the order transcripts are written in
+    seqids = {}
+    num_transcripts = 0
+    with open(gff_file) as gff, open(gtf_file, 'w') as gtf:
+        for line_number, line in enumerate(gff, 1):
+            if line.startswith('##FASTA'):
+                break
+            if line.startswith('#') or not line.strip():
+                continue
+            fields = line.rstrip('\r\n').split('\t')
+            if len(fields) != 9:
+                raise ValueError('line {} of {} is not a GFF record'.format(line_number,
+                                                                          gff_file))
+            attributes = _parse_attributes(fields[8])
+            parents = [urllib.unquote(p) for p in attributes.get('Parent', '').split(',') if p]
+            feature = {'seqid': fields[0], 'source': fields[1], 'type': fields[2],
+                       'start': int(fields[3]), 'end': int(fields[4]), 'strand': fields[6],
+                       'phase': fields[7], 'parents': parents, 'attributes': attributes}
+            feature_id = urllib.unquote(attributes.get('ID', ''))
+            seqids.setdefault(fields[0], len(seqids))
+
+            if streaming and not parents and (fields[0] != locus.seqid or
+                                              feature['start'] > locus.end):
+                num_transcripts += _flush(gtf, locus, seqids)
+                locus = _Locus()
+                locus.seqid = fields[0]
+            if not parents:
+                locus.end = max(locus.end, feature['end'])
+            if streaming and any(parent not in locus.features for parent in parents):
+                raise GffOrderError('{} is not gene-ordered'.format(gff_file))
+
+            if feature['type'] in SEGMENT_TYPES:
+                for parent in parents or [feature_id or '{}:{}-{}'.format(
+                        fields[0], fields[3], fields[4])]:
+                    if parent not in locus.segments and parent not in locus.features:
+                        locus.order.append(parent)
+                    locus.segments.setdefault(parent, []).append(feature)
+            elif feature_id:
+                if feature_id not in locus.segments:
+                    locus.order.append(feature_id)
+                locus.features[feature_id] = feature
+        num_transcripts += _flush(gtf, locus, seqids)
+    return num_transcripts
+
+
+def convert_gff3_to_gtf(gff_file, gtf_file):
+    """
+    convert_gff3_to_gtf: write the transcripts of a GFF3 file as GTF exon and CDS records;
+                         returns the number of transcripts written
+    """
+    try:
+        return _convert(gff_file, gtf_file, streaming=True)
+    except GffOrderError:
+        return _convert(gff_file, gtf_file, streaming=False)
@@ -0,0 +1,60 @@
+"""
+HTML summary reports whose tables live in a compact JSON side file.
+
+report.html holds the page shell and the first page of each table; report_data.json holds
+all the rows, and the page renders one page of each table at a time, so neither writing nor
+opening the report grows with the number of samples or condition pairs beyond the size of
+the data itself. When the data file cannot be loaded the page says so and keeps showing the
+inline first pages.
+"""
+
+import os
+import json
+
+REPORT_TEMPLATE = os.path.join(os.path.dirname(__file__), 'report_template.html')
+REPORT_FILE_NAME = 'report.html'
+DATA_FILE_NAME = 'report_data.json'
+
+
+class PaginatedReport(object):
+    """
+    Collects the summary tables of one report
+    """
+
+    def __init__(self, page_size=25):
+        self.page_size = page_size
+        self.tables = []
+
+    def add_table(self, title, columns, rows):
+        """
+        add_table: add a table rendered from the data file; rows are lists aligned with columns
+        """
+        self.tables.append({'title': title,
+                            'columns': list(columns),
+                            'rows': [[u'' if value is None else value for value in row]
+                                     for row in rows]})
+
+    def write(self, output_directory):
+        """
+        write: write report.html and report_data.json to output_directory and return the
+               report.html path
+        """
+        with open(os.path.join(output_directory, DATA_FILE_NAME), 'w') as data_file:
+            json.dump({'page_size': self.page_size, 'tables': self.tables}, data_file,
+                      separators=(',', ':'))
+
+        with open(REPORT_TEMPLATE, 'r') as report_template_file:
+            report_template = report_template_file.read()
+
+        first_pages = {'page_size': self.page_size,
+                       'tables': [dict(table, rows=table['rows'][:self.page_size],
+                                       row_count=len(table['rows']))
+                                  for table in self.tables]}
+        # '</' would end the inline script early
+        inline_data = json.dumps(first_pages, separators=(',', ':')).replace('</', '<\\/')
+
+        report_file_path = os.path.join(output_directory, REPORT_FILE_NAME)
+        with open(report_file_path, 'w') as report_file:
+            report_file.write(report_template.replace('Inline_Report_Data', inline_data))
+
+        return report_file_path
@@ -0,0 +1,535 @@
+"""
+Local filesystem backend for the service clients used by the cufflinks and cuffdiff runners.
+
+Selected with 'client-backend = local' in the module config; 'local-store-dir' holds the
+store. Workspace objects are JSON files under objects/<workspace id>/<object id>/<version>,
+and handles are plain local paths: file_to_shock copies into files/ and returns a handle
+whose 'id' and 'hid' are the copied path, and objects referencing inputs (alignment BAMs,
+assembly FASTAs, genome annotations, expression archives) may carry the input's own path
+as its handle. Only the client methods the runners call are implemented, with the same
+parameters and return values as the KBase services.
+"""
+
+import os
+import re
+import json
+import time
+import errno
+import fcntl
+import shutil
+import uuid
+import zipfile
+from contextlib import contextmanager
+
+# workspace appends the latest type version when a save does not name one
+DEFAULT_TYPE_VERSION = '-1.0'
+
+
+def _mkdir_p(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _select(data, path):
+    """
+    _select: the part of data at an 'included' path ('a/b', '[*]' or '*' for every element)
+    """
+    if not path:
+        return data
+    key, rest = path[0], path[1:]
+    if key in ('*', '[*]'):
+        if isinstance(data, list):
+            return [_select(value, rest) for value in data]
+        return dict((k, _select(value, rest)) for k, value in data.items())
+    if isinstance(data, list):
+        return _select(data[int(key)], rest)
+    return {key: _select(data[key], rest)} if key in data else {}
+
+
+def _merge(target, part):
+    for key, value in part.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+def get_subset(data, included):
+    """
+    get_subset: the fields of an object's data named by workspace 'included' paths
+    """
+    subset = dict()
+    for path in included:
+        part = _select(data, [p for p in path.split('/') if p])
+        if isinstance(part, dict):
+            _merge(subset, part)
+    return subset
+
+
+class LocalStore(object):
+    """
+    Workspaces, objects and files of the local backend, all under one directory
+    """
+
+    def __init__(self, store_directory, scratch=None):
+        self.store_directory = store_directory
+        self.scratch = scratch or os.path.join(store_directory, 'tmp')
+        for directory in ['objects', 'files']:
+            _mkdir_p(os.path.join(store_directory, directory))
+        self.workspaces_file = os.path.join(store_directory, 'workspaces.json')
+
+    @contextmanager
+    def _lock(self):
+        # pool workers of one run save into the same store
+        with open(os.path.join(self.store_directory, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_json(self, path, default=None):
+        if not os.path.exists(path):
+            return default
+        with open(path) as json_file:
+            return json.load(json_file)
+
+    def _write_json(self, path, data):
+        temp_path = '{}.{}'.format(path, uuid.uuid4())
+        with open(temp_path, 'w') as json_file:
+            json.dump(data, json_file)
+        os.rename(temp_path, path)
+
+    def _workspaces(self):
+        return self._read_json(self.workspaces_file, {})
+
+    def create_workspace(self, name):
+        """
+        create_workspace: id of the named workspace, creating it when missing
+        """
+        with self._lock():
+            workspaces = self._workspaces()
+            if name not in workspaces:
+                workspaces[name] = len(workspaces) + 1
+                self._write_json(self.workspaces_file, workspaces)
+                _mkdir_p(self._workspace_directory(workspaces[name]))
+            return workspaces[name]
+
+    def get_workspace_id(self, workspace):
+        if isinstance(workspace, int) or str(workspace).isdigit():
+            return int(workspace)
+        workspaces = self._workspaces()
+        if workspace not in workspaces:
+            raise ValueError('No workspace with name {} exists'.format(workspace))
+        return workspaces[workspace]
+
+    def _workspace_name(self, workspace_id):
+        for name, wsid in self._workspaces().items():
+            if wsid == workspace_id:
+                return name
+        raise ValueError('No workspace with id {} exists'.format(workspace_id))
+
+    def _workspace_directory(self, workspace_id):
+        return os.path.join(self.store_directory, 'objects', str(workspace_id))
+
+    def _object_ids(self, workspace_id):
+        return self._read_json(os.path.join(self._workspace_directory(workspace_id),
+                                            'names.json'), {})
+
+    def _resolve(self, ref):
+        """
+        _resolve: (workspace id, object id, version) of a ref or the last element of a ref path
+        """
+        parts = ref.split(';')[-1].strip().split('/')
+        if len(parts) not in (2, 3):
+            raise ValueError('Illegal object reference {}'.format(ref))
+        workspace_id = self.get_workspace_id(parts[0])
+        object_id = parts[1]
+        if not object_id.isdigit():
+            object_ids = self._object_ids(workspace_id)
+            if object_id not in object_ids:
+                raise ValueError('No object with name {} exists in workspace {}'.format(
+                    object_id, workspace_id))
+            object_id = object_ids[object_id]
+        object_directory = os.path.join(self._workspace_directory(workspace_id), str(object_id))
+        if len(parts) == 3:
+            version = int(parts[2])
+        else:
+            versions = [int(f[:-len('.json')]) for f in os.listdir(object_directory)
+                        if f.endswith('.json')] if os.path.isdir(object_directory) else []
+            if not versions:
+                raise ValueError('No object {} exists'.format(ref))
+            version = max(versions)
+        return workspace_id, int(object_id), version
+
+    def _object_path(self, workspace_id, object_id, version):
+        return os.path.join(self._workspace_directory(workspace_id), str(object_id),
+                            '{}.json'.format(version))
+
+    def get_object(self, ref):
+        """
+        get_object: {'data', 'info'} of the object a ref or ref path points to
+        """
+        obj = self._read_json(self._object_path(*self._resolve(ref)))
+        if obj is None:
+            raise ValueError('No object {} exists'.format(ref))
+        return obj
+
+    def save_object(self, workspace, name, object_type, data, meta=None):
+        """
+        save_object: store a new version of the named object, returns its object info
+        """
+        workspace_id = self.get_workspace_id(workspace)
+        if not re.search(r'-\d+\.\d+$', object_type):
+            object_type += DEFAULT_TYPE_VERSION
+        with self._lock():
+            names_file = os.path.join(self._workspace_directory(workspace_id), 'names.json')
+            object_ids = self._object_ids(workspace_id)
+            if name not in object_ids:
+                object_ids[name] = len(object_ids) + 1
+                _mkdir_p(os.path.join(self._workspace_directory(workspace_id),
+                                      str(object_ids[name])))
+                self._write_json(names_file, object_ids)
+            object_id = object_ids[name]
+            versions = [int(f[:-len('.json')]) for f in os.listdir(
+                os.path.join(self._workspace_directory(workspace_id), str(object_id)))
+                if f.endswith('.json')]
+            version = max(versions) + 1 if versions else 1
+            serialized = json.dumps(data)
+            info = [object_id, name, object_type,
+                    time.strftime('%Y-%m-%dT%H:%M:%S+0000', time.gmtime()), version,
+                    'local', workspace_id, self._workspace_name(workspace_id),
+                    str(uuid.uuid4()).replace('-', ''), len(serialized), meta or {}]
+            self._write_json(self._object_path(workspace_id, object_id, version),
+                             {'data': data, 'info': info})
+        return info
+
+    def upa(self, info):
+        return '{}/{}/{}'.format(info[6], info[0], info[4])
+
+    def store_file(self, file_path, pack=None):
+        """
+        store_file: copy (or zip, with pack='zip') a file or directory into the store and
+                    return the stored path
+        """
+        file_directory = os.path.join(self.store_directory, 'files', str(uuid.uuid4()))
+        _mkdir_p(file_directory)
+        if pack == 'zip' or os.path.isdir(file_path):
+            stored_path = os.path.join(file_directory,
+                                       os.path.basename(file_path.rstrip('/')) + '.zip')
+            with zipfile.ZipFile(stored_path, 'w', zipfile.ZIP_DEFLATED,
+                                 allowZip64=True) as zip_file:
+                if os.path.isdir(file_path):
+                    for root, dirs, files in os.walk(file_path):
+                        for name in files:
+                            path = os.path.join(root, name)
+                            zip_file.write(path, os.path.relpath(path, file_path))
+                else:
+                    zip_file.write(file_path, os.path.basename(file_path))
+        else:
+            stored_path = os.path.join(file_directory, os.path.basename(file_path))
+            shutil.copy(file_path, stored_path)
+        return stored_path
+
+    def make_handle(self, stored_path):
+        return {'hid': stored_path, 'id': stored_path, 'file_name': os.path.basename(stored_path),
+                'type': 'local', 'url': 'file://' + os.path.dirname(stored_path),
+                'remote_md5': None}
+
+    def new_scratch_directory(self):
+        directory = os.path.join(self.scratch, 'local_' + str(uuid.uuid4()))
+        _mkdir_p(directory)
+        return directory
+
+
+def _handle_path(handle):
+    """
+    _handle_path: local path of a handle dict or handle id
+    """
+    path = handle.get('id') if isinstance(handle, dict) else handle
+    if not path or not os.path.exists(path):
+        raise ValueError('Handle {} is not a local path'.format(handle))
+    return path
+
+
+def _link_or_copy(source_path, target_path):
+    # large read-only inputs are linked rather than copied
+    try:
+        os.symlink(os.path.abspath(source_path), target_path)
+    except OSError:
+        shutil.copy(source_path, target_path)
+    return target_path
+
+
+def _unpack(file_path, directory):
+    with zipfile.ZipFile(file_path) as zip_file:
+        zip_file.extractall(directory)
+
+
+class LocalWorkspace(object):
+
+    def __init__(self, store):
+        self.store = store
+
+    def get_objects2(self, params):
+        data = list()
+        for spec in params['objects']:
+            obj = self.store.get_object(spec['ref'])
+            if spec.get('included'):
+                obj = {'data': get_subset(obj['data'], spec['included']), 'info': obj['info']}
+            data.append(obj)
+        return {'data': data}
+
+    def get_object_subset(self, specs):
+        return self.get_objects2({'objects': specs})['data']
+
+    def get_object_info3(self, params):
+        infos = list()
+        for spec in params['objects']:
+            try:
+                infos.append(self.store.get_object(spec['ref'])['info'])
+            except ValueError:
+                # like the Workspace, a missing object is a None entry with ignoreErrors
+                if not params.get('ignoreErrors'):
+                    raise
+                infos.append(None)
+        return {'infos': infos,
+                'paths': [spec['ref'].split(';')[:-1] + [self.store.upa(info)] if info else None
+                          for spec, info in zip(params['objects'], infos)]}
+
+    def get_object_info(self, specs, includeMetadata=None):
+        return self.get_object_info3({'objects': specs})['infos']
+
+
+class LocalDataFileUtil(object):
+
+    def __init__(self, store):
+        self.store = store
+
+    def ws_name_to_id(self, name):
+        return self.store.get_workspace_id(name)
+
+    def save_objects(self, params):
+        return [self.store.save_object(params['id'], obj['name'], obj['type'], obj['data'],
+                                       obj.get('meta'))
+                for obj in params['objects']]
+
+    def file_to_shock(self, params):
+        stored_path = self.store.store_file(params['file_path'], params.get('pack'))
+        result = {'shock_id': stored_path, 'node_file_name': os.path.basename(stored_path),
+                  'size': os.path.getsize(stored_path)}
+        if params.get('make_handle'):
+            result['handle'] = self.store.make_handle(stored_path)
+        return result
+
+    def shock_to_file(self, params):
+        stored_path = _handle_path(params.get('handle_id') or params.get('shock_id'))
+        file_path = params['file_path']
+        if os.path.isdir(file_path):
+            file_path = os.path.join(file_path, os.path.basename(stored_path))
+        shutil.copy(stored_path, file_path)
+        if params.get('unpack') and zipfile.is_zipfile(file_path):
+            _unpack(file_path, os.path.dirname(file_path))
+        return {'file_path': file_path, 'node_file_name': os.path.basename(stored_path),
+                'size': os.path.getsize(stored_path)}
+
+
+class LocalGenomeFileUtil(object):
+
+    def __init__(self, store):
+        self.store = store
+
+    def genome_to_gff(self, params):
+        genome = self.store.get_object(params['genome_ref'])['data']
+        annotation_path = _handle_path(genome.get('gff_handle_ref'))
+        target_dir = params.get('target_dir') or self.store.new_scratch_directory()
+        file_path = os.path.join(target_dir, os.path.basename(annotation_path))
+        if params.get('is_gtf') and not annotation_path.endswith('.gtf'):
+            from gff_to_gtf import convert_gff3_to_gtf
+
+            file_path = os.path.splitext(file_path)[0] + '.gtf'
+            convert_gff3_to_gtf(annotation_path, file_path)
+        else:
+            shutil.copy(annotation_path, file_path)
+        return {'file_path': file_path}
+
+
+class LocalAssemblyUtil(object):
+
+    def __init__(self, store):
+        self.store = store
+
+    def get_assembly_as_fasta(self, params):
+        assembly = self.store.get_object(params['ref'])
+        fasta_path = _handle_path(assembly['data'].get('fasta_handle_ref'))
+        path = _link_or_copy(fasta_path, os.path.join(self.store.new_scratch_directory(),
+                                                      os.path.basename(fasta_path)))
+        return {'path': path, 'assembly_name': assembly['info'][1]}
+
+
+class LocalReadsAlignmentUtils(object):
+
+    def __init__(self, store):
+        self.store = store
+
+    def download_alignment(self, params):
+        alignment = self.store.get_object(params['source_ref'])['data']
+        bam_path = _handle_path(alignment.get('file'))
+        destination_dir = self.store.new_scratch_directory()
+        _link_or_copy(bam_path, os.path.join(destination_dir, os.path.basename(bam_path)))
+        return {'destination_dir': destination_dir}
+
+
+class LocalExpressionUtils(object):
+
+    def __init__(self, store):
+        self.store = store
+
+    def download_expression(self, params):
+        expression = self.store.get_object(params['source_ref'])['data']
+        destination_dir = self.store.new_scratch_directory()
+        _unpack(_handle_path(expression.get('file')), destination_dir)
+        return {'destination_dir': destination_dir}
+
+    def upload_expression(self, params):
+        import numpy as np
+        from expression_vectors import parse_tracking_file
+
+        workspace, name = params['destination_ref'].split('/')
+        alignment = self.store.get_object(params['alignment_ref'])['data']
+
+        gene_ids, columns = parse_tracking_file(
+            os.path.join(params['source_dir'], 'genes.fpkm_tracking'))
+        stored_path = self.store.store_file(params['source_dir'], 'zip')
+        expression_data = {
+            'id': name,
+            'type': 'RNA-Seq',
+            'numerical_interpretation': 'FPKM',
+            'processing_comments': 'log2 Normalized',
+            'tool_used': params.get('tool_used'),
+            'tool_version': params.get('tool_version'),
+            'condition': alignment.get('condition'),
+            'genome_id': alignment.get('genome_id'),
+            'annotation_id': params.get('annotation_ref'),
+            'mapped_rnaseq_alignment': {alignment.get('read_sample_id'):
+                                        params['alignment_ref']},
+            # levels are stored log2 normalized, as ExpressionUtils does
+            'expression_levels': dict(zip(gene_ids, np.log2(columns['FPKM'] + 1).tolist())),
+            'tpm_expression_levels': dict(zip(gene_ids,
+                                              np.log2(columns['TPM'] + 1).tolist())),
+            'file': self.store.make_handle(stored_path)}
+        if params.get('description'):
+            expression_data['description'] = params['description']
+
+        info = self.store.save_object(workspace, name, 'KBaseRNASeq.RNASeqExpression',
+                                      expression_data)
+        return {'obj_ref': self.store.upa(info)}
+
+
+class LocalDifferentialExpressionUtils(object):
+
+    def __init__(self, store):
+        self.store = store
+
+    def _read_matrix(self, diffexpr_filepath):
+        row_ids = list()
+        values = list()
+        with open(diffexpr_filepath) as diffexpr_file:
+            col_ids = next(diffexpr_file).rstrip('\n').split('\t')[1:]
+            for line in diffexpr_file:
+                larr = line.rstrip('\n').split('\t')
+                row_ids.append(larr[0])
+                values.append([None if v in ('None', '') else float(v) for v in larr[1:]])
+        return {'row_ids': row_ids, 'col_ids': col_ids, 'values': values}
+
+    def save_differential_expression_matrix_set(self, params):
+        workspace, set_name = params['destination_ref'].split('/')
+        items = list()
+        for diffexpr in params['diffexpr_data']:
+            condition1, condition2 = diffexpr['condition_mapping'].items()[0]
+            matrix_name = '{}-{}-{}'.format(set_name, condition1, condition2)
+            matrix_data = {'condition_mapping': diffexpr['condition_mapping'],
+                           'genome_ref': params.get('genome_ref'),
+                           'tool_used': params.get('tool_used'),
+                           'tool_version': params.get('tool_version'),
+                           'type': 'log2_level',
+                           'scale': '1.0',
+                           'data': self._read_matrix(diffexpr['diffexpr_filepath'])}
+            info = self.store.save_object(workspace, matrix_name,
+                                          'KBaseFeatureValues.DifferentialExpressionMatrix',
+                                          matrix_data)
+            items.append({'ref': self.store.upa(info),
+                          'label': '{}, {}'.format(condition1, condition2)})
+
+        info = self.store.save_object(workspace, set_name,
+                                      'KBaseSets.DifferentialExpressionMatrixSet',
+                                      {'description': 'log2_level', 'items': items})
+        return {'diffExprMatrixSet_ref': self.store.upa(info)}
+
+
+class LocalSetAPI(object):
+
+    def __init__(self, store):
+        self.store = store
+
+    def _get_set(self, params):
+        obj = self.store.get_object(params['ref'])
+        data = dict(obj['data'])
+        if params.get('include_set_item_ref_paths'):
+            data['items'] = [dict(item, ref_path=params['ref'] + ';' + item['ref'])
+                             for item in data.get('items', [])]
+        if params.get('include_item_info'):
+            data['items'] = [dict(item, info=self.store.get_object(
+                params['ref'] + ';' + item['ref'])['info']) for item in data.get('items', [])]
+        return {'data': data, 'info': obj['info']}
+
+    def get_reads_alignment_set_v1(self, params):
+        return self._get_set(params)
+
+    def get_expression_set_v1(self, params):
+        return self._get_set(params)
+
+    def save_expression_set_v1(self, params):
+        info = self.store.save_object(params['workspace'], params['output_object_name'],
+                                      'KBaseSets.ExpressionSet', params['data'])
+        return {'set_ref': self.store.upa(info), 'set_info': info}
+
+
+class LocalKBaseReport(object):
+
+    def __init__(self, store):
+        self.store = store
+
+    def create_extended_report(self, params):
+        report_data = dict((k, params[k]) for k in ['message', 'objects_created',
+                                                    'direct_html_link_index',
+                                                    'html_window_height'] if k in params)
+        for links in ['file_links', 'html_links']:
+            report_data[links] = [dict(link, path=self.store.store_file(link['path']))
+                                  for link in params.get(links) or [] if link.get('path')]
+        name = params.get('report_object_name') or 'report_' + str(uuid.uuid4())
+        info = self.store.save_object(params['workspace_name'], name, 'KBaseReport.Report',
+                                      report_data)
+        return {'name': name, 'ref': self.store.upa(info)}
+
+
+LOCAL_CLIENTS = {'ws': LocalWorkspace,
+                 'dfu': LocalDataFileUtil,
+                 'gfu': LocalGenomeFileUtil,
+                 'au': LocalAssemblyUtil,
+                 'rau': LocalReadsAlignmentUtils,
+                 'eu': LocalExpressionUtils,
+                 'deu': LocalDifferentialExpressionUtils,
+                 'set_api': LocalSetAPI,
+                 'kbase_report': LocalKBaseReport}
+
+
+def local_client(name, store):
+    """
+    local_client: the local backend implementation of a ServiceClients client
+    """
+    return LOCAL_CLIENTS[name](store)
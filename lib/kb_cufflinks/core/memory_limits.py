@@ -0,0 +1,81 @@
+"""
+Memory caps for the cufflinks and cuffdiff subprocesses.
+
+With 'subprocess-memory-limit' set, cufflinks and cuffdiff run under an RLIMIT_AS cap,
+their share of the job's memory, so a deep sample fails on its own with an allocation error
+instead of getting the whole container OOM-killed. Other tools (samtools, gffread, ...) are
+never capped, and no cap is applied unless one is configured. Failures that look like
+running out of memory (a SIGKILL, or an allocation error in the output) raise
+MemoryLimitError, and callers retry with fewer threads and a tighter --max-bundle-frags.
+"""
+
+import signal
+import resource
+
+from bam_utils import MIN_BUNDLE_FRAGS, MAX_BUNDLE_FRAGS
+from scratch_manager import parse_size
+
+MEMORY_ERROR_PATTERNS = ['std::bad_alloc', 'Cannot allocate memory', 'Out of memory',
+                         'out of memory', 'MemoryError']
+DEFAULT_MEMORY_RETRIES = 2
+
+
+class MemoryLimitError(ValueError):
+    """
+    A subprocess ran out of memory
+    """
+
+    def __init__(self, message, exit_code=None):
+        super(MemoryLimitError, self).__init__(message)
+        self.exit_code = exit_code
+
+
+def is_memory_failure(exit_code, output=''):
+    """
+    is_memory_failure: whether a failed subprocess was killed for, or died of, lack of memory
+    """
+    if exit_code == 0:
+        return False
+    # a SIGKILL is what the OOM killer sends; the shell reports it as 128 + 9
+    if exit_code in (-signal.SIGKILL, 128 + signal.SIGKILL):
+        return True
+    return any(pattern in (output or '') for pattern in MEMORY_ERROR_PATTERNS)
+
+
+def memory_limit_preexec(memory_limit, preexec_fn=None):
+    """
+    memory_limit_preexec: subprocess preexec_fn capping the child's address space at
+                          memory_limit bytes, after running preexec_fn; preexec_fn itself
+                          when there is no limit
+    """
+    if not memory_limit:
+        return preexec_fn
+
+    def preexec():
+        if preexec_fn is not None:
+            preexec_fn()
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    return preexec
+
+
+def degraded_options(num_threads, max_bundle_frags):
+    """
+    degraded_options: (num_threads, max_bundle_frags) for retrying a run that ran out of
+                      memory: half the threads and a quarter of the bundle limit
+    """
+    return (max(1, (num_threads or 1) // 2),
+            max(MIN_BUNDLE_FRAGS, (max_bundle_frags or MAX_BUNDLE_FRAGS) // 4))
+
+
+def get_memory_limit(config, memory, concurrency=1):
+    """
+    get_memory_limit: address space cap of one of concurrency subprocesses, from
+                      'subprocess-memory-limit' (a size, 'auto' for a share of the job's
+                      memory, or 'none', the default), or None for no cap
+    """
+    setting = str(config.get('subprocess-memory-limit') or 'none').strip().lower()
+    if setting == 'none':
+        return None
+    if setting == 'auto':
+        return memory // max(1, concurrency) if memory else None
+    return parse_size(setting)
@@ -0,0 +1,121 @@
+"""
+CPU placement of concurrent cufflinks processes.
+
+When several samples run at once, each pool worker gets a disjoint set of the CPUs this
+process may use, taken from as few NUMA nodes as possible, and the subprocesses it starts
+are pinned to that set. Python 2 has no os.sched_setaffinity, so the affinity calls go
+through libc.
+"""
+
+import os
+import re
+import ctypes
+import ctypes.util
+import multiprocessing
+
+from resources import parse_cpu_list
+
+NODE_DIRECTORY = '/sys/devices/system/node'
+# cpu_set_t of glibc: 1024 CPUs
+CPU_SET_BYTES = 128
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    return _libc
+
+
+def get_affinity(pid=0):
+    """
+    get_affinity: CPUs the process may run on, or None when that cannot be read
+    """
+    mask = ctypes.create_string_buffer(CPU_SET_BYTES)
+    try:
+        if _get_libc().sched_getaffinity(pid, CPU_SET_BYTES, mask) != 0:
+            return None
+    except (OSError, AttributeError):
+        return None
+    return [cpu for cpu in range(CPU_SET_BYTES * 8)
+            if ord(mask.raw[cpu // 8]) & (1 << (cpu % 8))]
+
+
+def set_affinity(cpus, pid=0):
+    """
+    set_affinity: pin a process (this one by default) to cpus
+    """
+    mask = bytearray(CPU_SET_BYTES)
+    for cpu in cpus:
+        mask[cpu // 8] |= 1 << (cpu % 8)
+    buf = ctypes.create_string_buffer(str(mask), CPU_SET_BYTES)
+    if _get_libc().sched_setaffinity(pid, CPU_SET_BYTES, buf) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def affinity_preexec(cpus):
+    """
+    affinity_preexec: subprocess preexec_fn pinning the child to cpus
+    """
+    def preexec():
+        set_affinity(cpus)
+    return preexec
+
+
+def numa_nodes(node_directory=NODE_DIRECTORY):
+    """
+    numa_nodes: (node number, CPUs) of every NUMA node, or a single node when the host does
+                not report any
+    """
+    nodes = list()
+    if os.path.isdir(node_directory):
+        for name in os.listdir(node_directory):
+            match = re.match(r'^node(\d+)$', name)
+            if not match:
+                continue
+            try:
+                with open(os.path.join(node_directory, name, 'cpulist')) as cpulist:
+                    nodes.append((int(match.group(1)), parse_cpu_list(cpulist.read())))
+            except IOError:
+                continue
+    return sorted(nodes) or [(0, range(multiprocessing.cpu_count()))]
+
+
+def plan_cpu_sets(num_slots, allowed_cpus, nodes, per_slot=None):
+    """
+    plan_cpu_sets: num_slots disjoint lists of per_slot (by default as many as fit) of
+                   allowed_cpus, each taken from consecutive CPUs of one node where the node
+                   has enough of them, or None when there are fewer CPUs than slots
+    """
+    allowed = set(allowed_cpus)
+    by_node = [[cpu for cpu in cpus if cpu in allowed] for node, cpus in nodes]
+    placed = set(cpu for cpus in by_node for cpu in cpus)
+    # CPUs no node lists still get used, after the node CPUs
+    by_node.append(sorted(allowed - placed))
+
+    per_slot = min(per_slot or len(allowed), len(allowed) // num_slots if num_slots else 0)
+    if not per_slot:
+        return None
+
+    cpu_sets = list()
+    # fill whole slots from one node first, then the leftovers of all nodes together
+    leftovers = list()
+    for cpus in by_node:
+        while len(cpus) >= per_slot and len(cpu_sets) < num_slots:
+            cpu_sets.append(cpus[:per_slot])
+            cpus = cpus[per_slot:]
+        leftovers.extend(cpus)
+    while len(cpu_sets) < num_slots:
+        cpu_sets.append(leftovers[:per_slot])
+        leftovers = leftovers[per_slot:]
+    return cpu_sets
+
+
+def cpu_set_nodes(cpus, nodes):
+    """
+    cpu_set_nodes: NUMA nodes a CPU set spans
+    """
+    return sorted(set(node for node, node_cpus in nodes for cpu in cpus if cpu in node_cpus))
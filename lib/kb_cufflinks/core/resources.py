@@ -0,0 +1,165 @@
+"""
+CPUs and memory this process may use, for every thread count and pool size decision.
+
+multiprocessing.cpu_count() reports the cores of the host, not the limits of the container
+the job runs in. The usable CPUs are the host cores narrowed down by the cgroup cpuset and
+CPU quota (cgroup v1 or v2), and the usable memory is the physical memory narrowed down by
+the cgroup memory limit. 'cpu-limit' and 'memory-limit' in the config override detection.
+"""
+
+import os
+import math
+import multiprocessing
+
+from scratch_manager import parse_size, format_size
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+PROC_CGROUP = '/proc/self/cgroup'
+MEMINFO = '/proc/meminfo'
+# cgroup v1 reports 'no memory limit' as a page-rounded 2^63 - 1
+UNLIMITED_MEMORY = 1 << 60
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def parse_cpu_list(cpu_list):
+    """
+    parse_cpu_list: CPU numbers of a cpuset list such as '0-3,8,10-11'
+    """
+    cpus = list()
+    for part in cpu_list.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _cgroup_paths(proc_cgroup):
+    """
+    _cgroup_paths: cgroup of this process for each v1 controller, and under '' for v2
+    """
+    paths = {}
+    for line in (_read(proc_cgroup) or '').splitlines():
+        parts = line.split(':', 2)
+        if len(parts) != 3:
+            continue
+        for controller in parts[1].split(',') if parts[1] else ['']:
+            paths[controller.replace('name=', '')] = parts[2]
+    return paths
+
+
+class Resources(object):
+    """
+    CPU and memory limits of the job
+    """
+
+    def __init__(self, cpus, memory=None):
+        self.cpus = max(1, int(cpus))
+        self.memory = memory
+
+    def __repr__(self):
+        return 'Resources(cpus={}, memory={})'.format(
+            self.cpus, format_size(self.memory) if self.memory else 'unlimited')
+
+    @classmethod
+    def detect(cls, cgroup_root=CGROUP_ROOT, proc_cgroup=PROC_CGROUP, meminfo=MEMINFO):
+        detector = _CgroupDetector(cgroup_root, proc_cgroup)
+        cpus = [multiprocessing.cpu_count(), detector.cpuset_cpus(), detector.quota_cpus()]
+        memory = [detector.memory_limit(), _physical_memory(meminfo)]
+        return cls(min(c for c in cpus if c),
+                   min(m for m in memory if m) if any(memory) else None)
+
+    @classmethod
+    def from_config(cls, config):
+        resources = cls.detect()
+        if config.get('cpu-limit'):
+            resources.cpus = max(1, int(config['cpu-limit']))
+        if parse_size(config.get('memory-limit')):
+            resources.memory = parse_size(config['memory-limit'])
+        return resources
+
+    def threads(self, requested=None):
+        """
+        threads: number of threads to use, the requested number (a user override) within the
+                 CPU limit, or all usable CPUs
+        """
+        if requested:
+            return max(1, min(int(requested), self.cpus))
+        return self.cpus
+
+
+def _physical_memory(meminfo):
+    for line in (_read(meminfo) or '').splitlines():
+        if line.startswith('MemTotal:'):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+class _CgroupDetector(object):
+    """
+    Reads the limits of the cgroup of this process, in the v2 unified hierarchy or the v1
+    controller hierarchies
+    """
+
+    def __init__(self, cgroup_root, proc_cgroup):
+        self.cgroup_root = cgroup_root
+        self.paths = _cgroup_paths(proc_cgroup)
+        self.unified = os.path.exists(os.path.join(cgroup_root, 'cgroup.controllers'))
+
+    def _read_limit(self, controller, name):
+        """
+        _read_limit: a cgroup file of this process's cgroup, falling back to the mount root
+                     where containers see their own cgroup
+        """
+        if self.unified:
+            directories = [os.path.join(self.cgroup_root, self.paths.get('', '/').lstrip('/')),
+                           self.cgroup_root]
+        else:
+            mounts = [os.path.join(self.cgroup_root, m) for m in controller.split('|')]
+            directories = [os.path.join(mount, self.paths.get(c.split(',')[0], '/').lstrip('/'))
+                           for mount, c in zip(mounts, controller.split('|'))] + mounts
+        for directory in directories:
+            value = _read(os.path.join(directory, name))
+            if value is not None:
+                return value
+        return None
+
+    def quota_cpus(self):
+        if self.unified:
+            value = self._read_limit('', 'cpu.max')
+            if not value or value.split()[0] == 'max':
+                return None
+            quota, period = value.split()[:2]
+        else:
+            quota = self._read_limit('cpu|cpu,cpuacct', 'cpu.cfs_quota_us')
+            period = self._read_limit('cpu|cpu,cpuacct', 'cpu.cfs_period_us')
+            if not quota or not period or int(quota) <= 0:
+                return None
+        return int(math.ceil(float(quota) / int(period)))
+
+    def cpuset_cpus(self):
+        for name in ['cpuset.cpus.effective', 'cpuset.effective_cpus', 'cpuset.cpus']:
+            value = self._read_limit('' if self.unified else 'cpuset', name)
+            if value:
+                return len(parse_cpu_list(value))
+        return None
+
+    def memory_limit(self):
+        if self.unified:
+            value = self._read_limit('', 'memory.max')
+        else:
+            value = self._read_limit('memory', 'memory.limit_in_bytes')
+        if not value or value == 'max' or int(value) >= UNLIMITED_MEMORY:
+            return None
+        return int(value)
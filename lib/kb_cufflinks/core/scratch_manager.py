@@ -0,0 +1,211 @@
+"""
+Per-job scratch space: a job creates its directories under one job directory, free disk
+space and an optional quota are checked before it stages data, and everything it created
+or downloaded is removed when it ends, except the result directories handed back to the
+caller. Failed jobs can be kept for debugging with 'keep-scratch-on-failure'.
+"""
+
+import os
+import re
+import errno
+import fcntl
+import shutil
+import uuid
+from contextlib import contextmanager
+
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+# tracked paths are recorded in the job directory so pool workers can add to them
+TRACKING_FILE = '.tracked_paths'
+
+
+def parse_size(value):
+    """
+    parse_size: bytes in a size such as '500M' or '20G', or None when not set
+    """
+    if value is None or str(value).strip() == '':
+        return None
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$', str(value).upper())
+    if not match:
+        raise ValueError('Invalid size {}'.format(value))
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def format_size(size):
+    for unit in ['T', 'G', 'M', 'K']:
+        if size >= SIZE_UNITS[unit]:
+            return '{:.1f}{}'.format(float(size) / SIZE_UNITS[unit], unit)
+    return '{}B'.format(size)
+
+
+def directory_size(path):
+    """
+    directory_size: bytes used by the files below path, not following symlinks
+    """
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def free_space(path):
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+class ScratchManager(object):
+    """
+    Tracks the directories of one job and removes them when the job ends
+    """
+
+    def __init__(self, job_directory, quota=None, min_free=None, keep_on_failure=False,
+                 logger=None):
+        self.job_directory = os.path.abspath(job_directory)
+        self.quota = quota
+        self.min_free = min_free
+        self.keep_on_failure = keep_on_failure
+        self.logger = logger
+        self.retained = list()
+
+    @classmethod
+    def from_config(cls, config, job_directory, logger=None):
+        return cls(job_directory,
+                   quota=parse_size(config.get('scratch-quota')),
+                   min_free=parse_size(config.get('scratch-min-free')),
+                   keep_on_failure=str(config.get('keep-scratch-on-failure', '')).lower() in
+                   ('1', 'true', 'yes'),
+                   logger=logger)
+
+    def _log(self, message):
+        if self.logger is not None:
+            self.logger.info(message)
+        else:
+            print(message)
+
+    def _mkdir_p(self, path):
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def check_space(self, required=0):
+        """
+        check_space: fail early when the disk or the job quota cannot take required more bytes
+        """
+        self._mkdir_p(self.job_directory)
+        available = free_space(self.job_directory)
+        if available < required + (self.min_free or 0):
+            raise ValueError('Not enough scratch space in {}: {} free, {} needed'.format(
+                self.job_directory, format_size(available),
+                format_size(required + (self.min_free or 0))))
+        if self.quota is not None:
+            usage = self.usage()
+            if usage + required > self.quota:
+                raise ValueError('Scratch quota of {} exceeded: {} used, {} more needed'.format(
+                    format_size(self.quota), format_size(usage), format_size(required)))
+
+    def make_directory(self, prefix=''):
+        """
+        make_directory: new uniquely named directory in the job directory
+        """
+        directory = os.path.join(self.job_directory, prefix + str(uuid.uuid4()))
+        self._mkdir_p(directory)
+        return directory
+
+    def track(self, path):
+        """
+        track: remove path (a file or a directory outside the job directory, such as a
+               download) with the job
+        """
+        if not path:
+            return
+        self._mkdir_p(self.job_directory)
+        with open(os.path.join(self.job_directory, TRACKING_FILE), 'a') as tracking_file:
+            fcntl.flock(tracking_file, fcntl.LOCK_EX)
+            tracking_file.write(os.path.abspath(path) + '\n')
+
+    def retain(self, path):
+        """
+        retain: keep path when the job directory is cleaned up
+        """
+        if path:
+            self.retained.append(os.path.abspath(path))
+
+    def tracked(self):
+        tracking_path = os.path.join(self.job_directory, TRACKING_FILE)
+        if not os.path.exists(tracking_path):
+            return []
+        with open(tracking_path) as tracking_file:
+            return sorted(set(line.rstrip('\n') for line in tracking_file if line.strip()))
+
+    def usage(self):
+        """
+        usage: bytes used by the job directory and the tracked paths outside it
+        """
+        usage = directory_size(self.job_directory)
+        for path in self.tracked():
+            if not self._in_job_directory(path):
+                usage += directory_size(path) if os.path.isdir(path) else (
+                    os.lstat(path).st_size if os.path.lexists(path) else 0)
+        return usage
+
+    def _in_job_directory(self, path):
+        return (path + os.sep).startswith(self.job_directory + os.sep)
+
+    def _is_kept(self, path):
+        return any((retained + os.sep).startswith(path + os.sep) for retained in self.retained)
+
+    def _remove(self, path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.lexists(path):
+            os.remove(path)
+
+    def _clean_directory(self, directory):
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if path in self.retained:
+                continue
+            if self._is_kept(path):
+                self._clean_directory(path)
+            else:
+                self._remove(path)
+
+    def cleanup(self, succeeded=True):
+        """
+        cleanup: remove the job directory and tracked paths, except retained directories
+        """
+        if not succeeded and self.keep_on_failure:
+            self._log('keeping scratch of failed job in {}'.format(self.job_directory))
+            return
+
+        protected = os.path.dirname(self.job_directory)
+        for path in self.tracked():
+            # never remove the shared scratch root a download may have been written to
+            if (protected + os.sep).startswith(path + os.sep) or self._is_kept(path):
+                continue
+            self._remove(path)
+
+        if not os.path.isdir(self.job_directory):
+            return
+        if any(self._in_job_directory(path) for path in self.retained):
+            self._clean_directory(self.job_directory)
+        else:
+            shutil.rmtree(self.job_directory, ignore_errors=True)
+
+    @contextmanager
+    def job(self):
+        """
+        job: check scratch space, run the body and clean up after it, success or failure
+        """
+        self.check_space()
+        try:
+            yield self
+        except BaseException:
+            self.cleanup(succeeded=False)
+            raise
+        self.cleanup(succeeded=True)
@@ -5,6 +5,7 @@ import traceback
 from zipfile import ZipFile
 from os import listdir
 from os.path import isfile, join
+from memory_limits import MemoryLimitError, is_memory_failure, memory_limit_preexec
 
 
 '''
@@ -101,12 +102,15 @@ def runProgram(logger=None,
                progName=None,
                argStr=None,
                script_dir=None,
-               working_dir=None):
+               working_dir=None,
+               memory_limit=None):
     """
     Convenience func to handle calling and monitoring output of external programs.
 
     :param progName: name of system program command
     :param argStr: string containing command line options for ``progName``
+    :param memory_limit: address space cap of the program in bytes; running out of
+                         memory raises MemoryLimitError
 
     :returns: subprocess.communicate object
     """
@@ -141,7 +145,8 @@ def runProgram(logger=None,
                                shell=True,
                                stdout=subprocess.PIPE,
                                stderr=subprocess.PIPE,
-                               cwd=working_dir)
+                               cwd=working_dir,
+                               preexec_fn=memory_limit_preexec(memory_limit))
     # Get results
     result, stderr = process.communicate()
     # print result
@@ -158,6 +163,9 @@ def runProgram(logger=None,
 
     # Check returncode for success/failure
     if process.returncode != 0:
+        if is_memory_failure(process.returncode, (result or '') + (stderr or '')):
+            raise MemoryLimitError('{0} ran out of memory, return code {1}'.format(
+                progName, process.returncode), process.returncode)
         raise Exception("Command execution failed  {0}".format(
             "".join(traceback.format_exc())))
         raise RuntimeError(
@@ -0,0 +1,129 @@
+"""
+Lazily constructed KBase service clients shared by the cufflinks and cuffdiff runners.
+
+Each client is only imported and built the first time it is used, so constructing a
+runner (or the service Impl) does not pay for clients the called method never touches.
+With 'client-backend = local' in the config, the clients are the filesystem-backed
+implementations in local_clients, storing objects and files under 'local-store-dir'.
+"""
+
+import os
+
+
+def _lazy_client(name, factory):
+    """
+    _lazy_client: build a read-only property that creates the client on first access
+    """
+    def getter(self):
+        if name not in self._clients:
+            if self.local_store is not None:
+                from local_clients import local_client
+                self._clients[name] = local_client(name, self.local_store)
+            else:
+                self._clients[name] = factory(self)
+        return self._clients[name]
+    return property(getter)
+
+
+def _workspace(self):
+    from Workspace.WorkspaceClient import Workspace
+    workspace = Workspace(self.ws_url, token=self.token)
+    if str(self.config.get('workspace-cache', 'true')).lower() in ('0', 'false', 'no'):
+        return workspace
+    from workspace_cache import CachingWorkspace
+    return CachingWorkspace.from_config(workspace, self.config)
+
+
+def _data_file_util(self):
+    from DataFileUtil.DataFileUtilClient import DataFileUtil
+    return DataFileUtil(self.callback_url)
+
+
+def _genome_file_util(self):
+    from GenomeFileUtil.GenomeFileUtilClient import GenomeFileUtil
+    return GenomeFileUtil(self.callback_url)
+
+
+def _assembly_util(self):
+    from AssemblyUtil.AssemblyUtilClient import AssemblyUtil
+    return AssemblyUtil(self.callback_url)
+
+
+def _reads_alignment_utils(self):
+    from ReadsAlignmentUtils.ReadsAlignmentUtilsClient import ReadsAlignmentUtils
+    return ReadsAlignmentUtils(self.callback_url)
+
+
+def _expression_utils(self):
+    from ExpressionUtils.ExpressionUtilsClient import ExpressionUtils
+    return ExpressionUtils(self.callback_url)
+
+
+def _differential_expression_utils(self):
+    from DifferentialExpressionUtils.DifferentialExpressionUtilsClient import \
+        DifferentialExpressionUtils
+    return DifferentialExpressionUtils(self.callback_url)
+
+
+def _set_api(self):
+    from SetAPI.SetAPIClient import SetAPI
+    return SetAPI(self.srv_wiz_url, service_ver='dev')
+
+
+def _kbase_report(self):
+    from KBaseReport.KBaseReportClient import KBaseReport
+    return KBaseReport(self.callback_url, token=self.token)
+
+
+class ServiceClients(object):
+    """
+    Holds the service urls and token from the module config and hands out clients
+    """
+
+    def __init__(self, config):
+        self.ws_url = config['workspace-url']
+        self.callback_url = config['SDK_CALLBACK_URL']
+        self.srv_wiz_url = config.get('srv-wiz-url')
+        self.token = config.get('KB_AUTH_TOKEN')
+        self.config = config
+        self._clients = {}
+
+        self.local_store = None
+        if config.get('client-backend', 'kbase') == 'local':
+            from local_clients import LocalStore
+            self.local_store = LocalStore(config.get('local-store-dir') or
+                                          os.path.join(config['scratch'], 'local_store'),
+                                          config.get('scratch'))
+        elif config.get('client-backend', 'kbase') != 'kbase':
+            raise ValueError('Unknown client-backend {}'.format(config['client-backend']))
+
+    ws = _lazy_client('ws', _workspace)
+    dfu = _lazy_client('dfu', _data_file_util)
+    gfu = _lazy_client('gfu', _genome_file_util)
+    au = _lazy_client('au', _assembly_util)
+    rau = _lazy_client('rau', _reads_alignment_utils)
+    eu = _lazy_client('eu', _expression_utils)
+    deu = _lazy_client('deu', _differential_expression_utils)
+    set_api = _lazy_client('set_api', _set_api)
+    kbase_report = _lazy_client('kbase_report', _kbase_report)
+
+    def workspace_cache_stats(self):
+        """
+        workspace_cache_stats: hit/miss counts of the workspace object cache, or None when
+                               the workspace client is not built or not cached
+        """
+        ws = self._clients.get('ws')
+        return ws.stats() if hasattr(ws, 'stats') else None
+
+    def created(self):
+        """
+        created: names of the clients built so far
+        """
+        return sorted(self._clients.keys())
+
+
+def client_property(name):
+    """
+    client_property: expose a ServiceClients client as an attribute of the owning runner
+    """
+    return property(lambda self: getattr(self.clients, name))
@@ -0,0 +1,45 @@
+"""
+Longest-job-first scheduling of the alignments of a pool run.
+
+Cufflinks time grows with the number of mapped reads, so tasks are dispatched in order of
+decreasing read count and deep libraries no longer start last while the other workers sit
+idle. The seconds per read of the tasks finished so far estimate the run time of the next
+ones, and both are logged so the cost model can be checked against real runs.
+"""
+
+# bytes of coordinate-sorted BAM per mapped read, for alignments without read counts
+BAM_BYTES_PER_READ = 40
+
+
+def longest_first(costs):
+    """
+    longest_first: task indexes, most expensive first; tasks of unknown cost (None) count as
+                   the average known cost, and ties keep task order
+    """
+    known = [cost for cost in costs if cost is not None]
+    default = float(sum(known)) / len(known) if known else 0
+    return sorted(range(len(costs)),
+                  key=lambda i: -(costs[i] if costs[i] is not None else default))
+
+
+class CostModel(object):
+    """
+    Seconds per unit of cost, fitted to the tasks finished so far
+    """
+
+    def __init__(self):
+        self.total_cost = 0
+        self.total_seconds = 0.0
+
+    def estimate(self, cost):
+        """
+        estimate: expected seconds of a task, or None before any task of known cost finished
+        """
+        if cost is None or not self.total_cost:
+            return None
+        return cost * self.total_seconds / self.total_cost
+
+    def record(self, cost, seconds):
+        if cost is not None:
+            self.total_cost += cost
+            self.total_seconds += seconds
@@ -0,0 +1,183 @@
+"""
+Disk cache of workspace objects in front of the Workspace client.
+
+A fully versioned ref (wsid/objid/ver) always names the same object, so get_objects2
+results for such refs (whole objects and 'included' subsets) are kept as gzipped JSON
+files and shared by later calls, runs and pool workers. Unversioned refs are resolved to
+their current version once per client, then served like versioned ones. The cache is
+bounded in size; least recently read files are removed first.
+
+Objects are only served to the token that fetched them: every token has a directory of
+its own, so a cache hit never hands out an object the workspace did not let that caller
+read. Ref paths ('a;b') are not cached, since the access check they rely on is on the
+path, not on the object it ends at.
+"""
+
+import os
+import re
+import gzip
+import json
+import errno
+import hashlib
+import uuid
+
+from scratch_manager import parse_size
+from local_clients import get_subset
+
+DEFAULT_CACHE_SIZE = '2G'
+UPA_PATTERN = re.compile(r'^\d+/\d+/\d+$')
+
+
+class CachingWorkspace(object):
+    """
+    Workspace client wrapper serving get_objects2 and get_object_subset from the disk cache
+    """
+
+    def __init__(self, workspace, cache_directory, max_size=None, logger=None, token=None):
+        self.workspace = workspace
+        self.cache_directory = cache_directory
+        self.max_size = max_size
+        self.logger = logger
+        # objects fetched with one token are never served to another
+        self.token_directory = os.path.join(cache_directory,
+                                            hashlib.sha1(token or '').hexdigest())
+        self.resolved = dict()
+        self.hits = 0
+        self.misses = 0
+        # running size of the cache directory, scanned on the first write
+        self.total_size = None
+
+    @classmethod
+    def from_config(cls, workspace, config, logger=None):
+        return cls(workspace,
+                   config.get('workspace-cache-dir') or os.path.join(config['scratch'],
+                                                                     'workspace_cache'),
+                   parse_size(config.get('workspace-cache-size') or DEFAULT_CACHE_SIZE),
+                   logger, config.get('KB_AUTH_TOKEN'))
+
+    def __getattr__(self, name):
+        # all other Workspace methods go straight to the service
+        if name.startswith('__') or 'workspace' not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.workspace, name)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'resolved_refs': len(self.resolved)}
+
+    def _resolve(self, specs):
+        """
+        _resolve: versioned ref of the object each spec points to, resolving the
+                  unversioned ones once per client
+        """
+        unresolved = [spec['ref'] for spec in specs
+                      if not UPA_PATTERN.match(spec['ref'].strip()) and
+                      spec['ref'] not in self.resolved]
+        if unresolved:
+            unresolved = sorted(set(unresolved))
+            infos = self.workspace.get_object_info3(
+                {'objects': [{'ref': ref} for ref in unresolved]})['infos']
+            for ref, info in zip(unresolved, infos):
+                self.resolved[ref] = '{}/{}/{}'.format(info[6], info[0], info[4])
+        return [self.resolved.get(spec['ref']) or spec['ref'].strip() for spec in specs]
+
+    def _cache_path(self, upa, included=None):
+        key = hashlib.sha1(json.dumps([upa, sorted(included) if included else None])).hexdigest()
+        return os.path.join(self.token_directory, key[:2], key + '.json.gz')
+
+    def _read(self, cache_path):
+        try:
+            with gzip.open(cache_path, 'rb') as cache_file:
+                obj = json.loads(cache_file.read())
+        except (IOError, ValueError):
+            return None
+        # file mtime is the LRU clock
+        os.utime(cache_path, None)
+        return obj
+
+    def _write(self, cache_path, obj):
+        serialized = json.dumps(obj)
+        if self.max_size is not None and len(serialized) > self.max_size / 10:
+            return
+        try:
+            os.makedirs(os.path.dirname(cache_path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        temp_path = '{}.{}'.format(cache_path, uuid.uuid4())
+        with gzip.open(temp_path, 'wb') as cache_file:
+            cache_file.write(serialized)
+        os.rename(temp_path, cache_path)
+        if self.max_size is None:
+            return
+        if self.total_size is None:
+            self._evict()
+        else:
+            self.total_size += os.path.getsize(cache_path)
+            if self.total_size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """
+        _evict: rescan the cache, shared with other clients and processes, and remove the
+                least recently read files until it fits in max_size
+        """
+        if self.max_size is None:
+            return
+        cache_files = list()
+        for root, dirs, files in os.walk(self.cache_directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                cache_files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for mtime, size, path in cache_files)
+        for mtime, size, path in sorted(cache_files):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self.total_size = total
+
+    def _get_cached(self, upa, included):
+        if included:
+            obj = self._read(self._cache_path(upa, included))
+            if obj is not None:
+                return obj
+            # a cached whole object serves any subset of it
+            obj = self._read(self._cache_path(upa))
+            if obj is not None:
+                return dict(obj, data=get_subset(obj['data'], included))
+            return None
+        return self._read(self._cache_path(upa))
+
+    def get_objects2(self, params):
+        specs = params['objects']
+        # only plain ref/included lookups are cached, and not ref paths
+        if set(params) != {'objects'} or any(set(spec) - {'ref', 'included'} or
+                                             ';' in spec['ref'] for spec in specs):
+            return self.workspace.get_objects2(params)
+        upas = self._resolve(specs)
+        data = [self._get_cached(upa, spec.get('included')) for spec, upa in zip(specs, upas)]
+
+        missing = [i for i, obj in enumerate(data) if obj is None]
+        self.hits += len(specs) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            fetch_params = dict(params)
+            fetch_params['objects'] = [specs[i] for i in missing]
+            fetched = self.workspace.get_objects2(fetch_params)['data']
+            for i, obj in zip(missing, fetched):
+                data[i] = obj
+                info = obj.get('info')
+                if info and '{}/{}/{}'.format(info[6], info[0], info[4]) == upas[i]:
+                    self._write(self._cache_path(upas[i], specs[i].get('included')), obj)
+        return {'data': data}
+
+    def get_object_subset(self, specs):
+        return self.get_objects2({'objects': specs})['data']
@@ -187,6 +187,20 @@ CufflinksParams is a reference to a hash where the following keys are defined:
 	min_intron_length has a value which is an int
 	max_intron_length has a value which is an int
 	overhang_tolerance has a value which is an int
+	incremental has a value which is a kb_cufflinks.boolean
+	previous_expression_set_ref has a value which is a kb_cufflinks.obj_ref
+	shard_by_contig has a value which is a kb_cufflinks.boolean
+	num_shards has a value which is an int
+	max_bundle_frags has a value which is an int
+	max_bundle_length has a value which is an int
+	no_effective_length_correction has a value which is a kb_cufflinks.boolean
+	frag_bias_correct has a value which is a kb_cufflinks.boolean
+	multi_read_correct has a value which is a kb_cufflinks.boolean
+	library_type has a value which is a string
+	preset has a value which is a string
+	auto_tune_bundles has a value which is a kb_cufflinks.boolean
+boolean is an int
+obj_ref is a string
 CufflinksResult is a reference to a hash where the following keys are defined:
 	result_directory has a value which is a string
 	expression_obj_ref has a value which is a kb_cufflinks.obj_ref
@@ -194,7 +208,6 @@ CufflinksResult is a reference to a hash where the following keys are defined:
 	exprMatrix_TPM_ref has a value which is a kb_cufflinks.obj_ref
 	report_name has a value which is a string
 	report_ref has a value which is a string
-obj_ref is a string
 
 </pre>
 
@@ -214,6 +227,20 @@ CufflinksParams is a reference to a hash where the following keys are defined:
 	min_intron_length has a value which is an int
 	max_intron_length has a value which is an int
 	overhang_tolerance has a value which is an int
+	incremental has a value which is a kb_cufflinks.boolean
+	previous_expression_set_ref has a value which is a kb_cufflinks.obj_ref
+	shard_by_contig has a value which is a kb_cufflinks.boolean
+	num_shards has a value which is an int
+	max_bundle_frags has a value which is an int
+	max_bundle_length has a value which is an int
+	no_effective_length_correction has a value which is a kb_cufflinks.boolean
+	frag_bias_correct has a value which is a kb_cufflinks.boolean
+	multi_read_correct has a value which is a kb_cufflinks.boolean
+	library_type has a value which is a string
+	preset has a value which is a string
+	auto_tune_bundles has a value which is a kb_cufflinks.boolean
+boolean is an int
+obj_ref is a string
 CufflinksResult is a reference to a hash where the following keys are defined:
 	result_directory has a value which is a string
 	expression_obj_ref has a value which is a kb_cufflinks.obj_ref
@@ -221,7 +248,6 @@ CufflinksResult is a reference to a hash where the following keys are defined:
 	exprMatrix_TPM_ref has a value which is a kb_cufflinks.obj_ref
 	report_name has a value which is a string
 	report_ref has a value which is a string
-obj_ref is a string
 
 
 =end text
@@ -299,6 +325,173 @@ sub _run_cufflinks_submit {
  
 
 
+=head2 run_cufflinks_batch
+
+  $return = $obj->run_cufflinks_batch($params)
+
+=over 4
+
+=item Parameter and return types
+
+=begin html
+
+<pre>
+$params is a kb_cufflinks.CufflinksBatchParams
+$return is a kb_cufflinks.CufflinksBatchResult
+CufflinksBatchParams is a reference to a hash where the following keys are defined:
+	workspace_name has a value which is a string
+	alignment_object_refs has a value which is a reference to a list where each element is a string
+	expression_set_suffix has a value which is a string
+	expression_suffix has a value which is a string
+	genome_ref has a value which is a string
+	num_threads has a value which is an int
+	min_intron_length has a value which is an int
+	max_intron_length has a value which is an int
+	overhang_tolerance has a value which is an int
+	incremental has a value which is a kb_cufflinks.boolean
+	shard_by_contig has a value which is a kb_cufflinks.boolean
+	num_shards has a value which is an int
+	max_bundle_frags has a value which is an int
+	max_bundle_length has a value which is an int
+	no_effective_length_correction has a value which is a kb_cufflinks.boolean
+	frag_bias_correct has a value which is a kb_cufflinks.boolean
+	multi_read_correct has a value which is a kb_cufflinks.boolean
+	library_type has a value which is a string
+	preset has a value which is a string
+	auto_tune_bundles has a value which is a kb_cufflinks.boolean
+boolean is an int
+CufflinksBatchResult is a reference to a hash where the following keys are defined:
+	results has a value which is a reference to a list where each element is a kb_cufflinks.CufflinksResult
+	report_name has a value which is a string
+	report_ref has a value which is a string
+CufflinksResult is a reference to a hash where the following keys are defined:
+	result_directory has a value which is a string
+	expression_obj_ref has a value which is a kb_cufflinks.obj_ref
+	exprMatrix_FPKM_ref has a value which is a kb_cufflinks.obj_ref
+	exprMatrix_TPM_ref has a value which is a kb_cufflinks.obj_ref
+	report_name has a value which is a string
+	report_ref has a value which is a string
+obj_ref is a string
+
+</pre>
+
+=end html
+
+=begin text
+
+$params is a kb_cufflinks.CufflinksBatchParams
+$return is a kb_cufflinks.CufflinksBatchResult
+CufflinksBatchParams is a reference to a hash where the following keys are defined:
+	workspace_name has a value which is a string
+	alignment_object_refs has a value which is a reference to a list where each element is a string
+	expression_set_suffix has a value which is a string
+	expression_suffix has a value which is a string
+	genome_ref has a value which is a string
+	num_threads has a value which is an int
+	min_intron_length has a value which is an int
+	max_intron_length has a value which is an int
+	overhang_tolerance has a value which is an int
+	incremental has a value which is a kb_cufflinks.boolean
+	shard_by_contig has a value which is a kb_cufflinks.boolean
+	num_shards has a value which is an int
+	max_bundle_frags has a value which is an int
+	max_bundle_length has a value which is an int
+	no_effective_length_correction has a value which is a kb_cufflinks.boolean
+	frag_bias_correct has a value which is a kb_cufflinks.boolean
+	multi_read_correct has a value which is a kb_cufflinks.boolean
+	library_type has a value which is a string
+	preset has a value which is a string
+	auto_tune_bundles has a value which is a kb_cufflinks.boolean
+boolean is an int
+CufflinksBatchResult is a reference to a hash where the following keys are defined:
+	results has a value which is a reference to a list where each element is a kb_cufflinks.CufflinksResult
+	report_name has a value which is a string
+	report_ref has a value which is a string
+CufflinksResult is a reference to a hash where the following keys are defined:
+	result_directory has a value which is a string
+	expression_obj_ref has a value which is a kb_cufflinks.obj_ref
+	exprMatrix_FPKM_ref has a value which is a kb_cufflinks.obj_ref
+	exprMatrix_TPM_ref has a value which is a kb_cufflinks.obj_ref
+	report_name has a value which is a string
+	report_ref has a value which is a string
+obj_ref is a string
+
+
+=end text
+
+=item Description
+
+
+
+=back
+
+=cut
+
+sub run_cufflinks_batch
+{
+    my($self, @args) = @_;
+    my $job_id = $self->_run_cufflinks_batch_submit(@args);
+    my $async_job_check_time = $self->{async_job_check_time};
+    while (1) {
+        Time::HiRes::sleep($async_job_check_time);
+        $async_job_check_time *= $self->{async_job_check_time_scale_percent} / 100.0;
+        if ($async_job_check_time > $self->{async_job_check_max_time}) {
+            $async_job_check_time = $self->{async_job_check_max_time};
+        }
+        my $job_state_ref = $self->_check_job($job_id);
+        if ($job_state_ref->{"finished"} != 0) {
+            if (!exists $job_state_ref->{"result"}) {
+                $job_state_ref->{"result"} = [];
+            }
+            return wantarray ? @{$job_state_ref->{"result"}} : $job_state_ref->{"result"}->[0];
+        }
+    }
+}
+
+sub _run_cufflinks_batch_submit {
+    my($self, @args) = @_;
+# Authentication: required
+    if ((my $n = @args) != 1) {
+        Bio::KBase::Exceptions::ArgumentValidationError->throw(error =>
+                                   "Invalid argument count for function _run_cufflinks_batch_submit (received $n, expecting 1)");
+    }
+    {
+        my($params) = @args;
+        my @_bad_arguments;
+        (ref($params) eq 'HASH') or push(@_bad_arguments, "Invalid type for argument 1 \"params\" (value was \"$params\")");
+        if (@_bad_arguments) {
+            my $msg = "Invalid arguments passed to _run_cufflinks_batch_submit:\n" . join("", map { "\t$_\n" } @_bad_arguments);
+            Bio::KBase::Exceptions::ArgumentValidationError->throw(error => $msg,
+                                   method_name => '_run_cufflinks_batch_submit');
+        }
+    }
+    my $context = undef;
+    if ($self->{service_version}) {
+        $context = {'service_ver' => $self->{service_version}};
+    }
+    my $result = $self->{client}->call($self->{url}, $self->{headers}, {
+        method => "kb_cufflinks._run_cufflinks_batch_submit",
+        params => \@args, context => $context});
+    if ($result) {
+        if ($result->is_error) {
+            Bio::KBase::Exceptions::JSONRPC->throw(error => $result->error_message,
+                           code => $result->content->{error}->{code},
+                           method_name => '_run_cufflinks_batch_submit',
+                           data => $result->content->{error}->{error} # JSON::RPC::ReturnObject only supports JSONRPC 1.1 or 1.O
+            );
+        } else {
+            return $result->result->[0];  # job_id
+        }
+    } else {
+        Bio::KBase::Exceptions::HTTP->throw(error => "Error invoking method _run_cufflinks_batch_submit",
+                        status_line => $self->{client}->status_line,
+                        method_name => '_run_cufflinks_batch_submit');
+    }
+}
+
+ 
+
+
 =head2 run_Cuffdiff
 
   $returnVal = $obj->run_Cuffdiff($params)
@@ -320,8 +513,13 @@ CuffdiffInput is a reference to a hash where the following keys are defined:
 	multi_read_correct has a value which is a kb_cufflinks.boolean
 	time_series has a value which is a kb_cufflinks.boolean
 	min_alignment_count has a value which is an int
+	quantify_once has a value which is a kb_cufflinks.boolean
+	contrasts has a value which is a reference to a list where each element is a kb_cufflinks.ConditionPair
 obj_ref is a string
 boolean is an int
+ConditionPair is a reference to a hash where the following keys are defined:
+	condition1 has a value which is a string
+	condition2 has a value which is a string
 CuffdiffResult is a reference to a hash where the following keys are defined:
 	result_directory has a value which is a string
 	diffExprMatrixSet_ref has a value which is a kb_cufflinks.obj_ref
@@ -344,8 +542,13 @@ CuffdiffInput is a reference to a hash where the following keys are defined:
 	multi_read_correct has a value which is a kb_cufflinks.boolean
 	time_series has a value which is a kb_cufflinks.boolean
 	min_alignment_count has a value which is an int
+	quantify_once has a value which is a kb_cufflinks.boolean
+	contrasts has a value which is a reference to a list where each element is a kb_cufflinks.ConditionPair
 obj_ref is a string
 boolean is an int
+ConditionPair is a reference to a hash where the following keys are defined:
+	condition1 has a value which is a string
+	condition2 has a value which is a string
 CuffdiffResult is a reference to a hash where the following keys are defined:
 	result_directory has a value which is a string
 	diffExprMatrixSet_ref has a value which is a kb_cufflinks.obj_ref
@@ -616,6 +819,36 @@ report_ref has a value which is a string
 
 
 
+=item Description
+
+incremental                 -   reuse Expression objects of the prior expression set
+made from the same alignment version with the same
+params, and only run cufflinks for new or changed
+alignments (Optional)
+previous_expression_set_ref -   KBaseSets.ExpressionSet to build on in incremental
+mode; defaults to the existing set with the output
+name (Optional)
+shard_by_contig             -   run cufflinks on groups of contigs with similar read
+counts in parallel and merge the results, for very
+deep alignments (Optional)
+num_shards                  -   number of contig groups in sharded mode; defaults to
+num_threads (Optional)
+max_bundle_frags            -   skip loci with more fragments than this (Optional)
+max_bundle_length           -   skip loci longer than this (Optional)
+no_effective_length_correction - do not correct for effective transcript length
+(Optional)
+frag_bias_correct           -   correct for fragment bias using the genome sequence
+(Optional)
+multi_read_correct          -   weight multi-mapped reads by their likely origin
+(Optional)
+library_type                -   fr-unstranded, fr-firststrand or fr-secondstrand
+(Optional)
+preset                      -   "fast": bundle limits and corrections tuned for run
+time; explicitly given options still apply (Optional)
+auto_tune_bundles           -   pick max_bundle_frags from the read depth of each BAM
+unless it is given (Optional)
+
+
 =item Definition
 
 =begin html
@@ -631,6 +864,18 @@ num_threads has a value which is an int
 min_intron_length has a value which is an int
 max_intron_length has a value which is an int
 overhang_tolerance has a value which is an int
+incremental has a value which is a kb_cufflinks.boolean
+previous_expression_set_ref has a value which is a kb_cufflinks.obj_ref
+shard_by_contig has a value which is a kb_cufflinks.boolean
+num_shards has a value which is an int
+max_bundle_frags has a value which is an int
+max_bundle_length has a value which is an int
+no_effective_length_correction has a value which is a kb_cufflinks.boolean
+frag_bias_correct has a value which is a kb_cufflinks.boolean
+multi_read_correct has a value which is a kb_cufflinks.boolean
+library_type has a value which is a string
+preset has a value which is a string
+auto_tune_bundles has a value which is a kb_cufflinks.boolean
 
 </pre>
 
@@ -648,6 +893,168 @@ num_threads has a value which is an int
 min_intron_length has a value which is an int
 max_intron_length has a value which is an int
 overhang_tolerance has a value which is an int
+incremental has a value which is a kb_cufflinks.boolean
+previous_expression_set_ref has a value which is a kb_cufflinks.obj_ref
+shard_by_contig has a value which is a kb_cufflinks.boolean
+num_shards has a value which is an int
+max_bundle_frags has a value which is an int
+max_bundle_length has a value which is an int
+no_effective_length_correction has a value which is a kb_cufflinks.boolean
+frag_bias_correct has a value which is a kb_cufflinks.boolean
+multi_read_correct has a value which is a kb_cufflinks.boolean
+library_type has a value which is a string
+preset has a value which is a string
+auto_tune_bundles has a value which is a kb_cufflinks.boolean
+
+
+=end text
+
+=back
+
+
+
+=head2 CufflinksBatchParams
+
+=over 4
+
+
+
+=item Description
+
+Input parameters for run_cufflinks_batch. Same as CufflinksParams, but takes a list
+of alignment or alignment set objects that are quantified against the same genome.
+
+alignment_object_refs       -   KBaseRNASeq.RNASeqAlignment, KBaseRNASeq.RNASeqAlignmentSet
+or KBaseSets.ReadsAlignmentSet object references
+
+
+=item Definition
+
+=begin html
+
+<pre>
+a reference to a hash where the following keys are defined:
+workspace_name has a value which is a string
+alignment_object_refs has a value which is a reference to a list where each element is a string
+expression_set_suffix has a value which is a string
+expression_suffix has a value which is a string
+genome_ref has a value which is a string
+num_threads has a value which is an int
+min_intron_length has a value which is an int
+max_intron_length has a value which is an int
+overhang_tolerance has a value which is an int
+incremental has a value which is a kb_cufflinks.boolean
+shard_by_contig has a value which is a kb_cufflinks.boolean
+num_shards has a value which is an int
+max_bundle_frags has a value which is an int
+max_bundle_length has a value which is an int
+no_effective_length_correction has a value which is a kb_cufflinks.boolean
+frag_bias_correct has a value which is a kb_cufflinks.boolean
+multi_read_correct has a value which is a kb_cufflinks.boolean
+library_type has a value which is a string
+preset has a value which is a string
+auto_tune_bundles has a value which is a kb_cufflinks.boolean
+
+</pre>
+
+=end html
+
+=begin text
+
+a reference to a hash where the following keys are defined:
+workspace_name has a value which is a string
+alignment_object_refs has a value which is a reference to a list where each element is a string
+expression_set_suffix has a value which is a string
+expression_suffix has a value which is a string
+genome_ref has a value which is a string
+num_threads has a value which is an int
+min_intron_length has a value which is an int
+max_intron_length has a value which is an int
+overhang_tolerance has a value which is an int
+incremental has a value which is a kb_cufflinks.boolean
+shard_by_contig has a value which is a kb_cufflinks.boolean
+num_shards has a value which is an int
+max_bundle_frags has a value which is an int
+max_bundle_length has a value which is an int
+no_effective_length_correction has a value which is a kb_cufflinks.boolean
+frag_bias_correct has a value which is a kb_cufflinks.boolean
+multi_read_correct has a value which is a kb_cufflinks.boolean
+library_type has a value which is a string
+preset has a value which is a string
+auto_tune_bundles has a value which is a kb_cufflinks.boolean
+
+
+=end text
+
+=back
+
+
+
+=head2 CufflinksBatchResult
+
+=over 4
+
+
+
+=item Description
+
+results: one CufflinksResult (without report) per entry of alignment_object_refs
+report_name: name of the combined report generated by KBaseReport
+report_ref: reference of the combined report generated by KBaseReport
+
+
+=item Definition
+
+=begin html
+
+<pre>
+a reference to a hash where the following keys are defined:
+results has a value which is a reference to a list where each element is a kb_cufflinks.CufflinksResult
+report_name has a value which is a string
+report_ref has a value which is a string
+
+</pre>
+
+=end html
+
+=begin text
+
+a reference to a hash where the following keys are defined:
+results has a value which is a reference to a list where each element is a kb_cufflinks.CufflinksResult
+report_name has a value which is a string
+report_ref has a value which is a string
+
+
+=end text
+
+=back
+
+
+
+=head2 ConditionPair
+
+=over 4
+
+
+
+=item Definition
+
+=begin html
+
+<pre>
+a reference to a hash where the following keys are defined:
+condition1 has a value which is a string
+condition2 has a value which is a string
+
+</pre>
+
+=end html
+
+=begin text
+
+a reference to a hash where the following keys are defined:
+condition1 has a value which is a string
+condition2 has a value which is a string
 
 
 =end text
@@ -670,6 +1077,13 @@ expressionset_ref           -   reference for an expressionset object
 workspace_name              -   workspace name to save the differential expression output object
 output_obj_name             -   name of the differential expression matrix set output object
 
+quantify_once               -   run cuffquant once per sample and feed the cached .cxb
+files to cuffdiff and cuffnorm
+contrasts                   -   condition pairs to test; each runs as its own cuffdiff,
+concurrently, instead of one run over all conditions.
+q-values and significance are recomputed over the
+tests of all pairs together, as one run corrects them
+
 
 =item Definition
 
@@ -684,6 +1098,8 @@ library_norm_method has a value which is a string
 multi_read_correct has a value which is a kb_cufflinks.boolean
 time_series has a value which is a kb_cufflinks.boolean
 min_alignment_count has a value which is an int
+quantify_once has a value which is a kb_cufflinks.boolean
+contrasts has a value which is a reference to a list where each element is a kb_cufflinks.ConditionPair
 
 </pre>
 
@@ -699,6 +1115,8 @@ library_norm_method has a value which is a string
 multi_read_correct has a value which is a kb_cufflinks.boolean
 time_series has a value which is a kb_cufflinks.boolean
 min_alignment_count has a value which is an int
+quantify_once has a value which is a kb_cufflinks.boolean
+contrasts has a value which is a reference to a list where each element is a kb_cufflinks.ConditionPair
 
 
 =end text
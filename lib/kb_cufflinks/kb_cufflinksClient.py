@@ -50,14 +50,50 @@ class kb_cufflinks(object):
 
     def run_cufflinks(self, params, context=None):
         """
-        :param params: instance of type "CufflinksParams" -> structure:
-           parameter "workspace_name" of String, parameter
-           "alignment_object_ref" of String, parameter
+        :param params: instance of type "CufflinksParams" (incremental                
+           -   reuse Expression objects of the prior expression set made from
+           the same alignment version with the same params, and only run
+           cufflinks for new or changed alignments (Optional)
+           previous_expression_set_ref -   KBaseSets.ExpressionSet to build
+           on in incremental mode; defaults to the existing set with the
+           output name (Optional) shard_by_contig             -   run
+           cufflinks on groups of contigs with similar read counts in
+           parallel and merge the results, for very deep alignments
+           (Optional) num_shards                  -   number of contig groups
+           in sharded mode; defaults to num_threads (Optional)
+           max_bundle_frags            -   skip loci with more fragments than
+           this (Optional) max_bundle_length           -   skip loci longer
+           than this (Optional) no_effective_length_correction - do not
+           correct for effective transcript length (Optional)
+           frag_bias_correct           -   correct for fragment bias using
+           the genome sequence (Optional) multi_read_correct          -  
+           weight multi-mapped reads by their likely origin (Optional)
+           library_type                -   fr-unstranded, fr-firststrand or
+           fr-secondstrand (Optional) preset                      -   "fast":
+           bundle limits and corrections tuned for run time; explicitly given
+           options still apply (Optional) auto_tune_bundles           -  
+           pick max_bundle_frags from the read depth of each BAM unless it is
+           given (Optional)) -> structure: parameter "workspace_name" of
+           String, parameter "alignment_object_ref" of String, parameter
            "expression_set_suffix" of String, parameter "expression_suffix"
            of String, parameter "genome_ref" of String, parameter
            "num_threads" of Long, parameter "min_intron_length" of Long,
            parameter "max_intron_length" of Long, parameter
-           "overhang_tolerance" of Long
+           "overhang_tolerance" of Long, parameter "incremental" of type
+           "boolean" (A boolean - 0 for false, 1 for true. @range (0, 1)),
+           parameter "previous_expression_set_ref" of type "obj_ref" (An
+           X/Y/Z style reference), parameter "shard_by_contig" of type
+           "boolean" (A boolean - 0 for false, 1 for true. @range (0, 1)),
+           parameter "num_shards" of Long, parameter "max_bundle_frags" of
+           Long, parameter "max_bundle_length" of Long, parameter
+           "no_effective_length_correction" of type "boolean" (A boolean - 0
+           for false, 1 for true. @range (0, 1)), parameter
+           "frag_bias_correct" of type "boolean" (A boolean - 0 for false, 1
+           for true. @range (0, 1)), parameter "multi_read_correct" of type
+           "boolean" (A boolean - 0 for false, 1 for true. @range (0, 1)),
+           parameter "library_type" of String, parameter "preset" of String,
+           parameter "auto_tune_bundles" of type "boolean" (A boolean - 0 for
+           false, 1 for true. @range (0, 1))
         :returns: instance of type "CufflinksResult" (result_directory:
            folder path that holds all files generated by the cufflinks run
            expression_obj_ref: generated Expression/ExpressionSet object
@@ -83,6 +119,70 @@ class kb_cufflinks(object):
             if job_state['finished']:
                 return job_state['result'][0]
 
+    def _run_cufflinks_batch_submit(self, params, context=None):
+        return self._client._submit_job(
+             'kb_cufflinks.run_cufflinks_batch', [params],
+             self._service_ver, context)
+
+    def run_cufflinks_batch(self, params, context=None):
+        """
+        :param params: instance of type "CufflinksBatchParams" (Input
+           parameters for run_cufflinks_batch. Same as CufflinksParams, but
+           takes a list of alignment or alignment set objects that are
+           quantified against the same genome. alignment_object_refs       -  
+           KBaseRNASeq.RNASeqAlignment, KBaseRNASeq.RNASeqAlignmentSet or
+           KBaseSets.ReadsAlignmentSet object references) -> structure:
+           parameter "workspace_name" of String, parameter
+           "alignment_object_refs" of list of String, parameter
+           "expression_set_suffix" of String, parameter "expression_suffix"
+           of String, parameter "genome_ref" of String, parameter
+           "num_threads" of Long, parameter "min_intron_length" of Long,
+           parameter "max_intron_length" of Long, parameter
+           "overhang_tolerance" of Long, parameter "incremental" of type
+           "boolean" (A boolean - 0 for false, 1 for true. @range (0, 1)),
+           parameter "shard_by_contig" of type "boolean" (A boolean - 0 for
+           false, 1 for true. @range (0, 1)), parameter "num_shards" of Long,
+           parameter "max_bundle_frags" of Long, parameter
+           "max_bundle_length" of Long, parameter
+           "no_effective_length_correction" of type "boolean" (A boolean - 0
+           for false, 1 for true. @range (0, 1)), parameter
+           "frag_bias_correct" of type "boolean" (A boolean - 0 for false, 1
+           for true. @range (0, 1)), parameter "multi_read_correct" of type
+           "boolean" (A boolean - 0 for false, 1 for true. @range (0, 1)),
+           parameter "library_type" of String, parameter "preset" of String,
+           parameter "auto_tune_bundles" of type "boolean" (A boolean - 0 for
+           false, 1 for true. @range (0, 1))
+        :returns: instance of type "CufflinksBatchResult" (results: one
+           CufflinksResult (without report) per entry of
+           alignment_object_refs report_name: name of the combined report
+           generated by KBaseReport report_ref: reference of the combined
+           report generated by KBaseReport) -> structure: parameter "results"
+           of list of type "CufflinksResult" (result_directory: folder path
+           that holds all files generated by the cufflinks run
+           expression_obj_ref: generated Expression/ExpressionSet object
+           reference exprMatrix_FPKM/TPM_ref: generated FPKM/TPM
+           ExpressionMatrix object reference report_name: report name
+           generated by KBaseReport report_ref: report reference generated by
+           KBaseReport) -> structure: parameter "result_directory" of String,
+           parameter "expression_obj_ref" of type "obj_ref" (An X/Y/Z style
+           reference), parameter "exprMatrix_FPKM_ref" of type "obj_ref" (An
+           X/Y/Z style reference), parameter "exprMatrix_TPM_ref" of type
+           "obj_ref" (An X/Y/Z style reference), parameter "report_name" of
+           String, parameter "report_ref" of String, parameter "report_name"
+           of String, parameter "report_ref" of String
+        """
+        job_id = self._run_cufflinks_batch_submit(params, context)
+        async_job_check_time = self._client.async_job_check_time
+        while True:
+            time.sleep(async_job_check_time)
+            async_job_check_time = (async_job_check_time *
+                self._client.async_job_check_time_scale_percent / 100.0)
+            if async_job_check_time > self._client.async_job_check_max_time:
+                async_job_check_time = self._client.async_job_check_max_time
+            job_state = self._check_job(job_id)
+            if job_state['finished']:
+                return job_state['result'][0]
+
     def run_Cuffdiff(self, params, context=None):
         """
         :param params: instance of type "CuffdiffInput" (Required input
@@ -90,14 +190,23 @@ class kb_cufflinks(object):
            reference for an expressionset object workspace_name             
            -   workspace name to save the differential expression output
            object output_obj_name             -   name of the differential
-           expression matrix set output object) -> structure: parameter
-           "expressionset_ref" of type "obj_ref" (An X/Y/Z style reference),
-           parameter "workspace_name" of String, parameter "output_obj_name"
-           of String, parameter "library_norm_method" of String, parameter
-           "multi_read_correct" of type "boolean" (A boolean - 0 for false, 1
-           for true. @range (0, 1)), parameter "time_series" of type
-           "boolean" (A boolean - 0 for false, 1 for true. @range (0, 1)),
-           parameter "min_alignment_count" of Long
+           expression matrix set output object quantify_once               -  
+           run cuffquant once per sample and feed the cached .cxb files to
+           cuffdiff and cuffnorm contrasts                   -   condition
+           pairs to test; each runs as its own cuffdiff, concurrently,
+           instead of one run over all conditions. q-values and significance
+           are recomputed over the tests of all pairs together, as one run
+           corrects them) -> structure: parameter "expressionset_ref" of type
+           "obj_ref" (An X/Y/Z style reference), parameter "workspace_name"
+           of String, parameter "output_obj_name" of String, parameter
+           "library_norm_method" of String, parameter "multi_read_correct" of
+           type "boolean" (A boolean - 0 for false, 1 for true. @range (0,
+           1)), parameter "time_series" of type "boolean" (A boolean - 0 for
+           false, 1 for true. @range (0, 1)), parameter "min_alignment_count"
+           of Long, parameter "quantify_once" of type "boolean" (A boolean -
+           0 for false, 1 for true. @range (0, 1)), parameter "contrasts" of
+           list of type "ConditionPair" -> structure: parameter "condition1"
+           of String, parameter "condition2" of String
         :returns: instance of type "CuffdiffResult" -> structure: parameter
            "result_directory" of String, parameter "diffExprMatrixSet_ref" of
            type "obj_ref" (An X/Y/Z style reference), parameter "report_name"
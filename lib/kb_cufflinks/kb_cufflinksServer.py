@@ -337,6 +337,10 @@ class Application(object):
                              name='kb_cufflinks.run_cufflinks',
                              types=[dict])
         self.method_authentication['kb_cufflinks.run_cufflinks'] = 'required'  # noqa
+        self.rpc_service.add(impl_kb_cufflinks.run_cufflinks_batch,
+                             name='kb_cufflinks.run_cufflinks_batch',
+                             types=[dict])
+        self.method_authentication['kb_cufflinks.run_cufflinks_batch'] = 'required'  # noqa
         self.rpc_service.add(impl_kb_cufflinks.run_Cuffdiff,
                              name='kb_cufflinks.run_Cuffdiff',
                              types=[dict])
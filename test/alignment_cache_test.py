@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import shutil
+import tempfile
+
+from kb_cufflinks.core.alignment_cache import AlignmentCache
+
+
+class AlignmentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.downloads = list()
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def _download(self, size):
+        def download():
+            download_directory = tempfile.mkdtemp(dir=self.scratch)
+            with open(os.path.join(download_directory, 'reads.bam'), 'w') as bam_file:
+                bam_file.write('x' * size)
+            self.downloads.append(download_directory)
+            return download_directory
+        return download
+
+    def test_download_once(self):
+        cache = AlignmentCache(os.path.join(self.scratch, 'cache'))
+        directory, lease = cache.acquire('1/2/3', self._download(10))
+        self.assertEqual(os.listdir(directory), ['reads.bam'])
+        self.assertFalse(os.path.exists(self.downloads[0]))
+
+        self.assertEqual(cache.acquire('1/2/3', self._download(10))[0], directory)
+        self.assertEqual(len(self.downloads), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.release(lease)
+        cache.release(lease)
+
+    def test_lru_eviction_skips_held(self):
+        cache = AlignmentCache(os.path.join(self.scratch, 'cache'), max_size=25)
+        held, held_lease = cache.acquire('1/2/1', self._download(10))
+        old, old_lease = cache.acquire('1/3/1', self._download(10))
+        cache.release(old_lease)
+        os.utime(held, (0, 0))
+        os.utime(old, (1, 1))
+
+        # over the bound: the oldest entry is held, so the next oldest goes
+        new, new_lease = cache.acquire('1/4/1', self._download(10))
+        self.assertTrue(os.path.isdir(held))
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.isdir(new))
+
+        # leases of processes that are gone do not pin entries
+        cache.release(held_lease)
+        with open(os.path.join(held + '.holders', '999999999.dead'), 'w'):
+            pass
+        cache.acquire('1/5/1', self._download(10))
+        self.assertFalse(os.path.exists(held))
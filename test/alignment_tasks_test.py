@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import shutil
+import tempfile
+import time
+
+from kb_cufflinks.core.cufflinks_utils import CufflinksUtils
+from kb_cufflinks.core.task_scheduling import CostModel, longest_first
+
+
+def process_alignment(self, params):
+    started = time.time()
+    # later tasks finish first
+    time.sleep(0.05 * (3 - params['index']))
+    return {'alignment_ref': params['alignment_ref'], 'pid': os.getpid(),
+            'scratch': self.scratch, 'utils_id': id(self), 'started': started}
+
+
+class ReadCountWorkspace(object):
+
+    def __init__(self, mapped_reads):
+        self.mapped_reads = mapped_reads
+
+    def get_objects2(self, params):
+        return {'data': [{'info': [int(spec['ref'].split('/')[1]), 'a', 't', '', 1, 'u', 1],
+                          'data': {'alignment_stats': {
+                              'mapped_reads': self.mapped_reads[spec['ref']]}}}
+                         for spec in params['objects']]}
+
+
+class GenomeWorkspace(object):
+
+    def __init__(self, upas):
+        self.upas = upas
+
+    def get_object_info3(self, params):
+        infos = list()
+        for spec in params['objects']:
+            wsid, objid, ver = self.upas[spec['ref']].split('/')
+            infos.append([int(objid), 'genome', 'KBaseGenomes.Genome', '', int(ver), 'u',
+                          int(wsid), 'ws', '', 0, {}])
+        return {'infos': infos}
+
+
+class AlignmentTasksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        os.environ.setdefault('VERSION', '2.2.1')
+        self.config = {'scratch': self.scratch, 'workspace-url': 'http://localhost/ws',
+                       'SDK_CALLBACK_URL': 'http://localhost:5000', 'srv-wiz-url': '',
+                       'KB_AUTH_TOKEN': '', 'shock-url': ''}
+        self.process_alignment = CufflinksUtils._process_kbasesets_alignment_object
+        CufflinksUtils._process_kbasesets_alignment_object = process_alignment
+
+    def tearDown(self):
+        CufflinksUtils._process_kbasesets_alignment_object = self.process_alignment
+        shutil.rmtree(self.scratch)
+
+    def test_task_order(self):
+        runner = CufflinksUtils(self.config)
+        runner.clients._clients['ws'] = ReadCountWorkspace(
+            {'1/0/1': 10, '1/1/1': 40, '1/2/1': 0, '1/3/1': 20})
+        tasks = [{'index': i, 'alignment_ref': '1/{}/1'.format(i)} for i in range(4)]
+
+        results = list(runner._run_alignment_tasks(tasks, 2))
+
+        self.assertEqual([r['alignment_ref'] for r in results], ['1/0/1', '1/1/1', '1/2/1',
+                                                                 '1/3/1'])
+        # each worker builds its utils once and runs in the scratch of the run
+        workers = set((r['pid'], r['utils_id']) for r in results)
+        self.assertEqual(len(workers), len(set(r['pid'] for r in results)))
+        self.assertTrue(len(workers) <= 2)
+        self.assertNotIn(os.getpid(), [r['pid'] for r in results])
+        self.assertEqual(set(r['scratch'] for r in results), set([runner.scratch]))
+
+        self.assertEqual(list(runner._run_alignment_tasks([], 2)), [])
+
+    def test_longest_first(self):
+        runner = CufflinksUtils(self.config)
+        runner.clients._clients['ws'] = ReadCountWorkspace(
+            {'1/0/1': 10, '1/1/1': 40, '1/2/1': 0, '1/3/1': 20})
+        tasks = [{'index': i, 'alignment_ref': '1/{}/1'.format(i)} for i in range(4)]
+
+        results = list(runner._run_alignment_tasks(tasks, 1))
+
+        # the task without read counts counts as average
+        self.assertEqual([r['alignment_ref'] for r in sorted(results, key=lambda r: r['started'])],
+                         ['1/1/1', '1/2/1', '1/3/1', '1/0/1'])
+        self.assertEqual([(r['alignment_ref'], r['estimated_cost']) for r in runner.telemetry],
+                         [('1/1/1', 40), ('1/2/1', None), ('1/3/1', 20), ('1/0/1', 10)])
+        self.assertEqual(runner.telemetry[0]['estimated_seconds'], None)
+        self.assertTrue(runner.telemetry[2]['estimated_seconds'] > 0)
+
+    def test_cost_model(self):
+        self.assertEqual(longest_first([5, None, 1, 9, 5]), [3, 0, 1, 4, 2])
+        self.assertEqual(longest_first([None, None]), [0, 1])
+
+        model = CostModel()
+        self.assertEqual(model.estimate(10), None)
+        model.record(10, 2.0)
+        model.record(None, 7.0)
+        model.record(30, 6.0)
+        self.assertEqual(model.estimate(20), 4.0)
+
+    def test_params_hash_uses_genome_version(self):
+        runner = CufflinksUtils(self.config)
+        runner.clients._clients['ws'] = GenomeWorkspace({'ws/genome': '7/3/2', '7/3': '7/3/2',
+                                                         '7/3/1': '7/3/1'})
+        params = {'genome_ref': 'ws/genome', 'min_intron_length': 50}
+
+        # the same genome by name or unversioned ref: the same hash
+        self.assertEqual(runner._get_expression_params_hash(params),
+                         runner._get_expression_params_hash(dict(params, genome_ref='7/3')))
+        self.assertEqual(runner._get_expression_params_hash(params),
+                         runner._get_expression_params_hash(dict(params, genome_ref='genome',
+                                                                 workspace_name='ws')))
+        # another version of the genome: another hash
+        self.assertNotEqual(runner._get_expression_params_hash(params),
+                            runner._get_expression_params_hash(dict(params,
+                                                                    genome_ref='7/3/1')))
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import shutil
+import tempfile
+
+from kb_cufflinks.core.annotation_slim import SlimAnnotationCache, slim_gtf
+from kb_cufflinks.core.alignment_cache import release_lease
+from bam_utils_test import write_bam
+
+GTF = ''.join('\t'.join(record) + '\n' for record in [
+    ('chr1', 'GFF', 'gene', '1', '500', '.', '+', '.', 'gene_id "g1";'),
+    ('chr1', 'GFF', 'exon', '1', '100', '.', '+', '.', 'gene_id "g1"; transcript_id "t1";'),
+    ('chr1', 'GFF', 'CDS', '10', '100', '.', '+', '0', 'gene_id "g1"; transcript_id "t1";'),
+    ('chr1', 'GFF', 'exon', '1', '100', '.', '+', '.', 'gene_id "g1"; transcript_id "t1";'),
+    ('chr1', 'GFF', 'exon', '1', '100', '.', '+', '.', 'gene_id "g1"; transcript_id "t2";'),
+    ('chr1', 'GFF', 'start_codon', '10', '12', '.', '+', '0', 'transcript_id "t1";'),
+    ('scaffold_9', 'GFF', 'exon', '1', '50', '.', '-', '.', 'gene_id "g2"; transcript_id "t3";'),
+])
+
+
+class AnnotationSlimTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.gtf_file = os.path.join(self.scratch, 'genome.gtf')
+        with open(self.gtf_file, 'w') as gtf:
+            gtf.write('# gffread\n' + GTF)
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def test_slim_gtf(self):
+        output_file = os.path.join(self.scratch, 'slim.gtf')
+        counts = slim_gtf(self.gtf_file, ['chr1', 'chr2'], output_file)
+        self.assertEqual(counts, {'kept': 3, 'other_contigs': 1, 'other_features': 2,
+                                  'duplicates': 1})
+        with open(output_file) as slim:
+            self.assertEqual([line.split('\t')[2] for line in slim], ['exon', 'CDS', 'exon'])
+
+    def test_cache(self):
+        bam_file = os.path.join(self.scratch, 'a.bam')
+        write_bam(bam_file, '@HD\tVN:1.4\tSO:coordinate\n', [('chr1', 1000)])
+        other_bam_file = os.path.join(self.scratch, 'b.bam')
+        write_bam(other_bam_file, '@HD\tVN:1.4\tSO:coordinate\n',
+                  [('chr1', 1000), ('scaffold_9', 60)])
+
+        cache = SlimAnnotationCache(os.path.join(self.scratch, 'cache'))
+        slim_file, counts, lease = cache.get_slim(self.gtf_file, bam_file)
+        self.assertEqual(counts['kept'], 3)
+
+        # same genome annotation and contigs: the cached file, even from another run
+        self.assertEqual(SlimAnnotationCache(cache.cache_directory).get_slim(
+            self.gtf_file, bam_file)[:2], (slim_file, counts))
+
+        other_slim_file, other_counts, other_lease = cache.get_slim(self.gtf_file,
+                                                                    other_bam_file)
+        self.assertNotEqual(other_slim_file, slim_file)
+        self.assertEqual(other_counts['kept'], 4)
+        release_lease(lease)
+        release_lease(other_lease)
+
+    def test_cache_bound(self):
+        bam_files = list()
+        for name, references in [('a', [('chr1', 1000)]),
+                                 ('b', [('chr1', 1000), ('scaffold_9', 60)]),
+                                 ('c', [('chr2', 1000)])]:
+            bam_files.append(os.path.join(self.scratch, name + '.bam'))
+            write_bam(bam_files[-1], '@HD\tVN:1.4\tSO:coordinate\n', references)
+
+        cache = SlimAnnotationCache(os.path.join(self.scratch, 'cache'), max_size=1)
+        slim_file, counts, lease = cache.get_slim(self.gtf_file, bam_files[0])
+        # leased slim GTFs are kept while the cache is over its bound
+        other_slim_file, other_counts, other_lease = cache.get_slim(self.gtf_file,
+                                                                    bam_files[1])
+        self.assertTrue(os.path.exists(slim_file))
+
+        release_lease(lease)
+        os.utime(os.path.dirname(slim_file), (0, 0))
+        cache.get_slim(self.gtf_file, bam_files[2])
+        self.assertFalse(os.path.exists(slim_file))
+        self.assertTrue(os.path.exists(other_slim_file))
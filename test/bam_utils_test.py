@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+from kb_cufflinks.core.bam_utils import (BamSortCache, read_bam_header, is_coordinate_sorted,
+                                          suggest_max_bundle_frags)
+
+
+def bgzf_block(data):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    return ('\x1f\x8b\x08\x04' + '\x00' * 4 + '\x00\xff' + struct.pack('<H', 6) + 'BC' +
+            struct.pack('<HH', 2, len(compressed) + 25) + compressed +
+            struct.pack('<iI', zlib.crc32(data), len(data)))
+
+
+def write_bam(path, header_text, references):
+    data = 'BAM\x01' + struct.pack('<i', len(header_text)) + header_text
+    data += struct.pack('<i', len(references))
+    for name, length in references:
+        data += struct.pack('<i', len(name) + 1) + name + '\x00' + struct.pack('<i', length)
+    with open(path, 'wb') as bam_file:
+        # split across blocks to exercise block boundaries, then the BGZF EOF block
+        bam_file.write(bgzf_block(data[:10]) + bgzf_block(data[10:]) + bgzf_block(''))
+
+
+class BamUtilsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def test_read_header(self):
+        bam_file = os.path.join(self.scratch, 'sorted.bam')
+        write_bam(bam_file, '@HD\tVN:1.4\tSO:coordinate\n', [('chr1', 1000), ('chr2', 20)])
+
+        text, references = read_bam_header(bam_file)
+        self.assertEqual(text, '@HD\tVN:1.4\tSO:coordinate\n')
+        self.assertEqual(references, [('chr1', 1000), ('chr2', 20)])
+        self.assertTrue(is_coordinate_sorted(bam_file))
+
+    def test_sort_once(self):
+        bam_file = os.path.join(self.scratch, 'unsorted.bam')
+        write_bam(bam_file, '@HD\tVN:1.4\tSO:queryname\n', [('chr1', 1000)])
+        commands = []
+
+        def run_command(command):
+            commands.append(command)
+            shutil.copy(bam_file, command.split(' -o ')[1].split()[0])
+
+        sort_cache = BamSortCache(os.path.join(self.scratch, 'cache'), threads=4)
+        sorted_bam_file, lease = sort_cache.get_sorted(bam_file, '1/2/3', run_command)
+
+        self.assertEqual(len(commands), 1)
+        self.assertIn('sort -@ 4', commands[0])
+        self.assertTrue(os.path.exists(sorted_bam_file))
+        self.assertTrue(os.path.exists(lease))
+        self.assertEqual(sort_cache.get_cached('1/2/3')[0], sorted_bam_file)
+        self.assertEqual(sort_cache.get_sorted(bam_file, '1/2/3', run_command)[0],
+                         sorted_bam_file)
+        self.assertEqual(len(commands), 1)
+        self.assertIsNone(sort_cache.get_cached('1/2/4'))
+
+        # sorted input is used as is
+        coordinate_sorted_file = os.path.join(self.scratch, 'sorted.bam')
+        write_bam(coordinate_sorted_file, '@HD\tVN:1.4\tSO:coordinate\n', [('chr1', 1000)])
+        self.assertEqual(sort_cache.get_sorted(coordinate_sorted_file, '1/2/4', run_command),
+                         (coordinate_sorted_file, None))
+
+    def test_sort_cache_bound(self):
+        bam_file = os.path.join(self.scratch, 'unsorted.bam')
+        write_bam(bam_file, '@HD\tVN:1.4\tSO:queryname\n', [('chr1', 1000)])
+
+        def run_command(command):
+            shutil.copy(bam_file, command.split(' -o ')[1].split()[0])
+
+        sort_cache = BamSortCache(os.path.join(self.scratch, 'cache'),
+                                  max_size=os.path.getsize(bam_file) * 3 / 2)
+        held_bam_file, held_lease = sort_cache.get_sorted(bam_file, '1/2/1', run_command)
+        old_bam_file, old_lease = sort_cache.get_sorted(bam_file, '1/3/1', run_command)
+        sort_cache.cache.release(old_lease)
+        os.utime(os.path.dirname(held_bam_file), (0, 0))
+        os.utime(os.path.dirname(old_bam_file), (1, 1))
+
+        # over the bound: the oldest copy is in use, so the next oldest goes
+        sort_cache.get_sorted(bam_file, '1/4/1', run_command)
+        self.assertTrue(os.path.exists(held_bam_file))
+        self.assertFalse(os.path.exists(old_bam_file))
+
+        sort_cache.cache.release(held_lease)
+        sort_cache.get_sorted(bam_file, '1/5/1', run_command)
+        self.assertFalse(os.path.exists(held_bam_file))
+
+    def test_suggest_max_bundle_frags(self):
+        references = [('chr1', 1000000), ('chr2', 1000000), ('chr3', 5000)]
+        # 1 read / 100bp over the covered contigs -> 200 reads per typical bundle
+        self.assertEqual(suggest_max_bundle_frags(references, [10000, 10000, 0]), 20000)
+        self.assertEqual(suggest_max_bundle_frags(references, [10 ** 6, 10 ** 6, 0]), 500000)
+        self.assertEqual(suggest_max_bundle_frags(references, [100000, 100000, 0]), 100000)
+        self.assertIsNone(suggest_max_bundle_frags(references, [0, 0, 0]))
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import shutil
+import tempfile
+
+from kb_cufflinks.core import contig_id_mapping
+
+
+class ContigIdMappingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.fasta = os.path.join(self.scratch, 'assembly.fa')
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def _mapping(self, fasta_content):
+        with open(self.fasta, 'w') as fasta:
+            fasta.write(fasta_content)
+        mapping_filename = contig_id_mapping.create_sanitized_contig_ids(self.fasta)
+        with open(mapping_filename) as mapping:
+            self.assertEqual(mapping.readline(), 'original\tmodified\n')
+            return [tuple(line.rstrip('\n').split('\t')) for line in mapping]
+
+    def test_headers(self):
+        self.assertEqual(self._mapping('>chr_1 first\nACGT\nAC>GT\n\n>chr.2\nGG\n>chr3'),
+                         [('chr_1', 'chr1'), ('chr.2', 'chr2'), ('chr3', 'chr3')])
+        self.assertEqual(self._mapping(''), [])
+
+    def test_empty_header(self):
+        for fasta_content in ['>chr1\nACGT\n>\nACGT\n', '>chr1\nACGT\n> \r\nACGT\n']:
+            with self.assertRaisesRegexp(ValueError, 'Contig 2 of FASTA file .* has no id'):
+                self._mapping(fasta_content)
+
+    def test_collisions(self):
+        ids = ['scaffold_1', 'scaffold.1', 'scaffold|1', 'scaffold1a', 'scaffold-1']
+        mapping = self._mapping(''.join('>{}\nACGT\n'.format(x) for x in ids))
+        self.assertEqual(mapping, [('scaffold_1', 'scaffold1'),
+                                   ('scaffold.1', 'scaffold1a'),
+                                   ('scaffold|1', 'scaffold1a2'),
+                                   ('scaffold1a', 'scaffold1aa'),
+                                   ('scaffold-1', 'scaffold1a3')])
+
+    def test_many_collisions(self):
+        ids = ['scaffold{}1'.format('_' * (i % 7 + 1)) for i in range(20000)]
+        mapping = self._mapping(''.join('>{}\nA\n'.format(x) for x in ids))
+        modified = [m for o, m in mapping]
+        self.assertEqual(len(set(modified)), len(ids))
+        self.assertTrue(max(len(m) for m in modified) < 20)
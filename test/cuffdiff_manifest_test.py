@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import os
+import shutil
+import tempfile
+
+from kb_cufflinks.core.cuffdiff import CuffDiff
+
+
+class CuffdiffManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        os.environ.setdefault('SDK_CALLBACK_URL', 'http://localhost:5000')
+        self.cuffdiff_runner = CuffDiff({'scratch': self.scratch,
+                                         'workspace-url': 'http://localhost/ws'},
+                                        {'workspace_service_url': 'http://localhost/ws'},
+                                        logging.getLogger('cuffdiff_manifest_test'))
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def test_condition_groups(self):
+        # 'WT' is a substring of 'WT_heat' and of the directory names
+        manifest = [{'condition': 'WT_heat', 'bam_file': '/d/WT_1/a.bam'},
+                    {'condition': 'WT', 'bam_file': '/d/WT_heat_2/b.bam'},
+                    {'condition': 'WT_heat', 'bam_file': '/d/WT_3/c.bam'}]
+
+        data = self.cuffdiff_runner._get_manifest_data(manifest)
+
+        self.assertEqual(data['condition'], ['WT_heat', 'WT'])
+        self.assertEqual(data['bam_files'], [' /d/WT_1/a.bam,/d/WT_3/c.bam',
+                                             ' /d/WT_heat_2/b.bam'])
+
+    def test_alignment_bam_file(self):
+        alignment_dir = os.path.join(self.scratch, 'alignment')
+        os.makedirs(alignment_dir)
+        for name in ['accepted_hits.bam', 'unmapped.bam', 'align_summary.txt']:
+            open(os.path.join(alignment_dir, name), 'w').close()
+
+        self.assertEqual(self.cuffdiff_runner._get_alignment_bam_file(alignment_dir),
+                         os.path.join(alignment_dir, 'accepted_hits.bam'))
+        os.remove(os.path.join(alignment_dir, 'unmapped.bam'))
+        os.remove(os.path.join(alignment_dir, 'accepted_hits.bam'))
+        with self.assertRaises(ValueError):
+            self.cuffdiff_runner._get_alignment_bam_file(alignment_dir)
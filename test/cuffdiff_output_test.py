@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import shutil
+import tempfile
+
+from kb_cufflinks.core.cuffdiff_output import benjamini_hochberg, merge_cuffdiff_outputs
+
+DIFF_HEADER = 'test_id\tgene_id\tgene\tlocus\tsample_1\tsample_2\tstatus\n'
+
+
+class MergeCuffdiffOutputsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def test_merge(self):
+        contrast_directories = list()
+        for pair in [('WT', 'hy5'), ('WT', 'cop1')]:
+            contrast_directory = os.path.join(self.scratch, '{}_vs_{}'.format(*pair))
+            os.makedirs(contrast_directory)
+            with open(os.path.join(contrast_directory, 'gene_exp.diff'), 'w') as diff:
+                diff.write(DIFF_HEADER)
+                diff.write('g1\tg1\tg1\tc:1-9\t{}\t{}\tOK\n'.format(*pair))
+            contrast_directories.append(contrast_directory)
+
+        merge_cuffdiff_outputs(contrast_directories, self.scratch)
+
+        with open(os.path.join(self.scratch, 'gene_exp.diff')) as diff:
+            lines = diff.readlines()
+        self.assertEqual(lines[0], DIFF_HEADER)
+        self.assertEqual([l.split('\t')[5] for l in lines[1:]], ['hy5', 'cop1'])
+        self.assertFalse(os.path.exists(os.path.join(self.scratch, 'isoform_exp.diff')))
+
+    def test_merge_corrects_jointly(self):
+        header = ('test_id\tgene_id\tgene\tlocus\tsample_1\tsample_2\tstatus\tvalue_1\t'
+                  'value_2\tlog2(fold_change)\ttest_stat\tp_value\tq_value\tsignificant\n')
+        contrast_directories = list()
+        for pair, p_values in [(('WT', 'hy5'), [('OK', '0.01'), ('OK', '0.04')]),
+                               (('WT', 'cop1'), [('OK', '0.03'), ('NOTEST', '1')])]:
+            contrast_directory = os.path.join(self.scratch, '{}_vs_{}'.format(*pair))
+            os.makedirs(contrast_directory)
+            with open(os.path.join(contrast_directory, 'gene_exp.diff'), 'w') as diff:
+                diff.write(header)
+                for i, (status, p_value) in enumerate(p_values):
+                    # q-values as each run corrected them on its own
+                    diff.write('\t'.join(['g{}'.format(i), 'g{}'.format(i), '-', 'c:1-9', pair[0],
+                                          pair[1], status, '1', '2', '1', '2', p_value,
+                                          p_value, 'yes' if status == 'OK' else 'no']) + '\n')
+            contrast_directories.append(contrast_directory)
+
+        merge_cuffdiff_outputs(contrast_directories, self.scratch)
+
+        with open(os.path.join(self.scratch, 'gene_exp.diff')) as diff:
+            rows = [line.rstrip('\n').split('\t') for line in diff][1:]
+        self.assertEqual([(r[11], r[12], r[13]) for r in rows],
+                         [('0.01', '0.03', 'yes'), ('0.04', '0.04', 'yes'),
+                          ('0.03', '0.04', 'yes'), ('1', '1', 'no')])
+
+    def test_benjamini_hochberg(self):
+        q_values = benjamini_hochberg([0.01, 0.04, 0.03, 0.2])
+        for q, expected in zip(q_values, [0.04, 0.0533333, 0.0533333, 0.2]):
+            self.assertAlmostEqual(q, expected, places=6)
@@ -419,6 +419,16 @@ class CuffdiffTest(unittest.TestCase):
                          },
             'No workspace with name 1s exists')
 
+    def test_cuffdiff_fail_self_contrast(self):
+        self.cuffdiff_fail(
+                        {
+                         'workspace_name': self.getWsName(),
+                         'expressionset_ref': '1/1/1',
+                         'output_obj_name': 'test_createdExprSet',
+                         'contrasts': [{'condition1': 'WT', 'condition2': 'WT'}]
+                         },
+            'contrast of condition WT with itself')
+
     def test_cuffdiff_fail_non_expset_ref(self):
         self.cuffdiff_fail(
                         {
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import shutil
+import struct
+import tempfile
+
+from kb_cufflinks.core import cufflinks_shards as shards
+from kb_cufflinks.core.bam_utils import BAI_PSEUDO_BIN, read_bai_mapped_counts
+from kb_cufflinks.core.cufflinks_utils import CufflinksUtils
+from bam_utils_test import write_bam
+
+TRACKING_HEADER = ['tracking_id', 'class_code', 'nearest_ref_id', 'gene_id', 'gene_short_name',
+                   'tss_id', 'locus', 'length', 'coverage', 'FPKM', 'FPKM_conf_lo',
+                   'FPKM_conf_hi', 'FPKM_status']
+
+
+def write_bai(path, mapped_counts):
+    data = 'BAI\x01' + struct.pack('<i', len(mapped_counts))
+    for mapped in mapped_counts:
+        # one regular bin with one chunk, the pseudo-bin, and one linear index entry
+        data += struct.pack('<i', 2)
+        data += struct.pack('<IiQQ', 4681, 1, 0, 100)
+        data += struct.pack('<IiQQQQ', BAI_PSEUDO_BIN, 2, 0, 100, mapped, 3)
+        data += struct.pack('<iQ', 1, 0)
+    with open(path, 'wb') as bai_file:
+        bai_file.write(data)
+
+
+class CufflinksShardsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def test_bai_counts_and_assignment(self):
+        bai_file = os.path.join(self.scratch, 'a.bam.bai')
+        write_bai(bai_file, [100, 0, 60, 50, 10])
+
+        counts = read_bai_mapped_counts(bai_file)
+        self.assertEqual(counts, [100, 0, 60, 50, 10])
+
+        groups = shards.assign_shards(['c1', 'c2', 'c3', 'c4', 'c5'], counts, 2)
+        self.assertEqual(groups, [['c1', 'c5'], ['c3', 'c4']])
+        self.assertEqual(len(shards.assign_shards(['c1', 'c2'], [5, 0], 4)), 1)
+
+    def test_bam_depth_index(self):
+        os.environ.setdefault('VERSION', '2.2.1')
+        runner = CufflinksUtils({'scratch': self.scratch, 'workspace-url': 'http://localhost/ws',
+                                 'SDK_CALLBACK_URL': 'http://localhost:5000',
+                                 'srv-wiz-url': '', 'KB_AUTH_TOKEN': '', 'shock-url': ''})
+        bam_file = os.path.join(self.scratch, 'a.bam')
+        write_bam(bam_file, '@HD\tVN:1.4\tSO:coordinate\n', [('c1', 1000), ('c2', 500)])
+        commands = []
+
+        def run_command(command):
+            commands.append(command)
+            # the index is written under a private name, never in place
+            index_file = command.split()[-1]
+            self.assertNotEqual(index_file, bam_file + '.bai')
+            write_bai(index_file, [30, 5])
+        runner._run_command = run_command
+
+        self.assertEqual(runner._get_bam_depth(bam_file), ([('c1', 1000), ('c2', 500)], [30, 5]))
+        self.assertEqual(sorted(os.listdir(self.scratch)), ['a.bam', 'a.bam.bai'])
+        runner._get_bam_depth(bam_file)
+        self.assertEqual(len(commands), 1)
+
+    def test_split_gtf(self):
+        gtf_file = os.path.join(self.scratch, 'genes.gtf')
+        with open(gtf_file, 'w') as gtf:
+            gtf.write('#header\nc1\tx\texon\t1\t10\nc2\tx\texon\t1\t10\nc3\tx\texon\t1\t10\n')
+        shard_directories = [os.path.join(self.scratch, d) for d in ['s0', 's1']]
+        for d in shard_directories:
+            os.makedirs(d)
+
+        gtf_paths = shards.split_gtf(gtf_file, [['c1'], ['c3']], shard_directories)
+
+        with open(gtf_paths[0]) as gtf:
+            self.assertEqual([l.split('\t')[0] for l in gtf], ['c1', 'c2'])
+        with open(gtf_paths[1]) as gtf:
+            self.assertEqual([l.split('\t')[0] for l in gtf], ['c3'])
+
+    def test_merge_rescales_fpkm(self):
+        shard_directories = [os.path.join(self.scratch, d) for d in ['s0', 's1']]
+        for d, gene_id in zip(shard_directories, ['g1', 'g2']):
+            os.makedirs(d)
+            with open(os.path.join(d, 'genes.fpkm_tracking'), 'w') as tracking:
+                tracking.write('\t'.join(TRACKING_HEADER) + '\n')
+                tracking.write('\t'.join([gene_id, '-', '-', gene_id, '-', '-', 'c:1-9', '-',
+                                          '2.5', '100', '80', '120', 'OK']) + '\n')
+            with open(os.path.join(d, 'transcripts.gtf'), 'w') as gtf:
+                gtf.write('c\tCufflinks\ttranscript\t1\t9\t1000\t+\t.\tgene_id "{}"; '
+                          'FPKM "100"; frac "1"; conf_lo "80"; conf_hi "120"; '
+                          'cov "2.5";\n'.format(gene_id))
+
+        self.assertEqual(shards.parse_map_mass('>\tNormalized Map Mass: 300.50\n'), 300.5)
+        shards.merge_shard_results(shard_directories, [300.0, 100.0], self.scratch)
+
+        with open(os.path.join(self.scratch, 'genes.fpkm_tracking')) as tracking:
+            lines = [l.rstrip('\n').split('\t') for l in tracking]
+        self.assertEqual(lines[0], TRACKING_HEADER)
+        self.assertEqual([l[0] for l in lines[1:]], ['g1', 'g2'])
+        self.assertEqual(lines[1][8:12], ['2.5', '75', '60', '90'])
+        self.assertEqual(lines[2][8:12], ['2.5', '25', '20', '30'])
+
+        with open(os.path.join(self.scratch, 'transcripts.gtf')) as gtf:
+            merged = gtf.read().splitlines()
+        self.assertIn('FPKM "25"; frac "1"; conf_lo "20"; conf_hi "30"; cov "2.5";', merged[1])
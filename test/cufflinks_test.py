@@ -19,6 +19,7 @@ except BaseException:
     from configparser import ConfigParser  # py3
 
 from kb_cufflinks.core.cufflinks_utils import CufflinksUtils
+from kb_cufflinks.core.gff_to_gtf import convert_gff3_to_gtf
 from kb_cufflinks.kb_cufflinksImpl import kb_cufflinks
 from kb_cufflinks.kb_cufflinksServer import MethodContext
 from kb_cufflinks.authclient import KBaseAuth as _KBaseAuth
@@ -395,3 +396,123 @@ class CufflinksTest(unittest.TestCase):
         self.assertTrue('exprMatrix_FPKM_ref' in result)
         self.assertTrue('exprMatrix_TPM_ref' in result)
 
+
+    def test_cufflinks_batch_app(self):
+        params = {
+            "workspace_name": self.getWsName(),
+            "expression_set_suffix": "_batch_expression_set",
+            "expression_suffix": "_batch_expression",
+            "alignment_object_refs": [self.alignment_ref_1,
+                                      self.alignment_kbasesets_set_ref],
+            "genome_ref": self.__class__.genome_ref,
+            "min_intron_length": 50,
+            "max_intron_length": 300000,
+            "overhang_tolerance": 8,
+            "num_threads": 2
+        }
+
+        result = self.getImpl().run_cufflinks_batch(self.ctx, params)[0]
+
+        print 'result: '
+        pprint(result)
+
+        self.assertTrue('report_name' in result)
+        self.assertTrue('report_ref' in result)
+        self.assertEqual(len(result['results']), 2)
+
+        alignment_result, set_result = result['results']
+        self.assertEqual(alignment_result['alignment_object_ref'], self.alignment_ref_1)
+        self.assertTrue('expression_obj_ref' in alignment_result)
+        self.assertTrue('genes.fpkm_tracking' in os.listdir(alignment_result['result_directory']))
+
+        self.assertEqual(set_result['alignment_object_ref'], self.alignment_kbasesets_set_ref)
+        result_files = os.listdir(set_result['result_directory'])
+        expect_result_files = ['test_Alignment_1_batch_expression',
+                               'test_Alignment_2_batch_expression']
+        self.assertTrue(all(x in result_files for x in expect_result_files))
+        self.assertTrue('exprMatrix_FPKM_ref' in set_result)
+        self.assertTrue('exprMatrix_TPM_ref' in set_result)
+
+    def test_cufflinks_app_kbasesets_alignment_set_incremental(self):
+        params = {
+            "workspace_name": self.getWsName(),
+            "expression_set_suffix": "_incremental_expression_set",
+            "expression_suffix": "_incremental_expression",
+            "alignment_object_ref": self.alignment_kbasesets_set_ref,
+            "genome_ref": self.__class__.genome_ref,
+            "min_intron_length": 50,
+            "max_intron_length": 300000,
+            "overhang_tolerance": 8,
+            "num_threads": 2,
+            "incremental": 1
+        }
+
+        first_result = self.getImpl().run_cufflinks(self.ctx, params.copy())[0]
+        second_result = self.getImpl().run_cufflinks(self.ctx, params.copy())[0]
+
+        first_set = self.set_api.get_expression_set_v1({
+            'ref': first_result['expression_obj_ref']})['data']
+        second_set = self.set_api.get_expression_set_v1({
+            'ref': second_result['expression_obj_ref']})['data']
+
+        # same object, new version, every expression reused
+        self.assertEqual(first_result['expression_obj_ref'].split('/')[:2],
+                         second_result['expression_obj_ref'].split('/')[:2])
+        self.assertNotEqual(first_result['expression_obj_ref'],
+                            second_result['expression_obj_ref'])
+        self.assertEqual([item['ref'] for item in first_set['items']],
+                         [item['ref'] for item in second_set['items']])
+        self.assertEqual(os.listdir(second_result['result_directory']), [])
+        self.assertTrue('exprMatrix_FPKM_ref' in second_result)
+
+    def test_cufflinks_app_fast_preset(self):
+        params = {
+            "workspace_name": self.getWsName(),
+            "expression_set_suffix": "_fast_expression_set",
+            "expression_suffix": "_fast_expression",
+            "alignment_object_ref": self.alignment_ref_1,
+            "genome_ref": self.__class__.genome_ref,
+            "num_threads": 1,
+            "preset": "fast",
+            "max_bundle_frags": 200000,
+            "library_type": "fr-unstranded"
+        }
+        result = self.getImpl().run_cufflinks(self.ctx, params)[0]
+
+        self.assertTrue('expression_obj_ref' in result)
+        result_files = os.listdir(result['result_directory'])
+        self.assertTrue('genes.fpkm_tracking' in result_files)
+
+    def test_cufflinks_options_command(self):
+        params = {'preset': 'fast', 'max_bundle_frags': 200000, 'multi_read_correct': 1,
+                  'library_type': 'fr-firststrand', 'num_threads': 2,
+                  'result_directory': 'out', 'gtf_file': 'genes.gtf', 'input_file': 'in.bam'}
+        command = self.cufflinks_runner._generate_command(
+            self.cufflinks_runner._resolve_cufflinks_options(params))
+
+        # explicit options win over the preset
+        self.assertIn(' --max-bundle-frags 200000', command)
+        self.assertIn(' --multi-read-correct', command)
+        self.assertIn(' --max-bundle-length 1000000', command)
+        self.assertIn(' --no-effective-length-correction', command)
+        self.assertIn(' --library-type fr-firststrand', command)
+        self.assertNotIn('--frag-bias-correct', command)
+
+        with self.assertRaises(ValueError):
+            self.cufflinks_runner._validate_cufflinks_options({'preset': 'fastest'})
+
+    def test_gff_to_gtf_matches_gffread(self):
+        # the in-process conversion writes the exon and CDS records gffread writes for a
+        # GenomeFileUtil GFF
+        gff_file = self.gfu.genome_to_gff({'genome_ref': self.genome_ref})['file_path']
+        gffread_file = os.path.join(self.scratch, 'gffread_' + str(time.time()) + '.gtf')
+        converted_file = os.path.join(self.scratch, 'converted_' + str(time.time()) + '.gtf')
+        self.cufflinks_runner._run_gffread(gff_file, gffread_file)
+        self.assertTrue(convert_gff3_to_gtf(gff_file, converted_file) > 0)
+
+        with open(gffread_file) as gffread, open(converted_file) as converted:
+            # newer gffread releases add comments and transcript records, which cufflinks
+            # does not read
+            self.assertEqual([line for line in gffread.read().splitlines()
+                              if line.split('\t')[2:3] in (['exon'], ['CDS'])],
+                             converted.read().splitlines())
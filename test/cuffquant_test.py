@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import os
+import shutil
+import tempfile
+
+from kb_cufflinks.core.cuffquant import CuffQuant
+
+
+class RecordingCuffQuant(CuffQuant):
+
+    def __init__(self, config):
+        CuffQuant.__init__(self, config, logging.getLogger('cuffquant_test'))
+        self.quantified = list()
+
+    def run_cuffquant(self, directory, num_threads, merged_gtf, bam_file, params):
+        self.quantified.append(bam_file)
+        os.makedirs(directory)
+        cxb_file = os.path.join(directory, 'abundances.cxb')
+        with open(cxb_file, 'w') as cxb:
+            cxb.write(bam_file)
+        return cxb_file
+
+
+class CuffQuantTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.merged_gtf = os.path.join(self.scratch, 'merged.gtf')
+        with open(self.merged_gtf, 'w') as gtf:
+            gtf.write('c1\tCuffmerge\texon\t1\t10\t.\t+\t.\tgene_id "g1";\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def test_quantify_once(self):
+        runner = RecordingCuffQuant({'scratch': self.scratch})
+        bam_files = ['a.bam', 'b.bam']
+
+        cxb_files = runner.get_abundances(bam_files, ['1/2/3', '1/4/1'], self.merged_gtf, 4, {})
+        self.assertEqual(runner.quantified, ['a.bam', 'b.bam'])
+        with open(cxb_files[1]) as cxb:
+            self.assertEqual(cxb.read(), 'b.bam')
+
+        # a new contrast over the same samples reuses the .cxb files
+        self.assertEqual(runner.get_abundances(bam_files, ['1/2/3', '1/4/1'],
+                                               self.merged_gtf, 4, {}), cxb_files)
+        self.assertEqual(len(runner.quantified), 2)
+
+        # options changing the quantification or a new alignment version do not
+        runner.get_abundances(bam_files, ['1/2/3', '1/4/2'], self.merged_gtf, 4,
+                              {'library_type': 'fr-firststrand'})
+        self.assertEqual(len(runner.quantified), 4)
+        runner.get_abundances(bam_files, ['1/2/3', '1/4/2'], self.merged_gtf, 4,
+                              {'library_type': 'fr-firststrand', 'time_series': 1})
+        self.assertEqual(len(runner.quantified), 4)
+
+    def test_merged_gtf_changes_key(self):
+        runner = RecordingCuffQuant({'scratch': self.scratch})
+        runner.get_abundances(['a.bam'], ['1/2/3'], self.merged_gtf, 1, {})
+        with open(self.merged_gtf, 'a') as gtf:
+            gtf.write('c1\tCuffmerge\texon\t20\t30\t.\t+\t.\tgene_id "g2";\n')
+        runner.get_abundances(['a.bam'], ['1/2/3'], self.merged_gtf, 1, {})
+        self.assertEqual(runner.quantified, ['a.bam', 'a.bam'])
+
+    def test_cached_abundances_need_no_bam(self):
+        runner = RecordingCuffQuant({'scratch': self.scratch})
+        self.assertEqual(runner.get_cached_abundances(['1/2/3'], self.merged_gtf, {}), [None])
+        cxb_files = runner.get_abundances(['a.bam'], ['1/2/3'], self.merged_gtf, 1, {})
+
+        # cached samples are looked up before their alignments are staged
+        self.assertEqual(runner.get_cached_abundances(['1/2/3', '1/4/1'], self.merged_gtf, {}),
+                         [cxb_files[0], None])
+        runner.get_abundances([None, 'b.bam'], ['1/2/3', '1/4/1'], self.merged_gtf, 1, {})
+        self.assertEqual(runner.quantified, ['a.bam', 'b.bam'])
+
+    def test_cache_bound(self):
+        runner = RecordingCuffQuant({'scratch': self.scratch, 'cuffquant-cache-size': '8'})
+        first = runner.get_abundances(['a.bam'], ['1/2/3'], self.merged_gtf, 1, {})
+        # .cxb files in use are not evicted
+        runner.get_abundances(['b.bam'], ['1/4/1'], self.merged_gtf, 1, {})
+        self.assertTrue(os.path.exists(first[0]))
+
+        runner.release()
+        self.assertEqual(runner.leases, [])
+        os.utime(os.path.dirname(first[0]), (0, 0))
+        runner.get_abundances(['c.bam'], ['1/5/1'], self.merged_gtf, 1, {})
+        self.assertFalse(os.path.exists(first[0]))
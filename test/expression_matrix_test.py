@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from kb_cufflinks.core.expression_matrix import ExpressionMatrixBuilder
+
+
+class ExpressionMatrixBuilderTest(unittest.TestCase):
+
+    def test_union_of_gene_ids(self):
+        builder = ExpressionMatrixBuilder()
+        builder.add_sample('sample_1', {'g1': 1.0, 'g2': 2.0}, {'g1': 3.0, 'g2': 4.0}, 'c1')
+        builder.add_sample('sample_2', {'g2': 5.0, 'g3': 6.0}, {'g2': 7.0, 'g3': 8.0}, 'c2')
+
+        fpkm_values, tpm_values = builder.build()
+
+        self.assertEqual(builder.col_ids, ['sample_1', 'sample_2'])
+        self.assertEqual(sorted(builder.row_ids), ['g1', 'g2', 'g3'])
+        rows = dict((gene_id, i) for i, gene_id in enumerate(builder.row_ids))
+        self.assertEqual(fpkm_values.shape, (3, 2))
+        self.assertEqual(list(fpkm_values[rows['g1']]), [1.0, 0.0])
+        self.assertEqual(list(fpkm_values[rows['g2']]), [2.0, 5.0])
+        self.assertEqual(list(fpkm_values[rows['g3']]), [0.0, 6.0])
+        self.assertEqual(list(tpm_values[rows['g2']]), [4.0, 7.0])
+
+    def test_matrix_data(self):
+        builder = ExpressionMatrixBuilder()
+        builder.add_sample('sample_1', {'g1': 1.0}, {'g1': 2.0}, 'c1')
+
+        fpkm_data, tpm_data = builder.get_matrix_data('1/2/3')
+
+        self.assertEqual(fpkm_data['genome_ref'], '1/2/3')
+        self.assertEqual(fpkm_data['scale'], 'log2')
+        self.assertEqual(fpkm_data['condition_mapping'], {'sample_1': 'c1'})
+        self.assertEqual(fpkm_data['data'], {'row_ids': ['g1'],
+                                             'col_ids': ['sample_1'],
+                                             'values': [[1.0]]})
+        self.assertEqual(tpm_data['data']['values'], [[2.0]])
+
+    def test_duplicate_and_empty(self):
+        builder = ExpressionMatrixBuilder()
+        with self.assertRaises(ValueError):
+            builder.get_matrix_data('1/2/3')
+        builder.add_sample('sample_1', {'g1': 1.0}, {'g1': 2.0})
+        with self.assertRaises(ValueError):
+            builder.add_sample('sample_1', {'g1': 1.0}, {'g1': 2.0})
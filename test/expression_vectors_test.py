@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import math
+import shutil
+import tempfile
+
+from kb_cufflinks.core.expression_vectors import ExpressionVectorStore, parse_tracking_file
+from kb_cufflinks.core.expression_matrix import ExpressionMatrixBuilder
+
+HEADER = ['tracking_id', 'class_code', 'nearest_ref_id', 'gene_id', 'gene_short_name',
+          'tss_id', 'locus', 'length', 'coverage', 'FPKM', 'FPKM_conf_lo', 'FPKM_conf_hi',
+          'FPKM_status']
+
+
+class ExpressionVectorStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.store = ExpressionVectorStore(os.path.join(self.scratch, 'vectors'))
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def _write_sample(self, name, rows):
+        result_directory = os.path.join(self.scratch, name)
+        os.makedirs(result_directory)
+        with open(os.path.join(result_directory, 'genes.fpkm_tracking'), 'w') as f:
+            f.write('\t'.join(HEADER) + '\n')
+            for gene_id, fpkm, status in rows:
+                f.write('\t'.join([gene_id, '-', '-', gene_id, '-', '-', 'chr1:1-100', '-',
+                                   '-', str(fpkm), str(fpkm / 2), str(fpkm * 2), status]) + '\n')
+        return result_directory
+
+    def test_columns(self):
+        result_directory = self._write_sample('s1', [('g1', 1.0, 'OK'), ('g2', 3.0, 'LOWDATA'),
+                                                     ('', 5.0, 'OK'), ('g3', 0.0, 'FAIL')])
+        ids, columns = parse_tracking_file(os.path.join(result_directory,
+                                                        'genes.fpkm_tracking'))
+        self.assertEqual(ids, ['g1', 'g2', 'g3'])
+        self.assertEqual(list(columns['FPKM_status']), [0, 1, 3])
+        self.assertEqual(list(columns['FPKM_conf_hi']), [2.0, 6.0, 0.0])
+        # rows without an id do not count towards TPM, as in parse_FPKMtracking_calc_TPM
+        self.assertAlmostEqual(columns['TPM'][1], 3.0 / 4.0 * 1e6)
+
+    def test_matches_parsed_levels(self):
+        self.store.add_sample('1/2/1', self._write_sample('s1', [('g1', 1.0, 'OK'),
+                                                                 ('g2', 3.0, 'OK')]))
+        vector_directory = self.store.get_sample('1/2/1')
+        self.assertTrue(vector_directory.startswith(self.store.cache_directory))
+
+        ids, fpkm, tpm = self.store.load_log2_levels(vector_directory)
+        self.assertEqual(ids, ['g1', 'g2'])
+        self.assertAlmostEqual(fpkm[1], math.log(3.0 + 1, 2))
+        self.assertAlmostEqual(tpm[0], math.log(0.25 * 1e6 + 1, 2))
+        self.store.release()
+        self.assertEqual(self.store.leases, [])
+
+    def test_kept_across_runs(self):
+        result_directory = self._write_sample('s1', [('g1', 1.0, 'OK')])
+        self.store.add_sample('1/2/1', result_directory)
+        shutil.rmtree(result_directory)
+
+        # a later run reusing the expression reads the cached vectors
+        store = ExpressionVectorStore(self.store.cache_directory)
+        ids, fpkm, tpm = store.load_log2_levels(store.get_sample('1/2/1'))
+        self.assertEqual(ids, ['g1'])
+        self.assertAlmostEqual(fpkm[0], 1.0)
+        self.assertEqual(store.get_sample('1/3/1'), None)
+        store.release()
+
+    def test_scoped_per_token(self):
+        config = {'scratch': self.scratch, 'KB_AUTH_TOKEN': 'token_a'}
+        store = ExpressionVectorStore.from_config(config)
+        store.add_sample('1/2/1', self._write_sample('s1', [('g1', 1.0, 'OK')]))
+        self.assertTrue(store.get_sample('1/2/1'))
+        store.release()
+
+        other = ExpressionVectorStore.from_config(dict(config, KB_AUTH_TOKEN='token_b'))
+        self.assertEqual(other.get_sample('1/2/1'), None)
+
+    def test_shared_index(self):
+        self.store.add_sample('1/2/1', self._write_sample('s1', [('g1', 1.0, 'OK')]))
+        self.store.add_sample('1/3/1', self._write_sample('s2', [('g1', 2.0, 'OK')]))
+        self.store.add_sample('1/4/1', self._write_sample('s3', [('g2', 4.0, 'OK')]))
+
+        # one index file per distinct set of ids
+        self.assertEqual(len(os.listdir(self.store.index_directory)), 2)
+
+        builder = ExpressionMatrixBuilder()
+        for name, ref in [('s1', '1/2/1'), ('s2', '1/3/1'), ('s3', '1/4/1')]:
+            gene_ids, fpkm, tpm = self.store.load_log2_levels(self.store.get_sample(ref))
+            builder.add_sample_columns(name, gene_ids, fpkm, tpm)
+        fpkm_values, tpm_values = builder.build()
+        self.store.release()
+
+        self.assertEqual(builder.row_ids, ['g1', 'g2'])
+        self.assertAlmostEqual(fpkm_values[0][1], math.log(3.0, 2))
+        self.assertEqual(fpkm_values[0][2], 0.0)
+        self.assertAlmostEqual(fpkm_values[1][2], math.log(5.0, 2))
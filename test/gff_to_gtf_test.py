@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import shutil
+import subprocess
+import tempfile
+from distutils.spawn import find_executable
+
+from kb_cufflinks.core.cufflinks_utils import CufflinksUtils
+from kb_cufflinks.core.gff_to_gtf import convert_gff3_to_gtf, _convert
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data',
+                              'gff_to_gtf')
+# the gffread cufflinks ships with in the module image, or one on PATH elsewhere
+GFFREAD = (os.path.join(CufflinksUtils.GFFREAD_TOOLKIT_PATH, 'gffread')
+           if os.path.exists(os.path.join(CufflinksUtils.GFFREAD_TOOLKIT_PATH, 'gffread'))
+           else find_executable('gffread'))
+IN_MODULE_IMAGE = os.path.isdir('/kb/module')
+
+GFF = [
+    ('chr1', 'KBase', 'gene', '100', '900', '.', '+', '.', 'ID=g1;Name=ABC%3B1'),
+    ('chr1', 'KBase', 'mRNA', '100', '900', '.', '+', '.', 'ID=g1.t1;Parent=g1'),
+    ('chr1', 'KBase', 'exon', '100', '300', '.', '+', '.', 'ID=e1;Parent=g1.t1'),
+    ('chr1', 'KBase', 'exon', '500', '900', '.', '+', '.', 'ID=e2;Parent=g1.t1'),
+    ('chr1', 'KBase', 'CDS', '200', '300', '.', '+', '0', 'ID=c1;Parent=g1.t1'),
+    ('chr1', 'KBase', 'CDS', '500', '700', '.', '+', '2', 'ID=c2;Parent=g1.t1'),
+    ('chr1', 'KBase', 'gene', '1000', '1600', '.', '-', '.', 'ID=g2'),
+    ('chr1', 'KBase', 'CDS', '1000', '1600', '.', '-', '0', 'ID=g2_CDS;Parent=g2'),
+    ('chr2', 'KBase', 'gene', '50', '400', '.', '+', '.', 'ID=g3'),
+    ('chr2', 'KBase', 'mRNA', '50', '400', '.', '+', '.', 'ID=g3.t1;Parent=g3'),
+    ('chr2', 'KBase', 'five_prime_UTR', '50', '99', '.', '+', '.', 'Parent=g3.t1'),
+    ('chr2', 'KBase', 'CDS', '100', '400', '.', '+', '0', 'Parent=g3.t1'),
+]
+
+
+def gtf_record(seqid, feature, start, end, strand, frame, attributes):
+    return '\t'.join([seqid, 'KBase', feature, start, end, '.', strand, frame, attributes])
+
+
+GTF = [
+    gtf_record('chr1', 'exon', '100', '300', '+', '.',
+               'transcript_id "g1.t1"; gene_id "g1"; gene_name "ABC;1";'),
+    gtf_record('chr1', 'exon', '500', '900', '+', '.',
+               'transcript_id "g1.t1"; gene_id "g1"; gene_name "ABC;1";'),
+    gtf_record('chr1', 'CDS', '200', '300', '+', '0',
+               'transcript_id "g1.t1"; gene_id "g1"; gene_name "ABC;1";'),
+    gtf_record('chr1', 'CDS', '500', '700', '+', '2',
+               'transcript_id "g1.t1"; gene_id "g1"; gene_name "ABC;1";'),
+    gtf_record('chr1', 'exon', '1000', '1600', '-', '.', 'transcript_id "g2"; gene_id "g2";'),
+    gtf_record('chr1', 'CDS', '1000', '1600', '-', '0', 'transcript_id "g2"; gene_id "g2";'),
+    gtf_record('chr2', 'exon', '50', '400', '+', '.', 'transcript_id "g3.t1"; gene_id "g3";'),
+    gtf_record('chr2', 'CDS', '100', '400', '+', '0', 'transcript_id "g3.t1"; gene_id "g3";'),
+]
+
+
+class GffToGtfTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.gff_file = os.path.join(self.scratch, 'genome.gff')
+        self.gtf_file = os.path.join(self.scratch, 'genome.gtf')
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def _convert(self, records, trailer=''):
+        with open(self.gff_file, 'w') as gff:
+            gff.write('##gff-version 3\n')
+            gff.write(''.join('\t'.join(record) + '\n' for record in records) + trailer)
+        num_transcripts = convert_gff3_to_gtf(self.gff_file, self.gtf_file)
+        with open(self.gtf_file) as gtf:
+            return num_transcripts, gtf.read().splitlines()
+
+    def test_gene_ordered(self):
+        self.assertEqual(self._convert(GFF, '##FASTA\n>chr1\nACGT\n'), (3, GTF))
+
+    def test_not_gene_ordered(self):
+        # a child after the next locus forces the buffered conversion, with the same output
+        records = GFF[:4] + GFF[6:] + GFF[4:6]
+        self.assertEqual(self._convert(records), (3, GTF))
+
+    def test_invalid_record(self):
+        with self.assertRaises(ValueError):
+            self._convert([('chr1', 'KBase', 'gene')])
+
+    def test_fixture(self):
+        # genome.gtf is the expected conversion of genome.gff; test_matches_gffread and
+        # CufflinksTest.test_gff_to_gtf_matches_gffread check it against gffread itself
+        gff_file = os.path.join(DATA_DIRECTORY, 'genome.gff')
+        self.assertEqual(_convert(gff_file, self.gtf_file, streaming=True), 7)
+        with open(self.gtf_file) as gtf, open(os.path.join(DATA_DIRECTORY,
+                                                           'genome.gtf')) as expected:
+            self.assertEqual(gtf.read().splitlines(), expected.read().splitlines())
+
+    @unittest.skipUnless(GFFREAD or IN_MODULE_IMAGE, 'gffread is not installed')
+    def test_matches_gffread(self):
+        # never skipped in the module image, where gffread must be present
+        self.assertTrue(GFFREAD, 'gffread not found in the module image')
+        gff_file = os.path.join(DATA_DIRECTORY, 'genome.gff')
+        gffread_file = os.path.join(self.scratch, 'gffread.gtf')
+        subprocess.check_call([GFFREAD, '-E', gff_file, '-T', '-o', gffread_file])
+        convert_gff3_to_gtf(gff_file, self.gtf_file)
+        with open(self.gtf_file) as gtf, open(gffread_file) as expected:
+            # newer gffread releases add comments and transcript records, which cufflinks
+            # does not read
+            self.assertEqual(gtf.read().splitlines(),
+                             [line for line in expected.read().splitlines()
+                              if line.split('\t')[2:3] in (['exon'], ['CDS'])])
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import json
+import shutil
+import tempfile
+
+from kb_cufflinks.core.html_report import PaginatedReport, DATA_FILE_NAME
+
+
+class PaginatedReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_directory)
+
+    def test_write(self):
+        report = PaginatedReport(page_size=10)
+        report.add_table('Samples', ['Name', 'Condition'],
+                         [['sample_{}'.format(i), None] for i in range(1000)])
+        report.add_table('Notes', ['Note'], [['</script>']])
+
+        report_file_path = report.write(self.output_directory)
+
+        with open(report_file_path) as report_file:
+            report_html = report_file.read()
+        self.assertNotIn('Inline_Report_Data', report_html)
+        # only the first page of each table is inlined, as a fallback for the data file
+        self.assertIn('"sample_9"', report_html)
+        self.assertNotIn('sample_10', report_html)
+        self.assertIn('"row_count":1000', report_html)
+        self.assertEqual(report_html.count('</script>'), 1)
+
+        with open(os.path.join(self.output_directory, DATA_FILE_NAME)) as data_file:
+            report_data = json.load(data_file)
+        self.assertEqual(report_data['page_size'], 10)
+        self.assertEqual(len(report_data['tables'][0]['rows']), 1000)
+        self.assertEqual(report_data['tables'][0]['rows'][999], ['sample_999', ''])
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import math
+import shutil
+import tempfile
+
+from kb_cufflinks.core.service_clients import ServiceClients
+from kb_cufflinks.core.local_clients import LocalWorkspace, get_subset
+
+TRACKING_HEADER = ['tracking_id', 'class_code', 'nearest_ref_id', 'gene_id', 'gene_short_name',
+                   'tss_id', 'locus', 'length', 'coverage', 'FPKM', 'FPKM_conf_lo',
+                   'FPKM_conf_hi', 'FPKM_status']
+
+
+class LocalClientsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.clients = ServiceClients({'workspace-url': None,
+                                       'SDK_CALLBACK_URL': None,
+                                       'scratch': self.scratch,
+                                       'client-backend': 'local'})
+        self.wsid = self.clients.local_store.create_workspace('local_test')
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def test_objects(self):
+        self.assertIsInstance(self.clients.ws, LocalWorkspace)
+        self.assertEqual(self.clients.dfu.ws_name_to_id('local_test'), self.wsid)
+
+        info = self.clients.dfu.save_objects({'id': self.wsid, 'objects': [
+            {'type': 'KBaseRNASeq.RNASeqAlignment', 'name': 'a_alignment',
+             'data': {'condition': 'WT', 'genome_id': '1/2/3'}}]})[0]
+        self.assertEqual(info[2], 'KBaseRNASeq.RNASeqAlignment-1.0')
+        self.clients.dfu.save_objects({'id': self.wsid, 'objects': [
+            {'type': 'KBaseRNASeq.RNASeqAlignment-1.1', 'name': 'a_alignment',
+             'data': {'condition': 'hy5', 'genome_id': '1/2/3'}}]})
+
+        self.assertEqual(self.clients.ws.get_objects2(
+            {'objects': [{'ref': 'local_test/a_alignment', 'included': ['condition']}]}
+        )['data'][0]['data'], {'condition': 'hy5'})
+        infos = self.clients.ws.get_object_info3({'objects': [{'ref': '2/3/4;1/1/1'}]})
+        self.assertEqual(infos['infos'][0][1], 'a_alignment')
+        self.assertEqual(infos['paths'][0], ['2/3/4', '1/1/1'])
+        with self.assertRaises(ValueError):
+            self.clients.dfu.ws_name_to_id('missing')
+
+        with self.assertRaises(ValueError):
+            self.clients.ws.get_object_info3({'objects': [{'ref': 'local_test/missing'}]})
+        infos = self.clients.ws.get_object_info3({'objects': [{'ref': 'local_test/missing'},
+                                                              {'ref': 'local_test/a_alignment'}],
+                                                  'ignoreErrors': 1})
+        self.assertEqual(infos['infos'][0], None)
+        self.assertEqual(infos['infos'][1][1], 'a_alignment')
+
+    def test_subset(self):
+        data = {'items': [{'ref': '1/2/3', 'label': 'a'}], 'description': 'x',
+                'mapped': {'s1': '1/4/1'}}
+        self.assertEqual(get_subset(data, ['items/[*]/ref', 'mapped']),
+                         {'items': [{'ref': '1/2/3'}], 'mapped': {'s1': '1/4/1'}})
+        self.assertEqual(get_subset(data, ['missing']), {})
+
+    def test_files_and_expression(self):
+        source_dir = os.path.join(self.scratch, 'cufflinks_result')
+        os.makedirs(source_dir)
+        with open(os.path.join(source_dir, 'genes.fpkm_tracking'), 'w') as tracking:
+            tracking.write('\t'.join(TRACKING_HEADER) + '\n')
+            for gene_id, fpkm in [('g1', '30'), ('g2', '10')]:
+                tracking.write('\t'.join([gene_id, '-', '-', gene_id, '-', '-', 'c:1-9', '-',
+                                          '2.5', fpkm, '0', '0', 'OK']) + '\n')
+
+        bam_file = os.path.join(self.scratch, 'reads.bam')
+        open(bam_file, 'w').close()
+        alignment_ref = '{}/{}/{}'.format(*[self.clients.dfu.save_objects(
+            {'id': self.wsid, 'objects': [{'type': 'KBaseRNASeq.RNASeqAlignment',
+                                          'name': 'a_alignment',
+                                          'data': {'condition': 'WT', 'read_sample_id': 's1',
+                                                   'file': {'id': bam_file}}}]})[0][i]
+            for i in (6, 0, 4)])
+        alignment_dir = self.clients.rau.download_alignment(
+            {'source_ref': alignment_ref})['destination_dir']
+        self.assertEqual(os.listdir(alignment_dir), ['reads.bam'])
+
+        expression_ref = self.clients.eu.upload_expression({
+            'destination_ref': 'local_test/a_expression', 'source_dir': source_dir,
+            'alignment_ref': alignment_ref})['obj_ref']
+        expression = self.clients.ws.get_objects2(
+            {'objects': [{'ref': expression_ref}]})['data'][0]['data']
+        self.assertEqual(expression['condition'], 'WT')
+        self.assertEqual(expression['mapped_rnaseq_alignment'], {'s1': alignment_ref})
+        # levels are log2(x + 1), as ExpressionUtils stores them
+        for levels, expected in [('expression_levels', {'g1': 31, 'g2': 11}),
+                                 ('tpm_expression_levels', {'g1': 750001, 'g2': 250001})]:
+            self.assertEqual(sorted(expression[levels]), ['g1', 'g2'])
+            for gene_id, value in expected.items():
+                self.assertAlmostEqual(expression[levels][gene_id], math.log(value, 2))
+
+        expression_dir = self.clients.eu.download_expression(
+            {'source_ref': expression_ref})['destination_dir']
+        self.assertEqual(os.listdir(expression_dir), ['genes.fpkm_tracking'])
+
+        set_ref = self.clients.set_api.save_expression_set_v1({
+            'workspace': 'local_test', 'output_object_name': 'a_set',
+            'data': {'description': '', 'items': [{'ref': expression_ref}]}})['set_ref']
+        expression_set = self.clients.set_api.get_expression_set_v1(
+            {'ref': set_ref, 'include_set_item_ref_paths': 1})
+        self.assertEqual(expression_set['data']['items'][0]['ref_path'],
+                         set_ref + ';' + expression_ref)
+        self.assertTrue(expression_set['info'][2].startswith('KBaseSets.ExpressionSet-'))
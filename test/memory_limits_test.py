@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from kb_cufflinks.core.cufflinks_utils import CufflinksUtils
+from kb_cufflinks.core.bam_utils import MIN_BUNDLE_FRAGS, MAX_BUNDLE_FRAGS
+from kb_cufflinks.core.memory_limits import (MemoryLimitError, degraded_options,
+                                             get_memory_limit, is_memory_failure,
+                                             memory_limit_preexec)
+
+
+class MemoryLimitsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        os.environ.setdefault('VERSION', '2.2.1')
+        self.config = {'scratch': self.scratch, 'workspace-url': 'http://localhost/ws',
+                       'SDK_CALLBACK_URL': 'http://localhost:5000', 'srv-wiz-url': '',
+                       'KB_AUTH_TOKEN': '', 'shock-url': '', 'memory-retries': '2'}
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def test_is_memory_failure(self):
+        self.assertTrue(is_memory_failure(-9))
+        self.assertTrue(is_memory_failure(137, ''))
+        self.assertTrue(is_memory_failure(1, "terminate called after throwing an instance of "
+                                             "'std::bad_alloc'"))
+        self.assertFalse(is_memory_failure(1, 'Error: cannot open alignment file'))
+        self.assertFalse(is_memory_failure(0, 'std::bad_alloc'))
+
+    def test_degraded_options(self):
+        self.assertEqual(degraded_options(8, 2000000), (4, 500000))
+        self.assertEqual(degraded_options(1, None), (1, MAX_BUNDLE_FRAGS // 4))
+        self.assertEqual(degraded_options(None, MIN_BUNDLE_FRAGS), (1, MIN_BUNDLE_FRAGS))
+
+    def test_get_memory_limit(self):
+        self.assertEqual(get_memory_limit({}, 8 << 30), None)
+        self.assertEqual(get_memory_limit({'subprocess-memory-limit': 'auto'}, 8 << 30), 8 << 30)
+        self.assertEqual(get_memory_limit({'subprocess-memory-limit': 'auto'}, 8 << 30, 4),
+                         2 << 30)
+        self.assertEqual(get_memory_limit({}, None), None)
+        self.assertEqual(get_memory_limit({'subprocess-memory-limit': 'none'}, 8 << 30), None)
+        self.assertEqual(get_memory_limit({'subprocess-memory-limit': '3G'}, 8 << 30, 4),
+                         3 << 30)
+
+    def test_memory_limit_preexec(self):
+        allocate = [sys.executable, '-c', "x = ' ' * (512 << 20)"]
+        pipe = subprocess.Popen(allocate, stderr=subprocess.PIPE,
+                                preexec_fn=memory_limit_preexec(256 << 20))
+        errors = pipe.communicate()[1]
+        self.assertTrue(is_memory_failure(pipe.returncode, errors))
+        self.assertEqual(memory_limit_preexec(None), None)
+
+    def test_other_commands_uncapped(self):
+        runner = CufflinksUtils(self.config)
+        runner.memory_limit = 256 << 20
+        runner._run_command('{} -c "x = \' \' * (512 << 20)"'.format(sys.executable))
+        with self.assertRaises(MemoryLimitError):
+            runner._run_command('{} -c "x = \' \' * (512 << 20)"'.format(sys.executable),
+                                runner.memory_limit)
+
+    def test_cufflinks_retry(self):
+        runner = CufflinksUtils(self.config)
+        commands = []
+
+        def run_command(command, memory_limit=None, error_file=None):
+            commands.append(command)
+            if len(commands) < 3:
+                raise MemoryLimitError('out of memory', -9)
+        runner._run_command = run_command
+
+        params = {'input_file': 'sample.bam', 'result_directory': self.scratch,
+                  'gtf_file': 'genes.gtf', 'num_threads': 8, 'max_bundle_frags': 2000000}
+        runner._run_cufflinks_command(params, 1 << 30)
+
+        self.assertEqual(len(commands), 3)
+        self.assertIn('-p 8', commands[0])
+        self.assertIn('-p 2', commands[2])
+        self.assertIn('--max-bundle-frags 125000', commands[2])
+        self.assertEqual([(e['attempt'], e['num_threads'], e['max_bundle_frags'])
+                          for e in runner.telemetry], [(1, 4, 500000), (2, 2, 125000)])
+
+        commands[:] = []
+        runner.memory_retries = 1
+        with self.assertRaises(MemoryLimitError):
+            runner._run_cufflinks_command(params, 1 << 30)
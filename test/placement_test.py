@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import shutil
+import subprocess
+import tempfile
+
+from kb_cufflinks.core.placement import (affinity_preexec, cpu_set_nodes, get_affinity,
+                                         numa_nodes, plan_cpu_sets)
+
+NODES = [(0, range(0, 8)), (1, range(8, 16))]
+
+
+class PlacementTest(unittest.TestCase):
+
+    def test_plan_cpu_sets(self):
+        # whole slots stay on one node
+        cpu_sets = plan_cpu_sets(4, range(16), NODES)
+        self.assertEqual(cpu_sets, [range(0, 4), range(4, 8), range(8, 12), range(12, 16)])
+        self.assertEqual([cpu_set_nodes(cpus, NODES) for cpus in cpu_sets], [[0], [0], [1], [1]])
+
+        # three slots of five: the last one takes the leftovers of both nodes
+        self.assertEqual(plan_cpu_sets(3, range(16), NODES),
+                         [range(0, 5), range(8, 13), [5, 6, 7, 13, 14]])
+
+        # thread budget below the CPU count, and CPUs outside the cpuset
+        self.assertEqual(plan_cpu_sets(2, [2, 3, 4, 9, 10, 11], NODES, per_slot=2),
+                         [[2, 3], [9, 10]])
+        self.assertEqual(plan_cpu_sets(4, [0, 1], NODES), None)
+
+    def test_numa_nodes(self):
+        node_directory = tempfile.mkdtemp()
+        try:
+            for node, cpu_list in [(0, '0-3,8-11'), (1, '4-7,12-15')]:
+                os.makedirs(os.path.join(node_directory, 'node{}'.format(node)))
+                with open(os.path.join(node_directory, 'node{}'.format(node), 'cpulist'),
+                          'w') as cpulist:
+                    cpulist.write(cpu_list + '\n')
+            os.makedirs(os.path.join(node_directory, 'power'))
+            self.assertEqual(numa_nodes(node_directory),
+                             [(0, [0, 1, 2, 3, 8, 9, 10, 11]), (1, [4, 5, 6, 7, 12, 13, 14, 15])])
+        finally:
+            shutil.rmtree(node_directory)
+        self.assertEqual(len(numa_nodes(os.path.join(node_directory, 'missing'))), 1)
+
+    def test_pin_subprocess(self):
+        allowed = get_affinity()
+        self.assertTrue(allowed)
+        output = subprocess.Popen('grep Cpus_allowed_list /proc/self/status',
+                                  stdout=subprocess.PIPE, shell=True,
+                                  preexec_fn=affinity_preexec(allowed[:1])).communicate()[0]
+        self.assertEqual(output.split()[-1], str(allowed[0]))
+        # the parent keeps its CPUs
+        self.assertEqual(get_affinity(), allowed)
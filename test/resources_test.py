@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import unittest
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from kb_cufflinks.core.resources import Resources, parse_cpu_list
+
+
+class ResourcesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.cgroup_root = os.path.join(self.scratch, 'cgroup')
+        self.proc_cgroup = os.path.join(self.scratch, 'proc_cgroup')
+        self.meminfo = os.path.join(self.scratch, 'meminfo')
+        self._write(self.meminfo, 'MemTotal:       16384000 kB\nMemFree:  1024 kB\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def _write(self, path, content):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def _detect(self):
+        return Resources.detect(self.cgroup_root, self.proc_cgroup, self.meminfo)
+
+    def test_cgroup_v2(self):
+        self._write(os.path.join(self.cgroup_root, 'cgroup.controllers'), 'cpu cpuset memory\n')
+        self._write(self.proc_cgroup, '0::/job\n')
+        job = os.path.join(self.cgroup_root, 'job')
+        self._write(os.path.join(job, 'cpu.max'), '150000 100000\n')
+        self._write(os.path.join(job, 'memory.max'), '4294967296\n')
+
+        resources = self._detect()
+        self.assertEqual(resources.cpus, min(2, multiprocessing.cpu_count()))
+        self.assertEqual(resources.memory, 4 << 30)
+
+        self._write(os.path.join(job, 'cpu.max'), 'max 100000\n')
+        self._write(os.path.join(job, 'memory.max'), 'max\n')
+        resources = self._detect()
+        self.assertEqual(resources.cpus, multiprocessing.cpu_count())
+        self.assertEqual(resources.memory, 16384000 * 1024)
+
+    def test_cgroup_v1(self):
+        # containers see their cgroup at the controller mount root
+        self._write(self.proc_cgroup, '4:memory:/docker/abc\n3:cpuset:/docker/abc\n'
+                                      '2:cpu,cpuacct:/docker/abc\n')
+        cpu = os.path.join(self.cgroup_root, 'cpu,cpuacct')
+        self._write(os.path.join(cpu, 'cpu.cfs_quota_us'), '-1\n')
+        self._write(os.path.join(cpu, 'cpu.cfs_period_us'), '100000\n')
+        self._write(os.path.join(self.cgroup_root, 'cpuset', 'cpuset.cpus'), '0\n')
+        self._write(os.path.join(self.cgroup_root, 'memory', 'memory.limit_in_bytes'),
+                    '9223372036854771712\n')
+
+        resources = self._detect()
+        self.assertEqual(resources.cpus, 1)
+        self.assertEqual(resources.memory, 16384000 * 1024)
+
+        self._write(os.path.join(self.cgroup_root, 'memory', 'docker', 'abc',
+                                 'memory.limit_in_bytes'), '1073741824\n')
+        self.assertEqual(self._detect().memory, 1 << 30)
+
+    def test_no_cgroups(self):
+        resources = Resources.detect(self.cgroup_root, self.proc_cgroup,
+                                     os.path.join(self.scratch, 'missing'))
+        self.assertEqual(resources.cpus, multiprocessing.cpu_count())
+        self.assertEqual(resources.memory, None)
+
+    def test_overrides(self):
+        resources = Resources.from_config({'cpu-limit': '3', 'memory-limit': '2G'})
+        self.assertEqual((resources.cpus, resources.memory), (3, 2 << 30))
+        self.assertEqual(resources.threads(), 3)
+        self.assertEqual(resources.threads(2), 2)
+        self.assertEqual(resources.threads(8), 3)
+
+        self.assertEqual(parse_cpu_list('0-3,8,10-11'), [0, 1, 2, 3, 8, 10, 11])
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import shutil
+import tempfile
+
+from kb_cufflinks.core.scratch_manager import ScratchManager, parse_size
+
+
+class ScratchManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.job_directory = os.path.join(self.scratch, 'job')
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def _write(self, path, size=10):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('x' * size)
+
+    def test_cleanup_keeps_results(self):
+        manager = ScratchManager(self.job_directory)
+        download = os.path.join(self.scratch, 'download_1')
+        with manager.job():
+            result_directory = manager.make_directory('result_')
+            self._write(os.path.join(result_directory, 'genes.fpkm_tracking'))
+            self._write(os.path.join(manager.make_directory(), 'report.html'))
+            self._write(os.path.join(download, 'a.bam'))
+            manager.track(download)
+            # a download written straight into the shared scratch root is never removed
+            manager.track(self.scratch)
+            manager.retain(result_directory)
+
+        self.assertEqual(os.listdir(self.job_directory), [os.path.basename(result_directory)])
+        self.assertEqual(os.listdir(result_directory), ['genes.fpkm_tracking'])
+        self.assertFalse(os.path.exists(download))
+        self.assertTrue(os.path.isdir(self.scratch))
+
+    def test_failure(self):
+        manager = ScratchManager(self.job_directory)
+        with self.assertRaises(RuntimeError):
+            with manager.job():
+                manager.make_directory()
+                raise RuntimeError('cufflinks failed')
+        self.assertFalse(os.path.exists(self.job_directory))
+
+        manager = ScratchManager(self.job_directory, keep_on_failure=True)
+        with self.assertRaises(RuntimeError):
+            with manager.job():
+                directory = manager.make_directory()
+                raise RuntimeError('cufflinks failed')
+        self.assertTrue(os.path.isdir(directory))
+
+    def test_quota(self):
+        self.assertEqual(parse_size('1.5K'), 1536)
+        self.assertEqual(parse_size('20G'), 20 << 30)
+        self.assertIsNone(parse_size(''))
+
+        manager = ScratchManager(self.job_directory, quota=100)
+        manager.check_space(50)
+        self._write(os.path.join(manager.make_directory(), 'big'), 80)
+        with self.assertRaises(ValueError):
+            manager.check_space(50)
+        with self.assertRaises(ValueError):
+            ScratchManager(self.job_directory, min_free=1 << 60).check_space()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import sys
+import json
+import subprocess
+
+from os import environ
+try:
+    from ConfigParser import ConfigParser  # py2
+except BaseException:
+    from configparser import ConfigParser  # py3
+
+from kb_cufflinks.core.cufflinks_utils import CufflinksUtils
+from kb_cufflinks.kb_cufflinksImpl import kb_cufflinks
+from kb_cufflinks.kb_cufflinksServer import MethodContext
+
+# construction of the service Impl for the async CLI path must stay within this budget
+STARTUP_BUDGET_SECONDS = 1.0
+
+STARTUP_SCRIPT = """
+import json
+import sys
+import time
+start = time.time()
+from kb_cufflinks.kb_cufflinksImpl import kb_cufflinks
+impl = kb_cufflinks(json.loads(sys.argv[1]))
+impl.status(None)
+print(json.dumps({'elapsed': time.time() - start,
+                  'pathos_loaded': 'pathos' in sys.modules,
+                  'requests_loaded': 'requests' in sys.modules,
+                  'cuffdiff_built': impl.cuffdiff_runner is not None}))
+"""
+
+
+class StartupTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        config_file = environ.get('KB_DEPLOYMENT_CONFIG', None)
+        cls.cfg = {}
+        config = ConfigParser()
+        config.read(config_file)
+        for nameval in config.items('kb_cufflinks'):
+            cls.cfg[nameval[0]] = nameval[1]
+        cls.cfg['log-sys-stat'] = 'false'
+        cls.ctx = MethodContext(None)
+
+    def test_startup_within_budget(self):
+        output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT,
+                                          json.dumps(self.cfg)])
+        startup = json.loads(output.strip().splitlines()[-1])
+        print('startup: ' + str(startup))
+
+        self.assertLess(startup['elapsed'], STARTUP_BUDGET_SECONDS)
+        self.assertFalse(startup['pathos_loaded'])
+        self.assertFalse(startup['requests_loaded'])
+        self.assertFalse(startup['cuffdiff_built'])
+
+    def test_status_builds_no_runner(self):
+        impl = kb_cufflinks(dict(self.cfg))
+        result = impl.status(self.ctx)[0]
+        self.assertEqual(result['state'], 'OK')
+        self.assertIsNone(impl.cuffdiff_runner)
+
+    def test_cufflinks_utils_clients_are_lazy(self):
+        cfg = dict(self.cfg)
+        cfg['SDK_CALLBACK_URL'] = environ.get('SDK_CALLBACK_URL')
+        cfg['KB_AUTH_TOKEN'] = environ.get('KB_AUTH_TOKEN')
+        cufflinks_runner = CufflinksUtils(cfg)
+        self.assertEqual(cufflinks_runner.clients.created(), [])
+        self.assertFalse(os.path.exists(cufflinks_runner.scratch))
+
+        cufflinks_runner.ws
+        self.assertEqual(cufflinks_runner.clients.created(), ['ws'])
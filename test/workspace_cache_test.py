@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import shutil
+import tempfile
+
+from kb_cufflinks.core.workspace_cache import CachingWorkspace
+
+
+class RecordingWorkspace(object):
+    """
+    Workspace stand-in holding one object per versioned ref
+    """
+
+    def __init__(self, objects, latest):
+        self.objects = objects
+        self.latest = latest
+        self.calls = list()
+
+    def _upa(self, ref):
+        ref = ref.split(';')[-1]
+        return self.latest.get(ref, ref)
+
+    def get_objects2(self, params):
+        self.calls.append(('get_objects2', [spec['ref'] for spec in params['objects']]))
+        data = list()
+        for spec in params['objects']:
+            obj = self.objects[self._upa(spec['ref'])]
+            if spec.get('included'):
+                obj = dict(obj, data=dict((k, obj['data'][k]) for k in spec['included']))
+            data.append(obj)
+        return {'data': data}
+
+    def get_object_info3(self, params):
+        self.calls.append(('get_object_info3', [spec['ref'] for spec in params['objects']]))
+        return {'infos': [self.objects[self._upa(spec['ref'])]['info']
+                          for spec in params['objects']]}
+
+    def ver(self):
+        return '0.8.0'
+
+
+def info(wsid, objid, ver):
+    return [objid, 'obj_{}'.format(objid), 'KBaseRNASeq.RNASeqAlignment-1.0', '', ver, 'u',
+            wsid, 'ws', '', 0, {}]
+
+
+class CachingWorkspaceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.workspace = RecordingWorkspace(
+            {'1/2/3': {'info': info(1, 2, 3), 'data': {'condition': 'WT', 'genome_id': 'g'}},
+             '1/4/1': {'info': info(1, 4, 1), 'data': {'condition': 'hy5', 'genome_id': 'g'}}},
+            {'ws/obj_2': '1/2/3'})
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def test_versioned_refs(self):
+        ws = CachingWorkspace(self.workspace, self.scratch)
+        first = ws.get_objects2({'objects': [{'ref': '1/2/3'}, {'ref': '1/4/1'}]})['data']
+        self.assertEqual(len(self.workspace.calls), 1)
+
+        # whole objects are reused by later clients, for subsets too
+        ws = CachingWorkspace(self.workspace, self.scratch)
+        self.assertEqual(ws.get_objects2({'objects': [{'ref': '1/2/3'}]})['data'], first[:1])
+        self.assertEqual(ws.get_object_subset([{'ref': '1/4/1', 'included': ['condition']}]),
+                         [{'info': info(1, 4, 1), 'data': {'condition': 'hy5'}}])
+        self.assertEqual(len(self.workspace.calls), 1)
+        self.assertEqual(ws.stats()['hits'], 2)
+
+        self.assertEqual(ws.ver(), '0.8.0')
+
+    def test_unversioned_refs_resolve_once(self):
+        ws = CachingWorkspace(self.workspace, self.scratch)
+        for i in range(3):
+            data = ws.get_objects2({'objects': [{'ref': 'ws/obj_2',
+                                                 'included': ['condition']}]})['data']
+            self.assertEqual(data[0]['data'], {'condition': 'WT'})
+        self.assertEqual(self.workspace.calls, [('get_object_info3', ['ws/obj_2']),
+                                                ('get_objects2', ['ws/obj_2'])])
+        self.assertEqual(ws.stats(), {'hits': 2, 'misses': 1, 'resolved_refs': 1})
+
+    def test_size_bound(self):
+        # objects over a tenth of the bound are not cached
+        ws = CachingWorkspace(self.workspace, self.scratch, max_size=100)
+        ws.get_objects2({'objects': [{'ref': '1/2/3'}]})
+        self.assertEqual(self._cached(), [])
+
+        ws = CachingWorkspace(self.workspace, self.scratch, max_size=100000)
+        ws.get_objects2({'objects': [{'ref': '1/2/3'}]})
+        first = self._cached()
+        os.utime(first[0], (0, 0))
+        ws.get_objects2({'objects': [{'ref': '1/4/1'}]})
+        self.assertEqual(len(self._cached()), 2)
+
+        # the least recently read file goes first
+        ws.max_size = sum(os.path.getsize(path) for path in self._cached()) - 1
+        ws._evict()
+        self.assertEqual(len(self._cached()), 1)
+        self.assertNotIn(first[0], self._cached())
+
+    def test_cache_per_token(self):
+        ws = CachingWorkspace(self.workspace, self.scratch, token='token_a')
+        ws.get_objects2({'objects': [{'ref': '1/2/3'}]})
+        CachingWorkspace(self.workspace, self.scratch, token='token_a').get_objects2(
+            {'objects': [{'ref': '1/2/3'}]})
+        self.assertEqual(len(self.workspace.calls), 1)
+
+        # another token asks the workspace, which checks its access
+        CachingWorkspace(self.workspace, self.scratch, token='token_b').get_objects2(
+            {'objects': [{'ref': '1/2/3'}]})
+        self.assertEqual(len(self.workspace.calls), 2)
+
+    def test_ref_paths_not_cached(self):
+        ws = CachingWorkspace(self.workspace, self.scratch)
+        ws.get_objects2({'objects': [{'ref': '1/2/3'}]})
+        for i in range(2):
+            data = ws.get_objects2({'objects': [{'ref': '1/4/1;1/2/3'}]})['data']
+            self.assertEqual(data[0]['info'], info(1, 2, 3))
+        self.assertEqual(self.workspace.calls, [('get_objects2', ['1/2/3'])] +
+                         [('get_objects2', ['1/4/1;1/2/3'])] * 2)
+
+    def test_evict_only_over_bound(self):
+        ws = CachingWorkspace(self.workspace, self.scratch, max_size=100000)
+        scans = list()
+        evict = ws._evict
+
+        def counting_evict():
+            scans.append(1)
+            evict()
+        ws._evict = counting_evict
+
+        ws.get_objects2({'objects': [{'ref': '1/2/3'}]})
+        ws.get_objects2({'objects': [{'ref': '1/4/1'}]})
+        # the first write scans the cache, later ones keep a running total
+        self.assertEqual(len(scans), 1)
+        self.assertEqual(ws.total_size, sum(os.path.getsize(path) for path in self._cached()))
+
+        # another process filled the cache up to the bound
+        ws.total_size = ws.max_size
+        self.workspace.objects['1/5/1'] = {'info': info(1, 5, 1), 'data': {'condition': 'WT'}}
+        ws.get_objects2({'objects': [{'ref': '1/5/1'}]})
+        self.assertEqual(len(scans), 2)
+        self.assertEqual(ws.total_size, sum(os.path.getsize(path) for path in self._cached()))
+
+    def _cached(self):
+        return [os.path.join(root, name) for root, dirs, files in os.walk(self.scratch)
+                for name in files]